@@ -1,12 +1,55 @@
 import logging
 
 from django.contrib import admin, messages
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from .models import Book, Comment, Genres
+from .models import (Book, BookImageRendition, Comment, Genres, LikedComment,
+                     OutboxEmail)
+from .pagination import EstimatedCountPaginator
+from .publishing import set_books_status
 
 logger = logging.getLogger(__name__)
 
 
+class BookImageRenditionInline(admin.TabularInline):
+    """
+    Read-only list of the resized renditions of a book image (they are built automatically).
+    """
+    model = BookImageRendition
+    fields = ['kind', 'format', 'image', 'width', 'height']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class GenreListFilter(admin.SimpleListFilter):
+    """
+    Filter of books by genre, listing the genres from their own table
+    (a filter on `genres__genre` reads the distinct names of all book genres on every page load).
+    """
+    title = 'genre'
+    parameter_name = 'genre'
+
+    def lookups(self, request, model_admin):
+        """
+        Returns the slug and name of every genre.
+        """
+        return Genres.objects.order_by('genre').values_list('slug', 'genre')
+
+    def queryset(self, request, queryset):
+        """
+        Returns the books of the selected genre.
+        """
+        if self.value():
+            return queryset.filter(genres__slug=self.value())
+        return queryset
+
+
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     """
@@ -18,11 +61,39 @@ class BookAdmin(admin.ModelAdmin):
     ordering = ['-time_create', 'title']
     actions = ['set_published', 'set_draft']
     search_fields = ['title', 'genres__genre']
-    list_filter = ['genres__genre', 'is_published']
+    list_filter = [GenreListFilter, 'is_published']
     filter_horizontal = ['genres']
+    inlines = [BookImageRenditionInline]
     list_per_page = 10
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     save_on_top = True
 
+    def get_queryset(self, request):
+        """
+        Returns books with the author joined, the genre names prefetched for the whole page
+        and the number of genres of each book annotated (used to sort the genres column).
+        """
+        genres_count = (Book.genres.through.objects
+                        .filter(book_id=OuterRef('pk'))
+                        .order_by()
+                        .values('book_id')
+                        .annotate(total=Count('pk'))
+                        .values('total'))
+        return (super().get_queryset(request)
+                .select_related('author')
+                .prefetch_related(Prefetch('genres', queryset=Genres.objects.only('id', 'genre').order_by('genre')))
+                .annotate(genres_count=Coalesce(Subquery(genres_count), 0)))
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches books through the same full-text index as the public search page.
+        """
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
+    @admin.display(description='Genres', ordering='genres_count')
     def get_genres(self, obj):
         """
         Returns a comma-separated string of genres for the book.
@@ -35,18 +106,18 @@ class BookAdmin(admin.ModelAdmin):
         """
         Custom admin action to mark selected books as published.
         """
-        count = queryset.update(is_published=Book.Status.PUBLISHED)
+        count = set_books_status(queryset, Book.Status.PUBLISHED)
         self.message_user(request, f'Change {count} entries.')
-        logger.info(f"Admin {request.user} published {count} books.")
+        logger.info("Admin %s published %s books.", request.user, count)
 
     @admin.action(description='Unpublish selected Books')
     def set_draft(self, request, queryset):
         """
         Custom admin action to mark selected books as draft (unpublished).
         """
-        count = queryset.update(is_published=Book.Status.DRAFT)
+        count = set_books_status(queryset, Book.Status.DRAFT)
         self.message_user(request, f'{count} books withdrawn from publication.', messages.WARNING)
-        logger.info(f"Admin {request.user} unpublished {count} books.")
+        logger.info("Admin %s unpublished %s books.", request.user, count)
 
 
 @admin.register(Genres)
@@ -62,7 +133,49 @@ class CommentAdmin(admin.ModelAdmin):
     """
     Admin interface for the Comment model.
     """
-    pass
+    list_display = ['id', 'book', 'author', 'created_at', 'likes_count']
+    list_select_related = ['book', 'author']
+    readonly_fields = ['likes_count']
+
+
+@admin.register(LikedComment)
+class LikedCommentAdmin(admin.ModelAdmin):
+    """
+    Read-only admin interface for comment likes.
+    Likes are only changed through Comment.toggle_like so that the stored counters stay correct.
+    """
+    list_display = ['id', 'comment', 'user', 'created_at']
+    list_select_related = ['comment__author', 'user']
+    raw_id_fields = ['comment', 'user']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """
+    Admin interface for the email outbox, with an action to retry failed emails.
+    """
+    list_display = ['id', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+    search_fields = ['subject']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+    list_per_page = 20
 
+    @admin.action(description='Retry selected emails now')
+    def retry_now(self, request, queryset):
+        """
+        Custom admin action to queue the selected unsent emails for the next send.
+        """
+        count = queryset.exclude(status=OutboxEmail.Status.SENT).update(
+            status=OutboxEmail.Status.PENDING, attempts=0, next_attempt_at=timezone.now())
+        self.message_user(request, f'{count} emails queued for sending.')
+        logger.info("Admin %s queued %s outbox emails for retry.", request.user, count)
@@ -0,0 +1,450 @@
+"""
+JSON API for books, genres and comments.
+
+Responses are built from `values()` rows into plain dicts, never from model instances:
+
+- lists are cursor-paginated (`?cursor=`, `?limit=` up to `MAX_LIMIT`) and return
+  `{"results": [...], "next": url, "previous": url}`;
+- `?fields=id,title` returns only the given fields (sparse fieldsets) and only those
+  columns are read;
+- `?include=genres,renditions` embeds related resources, with one query per include
+  for the whole page.
+
+Writes use the session of the logged-in user (send the CSRF token in the `X-CSRFToken`
+header) and are validated by the same forms as the HTML pages.
+"""
+import json
+import logging
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, JsonResponse
+from django.urls import reverse
+from django.views import View
+
+from books.forms import AddBookForm, CommentCreateForm
+from books.models import (Book, BookImageRendition, Comment, Genres,
+                          LikedComment)
+from books.pagination import CursorPaginator
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class ApiError(Exception):
+    """
+    Error returned to the client as `{"detail": message}` with the given status.
+    """
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.errors = errors
+
+
+def _image_url(name):
+    return default_storage.url(name) if name else None
+
+
+def _book_url(slug):
+    return reverse('book', kwargs={'book_slug': slug})
+
+
+def _split(value):
+    return [item for item in (value or '').split(',') if item]
+
+
+class ValuesSerializer:
+    """
+    Serializer building plain dicts from `values()` rows.
+    `fields` maps every output field to the lookup it is read from, or to a `(lookup, convert)` pair.
+    `default_fields` are returned when the request has no `?fields=` (all fields when None).
+    `embeds` are the names accepted by `?include=`; each one is added by the `embed_<name>` method
+    to a whole page of rows at once.
+    """
+    fields = {}
+    default_fields = None
+    embeds = ()
+    # Lookups always read (the primary key for the embeds, the cursor ordering)
+    required_lookups = ('id',)
+
+    def __init__(self, request, default_fields=None):
+        self.request = request
+        self.selected = self._parse('fields', self.fields) or list(default_fields or self.default_fields or self.fields)
+        self.includes = self._parse('include', self.embeds)
+
+    def _parse(self, parameter, allowed):
+        names = _split(self.request.GET.get(parameter))
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ApiError(400, f"Unknown {parameter}: {', '.join(unknown)}. Available: {', '.join(allowed)}.")
+        return list(dict.fromkeys(names))
+
+    def _lookup(self, name):
+        spec = self.fields[name]
+        return spec if isinstance(spec, str) else spec[0]
+
+    def lookups(self):
+        """
+        Returns the `values()` lookups needed for the selected fields.
+        """
+        return list(dict.fromkeys([*self.required_lookups, *(self._lookup(name) for name in self.selected)]))
+
+    def values(self, queryset):
+        """
+        Returns the queryset reading only the needed columns as dicts.
+        """
+        return queryset.values(*self.lookups())
+
+    def serialize(self, rows):
+        """
+        Returns the output dicts of a page of rows, with the requested embeds.
+        """
+        items = []
+        for row in rows:
+            item = {}
+            for name in self.selected:
+                spec = self.fields[name]
+                item[name] = row[spec] if isinstance(spec, str) else spec[1](row[spec[0]])
+            items.append(item)
+        ids = [row['id'] for row in rows]
+        for name in self.includes:
+            getattr(self, f'embed_{name}')(ids, items)
+        return items
+
+
+class BookSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'slug': 'slug',
+        'url': ('slug', _book_url),
+        'title': 'title',
+        'excerpt': 'excerpt',
+        'description': 'description',
+        'is_published': ('is_published', bool),
+        'author': 'author__username',
+        'image': ('image', _image_url),
+        'time_create': 'time_create',
+        'update_time': 'update_time',
+    }
+    # Lists show the excerpt, the full description has to be asked for
+    list_fields = [name for name in fields if name != 'description']
+    embeds = ('genres', 'renditions')
+    required_lookups = ('id', 'time_create')
+
+    def embed_genres(self, ids, items):
+        genres = defaultdict(list)
+        links = (Book.genres.through.objects
+                 .filter(book_id__in=ids)
+                 .order_by('genres__genre')
+                 .values_list('book_id', 'genres__slug', 'genres__genre'))
+        for book_id, slug, genre in links:
+            genres[book_id].append({'slug': slug, 'genre': genre})
+        for book_id, item in zip(ids, items):
+            item['genres'] = genres[book_id]
+
+    def embed_renditions(self, ids, items):
+        renditions = defaultdict(list)
+        rows = (BookImageRendition.objects
+                .filter(book_id__in=ids)
+                .order_by('kind', 'format')
+                .values_list('book_id', 'kind', 'format', 'image', 'width', 'height'))
+        for book_id, kind, image_format, image, width, height in rows:
+            renditions[book_id].append({'kind': kind, 'format': image_format, 'url': _image_url(image),
+                                        'width': width, 'height': height})
+        for book_id, item in zip(ids, items):
+            item['renditions'] = renditions[book_id]
+
+
+class GenreSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'slug': 'slug',
+        'genre': 'genre',
+        'books_count': 'books_count',
+    }
+    required_lookups = ('id', 'genre')
+
+
+class CommentSerializer(ValuesSerializer):
+    fields = {
+        'id': 'id',
+        'content': 'content',
+        'author': 'author__username',
+        'parent': 'parent_comment_id',
+        'thread': 'thread_id',
+        'depth': 'depth',
+        'likes_count': 'likes_count',
+        'created_at': 'created_at',
+        'updated_at': 'updated_at',
+    }
+    embeds = ('liked',)
+    required_lookups = ('id', 'created_at')
+
+    def embed_liked(self, ids, items):
+        liked = set()
+        if self.request.user.is_authenticated:
+            liked = set(LikedComment.objects
+                        .filter(comment_id__in=ids, user_id=self.request.user.pk)
+                        .values_list('comment_id', flat=True))
+        for comment_id, item in zip(ids, items):
+            item['liked'] = comment_id in liked
+
+
+class ApiBookForm(AddBookForm):
+    """
+    Book form of the API: genres are given by slug and images are not uploaded through JSON.
+    """
+    genres = forms.ModelMultipleChoiceField(queryset=Genres.objects.all(), to_field_name='slug', required=False)
+
+    class Meta(AddBookForm.Meta):
+        fields = ['title', 'description', 'is_published', 'genres']
+
+    def __init__(self, data=None, *args, **kwargs):
+        if data is not None and isinstance(data.get('is_published'), bool):
+            # The status choices are 1/0, JSON clients send true/false
+            data = dict(data, is_published=int(data['is_published']))
+        super().__init__(data, *args, **kwargs)
+
+
+class ApiView(View):
+    """
+    Base view of the API: errors are returned as JSON and request bodies are parsed as JSON.
+    """
+    serializer_class = None
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            data = {'detail': error.message}
+            if error.errors is not None:
+                data['errors'] = error.errors
+            return JsonResponse(data, status=error.status)
+        except Http404:
+            return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        response = super().http_method_not_allowed(request, *args, **kwargs)
+        return JsonResponse({'detail': f'Method {request.method} not allowed.'}, status=405,
+                            headers={'Allow': response['Allow']})
+
+    def get_serializer(self, **kwargs):
+        return self.serializer_class(self.request, **kwargs)
+
+    def require_user(self):
+        if not self.request.user.is_authenticated:
+            raise ApiError(401, 'Authentication required.')
+        return self.request.user
+
+    def json_body(self):
+        """
+        Returns the JSON object sent in the request body.
+        """
+        try:
+            data = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise ApiError(400, 'The request body is not valid JSON.')
+        if not isinstance(data, dict):
+            raise ApiError(400, 'The request body must be a JSON object.')
+        return data
+
+    def validate(self, form):
+        if not form.is_valid():
+            raise ApiError(400, 'Invalid data.', errors=form.errors.get_json_data())
+        return form
+
+    def paginated_response(self, queryset, ordering):
+        """
+        Returns a page of the serialized queryset with the URLs of the neighbouring pages.
+        """
+        try:
+            limit = min(max(int(self.request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            raise ApiError(400, 'limit must be a number.')
+        serializer = self.get_serializer()
+        paginator = CursorPaginator(serializer.values(queryset), limit, ordering)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return JsonResponse({
+            'results': serializer.serialize(page.object_list),
+            'next': self.page_url(page.next_cursor),
+            'previous': self.page_url(page.previous_cursor),
+        })
+
+    def page_url(self, cursor):
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query['cursor'] = cursor
+        return f'{self.request.path}?{urlencode(query, doseq=True)}'
+
+
+class BookAccessMixin:
+    """
+    Loads the book of the URL: published books for everyone, drafts only for their author.
+    """
+    def get_book(self, for_update=False):
+        books = Book.objects.filter(slug=self.kwargs['book_slug'])
+        if not for_update:
+            books = books.only('id', 'slug', 'is_published', 'author_id')
+        book = books.first()
+        if book is None or (book.is_published != Book.Status.PUBLISHED and not self.is_author(book)):
+            raise Http404
+        if for_update and not self.is_author(book):
+            self.require_user()
+            raise ApiError(403, 'Only the author can change this book.')
+        return book
+
+    def is_author(self, book):
+        return book.author_id is not None and book.author_id == self.request.user.pk
+
+    def book_response(self, slug, status=200):
+        serializer = self.get_serializer()
+        rows = serializer.values(Book.objects.filter(slug=slug))
+        return JsonResponse(serializer.serialize(rows)[0], status=status)
+
+
+class BookListApi(BookAccessMixin, ApiView):
+    """
+    GET: published books, newest first (`?genre=`, `?author=`, `?mine=1` for all own books).
+    POST: adds a book of the current user.
+    """
+    serializer_class = BookSerializer
+
+    def get_serializer(self, **kwargs):
+        return super().get_serializer(default_fields=BookSerializer.list_fields, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('mine'):
+            books = Book.objects.filter(author=self.require_user())
+        else:
+            books = Book.published.all()
+        if request.GET.get('genre'):
+            books = books.filter(genres__slug=request.GET['genre'])
+        if request.GET.get('author'):
+            books = books.filter(author__username=request.GET['author'])
+        return self.paginated_response(books, ('-time_create', '-id'))
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        data = self.json_body()
+        data.setdefault('is_published', Book.Status.PUBLISHED)
+        form = self.validate(ApiBookForm(data))
+        book = form.save(commit=False)
+        book.author = user
+        book.save()
+        form.save_m2m()
+        logger.info("Book '%s' added through the API by user %s", book.title, user)
+        response = self.book_response(book.slug, status=201)
+        response['Location'] = reverse('api:book', kwargs={'book_slug': book.slug})
+        return response
+
+
+class BookApi(BookAccessMixin, ApiView):
+    """
+    GET: a book. PATCH: changes the given fields (author only). DELETE: deletes it (author only).
+    """
+    serializer_class = BookSerializer
+
+    def get(self, request, *args, **kwargs):
+        return self.book_response(self.get_book().slug)
+
+    def patch(self, request, *args, **kwargs):
+        book = self.get_book(for_update=True)
+        data = {
+            'title': book.title,
+            'description': book.description,
+            'is_published': int(book.is_published),
+            'genres': list(book.genres.values_list('slug', flat=True)),
+        }
+        data.update(self.json_body())
+        form = self.validate(ApiBookForm(data, instance=book))
+        book = form.save()
+        logger.info("Book '%s' changed through the API by user %s", book.title, request.user)
+        return self.book_response(book.slug)
+
+    def delete(self, request, *args, **kwargs):
+        book = self.get_book(for_update=True)
+        book.delete()
+        logger.info("Book '%s' deleted through the API by user %s", book.title, request.user)
+        return HttpResponse(status=204)
+
+
+class GenreListApi(ApiView):
+    """
+    GET: all genres by name, with the number of published books.
+    """
+    serializer_class = GenreSerializer
+
+    def get(self, request, *args, **kwargs):
+        return self.paginated_response(Genres.objects.all(), ('genre', 'id'))
+
+
+class CommentListApi(BookAccessMixin, ApiView):
+    """
+    GET: comments of a book, newest first. POST: adds a comment (`content`, optional `parent` id).
+    """
+    serializer_class = CommentSerializer
+
+    def get(self, request, *args, **kwargs):
+        book = self.get_book()
+        return self.paginated_response(Comment.objects.filter(book=book), ('-created_at', '-id'))
+
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        book = self.get_book()
+        data = self.json_body()
+        form = self.validate(CommentCreateForm(data))
+        comment = form.save(commit=False)
+        if data.get('parent') is not None:
+            parent = None
+            if isinstance(data['parent'], int):
+                parent = Comment.objects.filter(pk=data['parent'], book=book).first()
+            if parent is None:
+                raise ApiError(400, 'Invalid data.', errors={'parent': [{'message': 'Unknown comment.',
+                                                                           'code': 'invalid'}]})
+            try:
+                comment.reply_to(parent)
+            except ValidationError as error:
+                raise ApiError(400, 'Invalid data.', errors={'parent': [{'message': error.message,
+                                                                           'code': error.code}]})
+        comment.book = book
+        comment.author = user
+        comment.save()
+        serializer = self.get_serializer()
+        return JsonResponse(serializer.serialize(serializer.values(Comment.objects.filter(pk=comment.pk)))[0],
+                            status=201)
+
+
+class CommentApi(ApiView):
+    """
+    DELETE: deletes a comment (its author or staff).
+    """
+    def delete(self, request, *args, **kwargs):
+        user = self.require_user()
+        comment = Comment.objects.filter(pk=kwargs['comment_id']).only('id', 'author_id').first()
+        if comment is None:
+            raise Http404
+        if comment.author_id != user.pk and not user.is_staff:
+            raise ApiError(403, 'Only the author can delete this comment.')
+        logger.info("Comment (id=%s) deleted through the API by user %s", comment.id, user)
+        comment.delete()
+        return HttpResponse(status=204)
+
+
+class CommentLikeApi(ApiView):
+    """
+    POST: likes the comment, or removes the like of the current user.
+    """
+    def post(self, request, *args, **kwargs):
+        user = self.require_user()
+        comment = Comment.objects.filter(pk=kwargs['comment_id']).only('id').first()
+        if comment is None:
+            raise Http404
+        liked, likes_count = comment.toggle_like(user)
+        return JsonResponse({'liked': liked, 'likes_count': likes_count})
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import api
+
+app_name = 'api'
+
+urlpatterns = [
+    path('books/', api.BookListApi.as_view(), name='books'),
+    path('books/<slug:book_slug>/', api.BookApi.as_view(), name='book'),
+    path('books/<slug:book_slug>/comments/', api.CommentListApi.as_view(), name='comments'),
+    path('comments/<int:comment_id>/', api.CommentApi.as_view(), name='comment'),
+    path('comments/<int:comment_id>/like/', api.CommentLikeApi.as_view(), name='like_comment'),
+    path('genres/', api.GenreListApi.as_view(), name='genres'),
+]
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class BooksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'books'
+
+    def ready(self):
+        from books import checks, signals  # noqa: F401
+        from books.profiling import install_query_recorder
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,214 @@
+"""
+Async versions of the busiest views, routed instead of the synchronous ones when
+`ASYNC_VIEWS` is on and the site is served by an ASGI server (see `gunicorn.conf.py`).
+
+They read the database through Django's async ORM interface, so a worker keeps serving
+other requests while their queries run. Steps that are synchronous by nature run in a
+thread: toggling a like (a transaction), the page cache and the template rendering
+(Django renders template responses in a thread under ASGI). Comments are still posted
+through the synchronous view. The pages, cache keys and ETags are the same as those of
+the views in `books.views`, so both modes can serve the same cache.
+
+`Feedback` has no async version: it only stores the message in the outbox, so it no longer
+waits for the mail server.
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import Count, Max, aprefetch_related_objects
+from django.http import Http404, JsonResponse
+from django.template.response import TemplateResponse
+from django.views import View
+
+from books import views
+from books.caching import (BOOKS, GENRES, TAGS, abooks_watermark,
+                           genre_namespace, get_cached_page, get_versions,
+                           not_modified_response, page_cache_key, page_etag,
+                           set_validators, store_page)
+from books.forms import CommentCreateForm
+from books.models import Book, Comment, Genres
+from books.pagination import CursorPaginator, ThreadPaginator
+from books.utils import DataMixin, navbar
+
+logger = logging.getLogger(__name__)
+
+
+async def get_user(request):
+    """
+    Returns the user of the request, loaded without blocking, and keeps it as `request.user`
+    so that templates and helpers don't load it again.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+class AsyncDetailedBookInfo(View):
+    """
+    Async version of `DetailedBookInfo`: the book page with a page of its comment threads.
+    """
+    template_name = 'books/book_info.html'
+    comments_per_page = 5
+
+    async def get(self, request, book_slug):
+        """
+        Returns the book page, or 304 if the client's copy is current.
+        """
+        user = await get_user(request)
+        book = await Book.objects.select_related('author').filter(slug=book_slug).afirst()
+        if book is None:
+            raise Http404('No book found')
+        if book.is_published != Book.Status.PUBLISHED and (book.author_id is None or book.author_id != user.pk):
+            logger.warning("Unauthorized access attempt to unpublished book '%s' by user %s", book.title, user)
+            raise Http404('Access denied')
+
+        comments = await book.comments.aaggregate(latest=Max('updated_at'), total=Count('id'))
+        versions = await sync_to_async(get_versions)(GENRES)
+        state = (book.pk, book.update_time, comments['latest'], comments['total'], versions)
+        last_modified = max(time for time in (book.update_time, comments['latest']) if time)
+        etag = page_etag(request, views.DetailedBookInfo.__name__, state)
+
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            await aprefetch_related_objects([book], 'genres', 'renditions')
+            paginator = ThreadPaginator(book.comments.for_listing(user), per_page=self.comments_per_page,
+                                        ordering=('-created_at', '-id'))
+            context = {
+                'view': self,
+                'object': book,
+                'book': book,
+                'form': CommentCreateForm(),
+                'comments_page': await paginator.apage(request.GET.get('cursor')),
+                'paginator': paginator,
+                'comments_count': comments['total'],
+                'navbar': navbar,
+                'title': book.title,
+            }
+            response = TemplateResponse(request, self.template_name, context)
+        return set_validators(request, response, etag, last_modified)
+
+    async def post(self, request, *args, **kwargs):
+        """
+        Posts a comment through the synchronous view.
+        """
+        return await sync_to_async(views.DetailedBookInfo.as_view())(request, *args, **kwargs)
+
+
+class AsyncBookListView(View):
+    """
+    Base of the async pages listing published books (cursor-paginated, cached for anonymous
+    visitors). `sync_view` is the synchronous view whose cache entries and ETags are shared.
+    """
+    template_name = 'books/books.html'
+    sync_view = None
+
+    def get_cache_namespaces(self):
+        raise NotImplementedError
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def get_watermarked_books(self):
+        return Book.published.all()
+
+    async def get_title(self):
+        raise NotImplementedError
+
+    async def get(self, request, **kwargs):
+        """
+        Returns 304, the cached page (anonymous visitors) or a freshly rendered page.
+        """
+        user = await get_user(request)
+        namespaces = self.get_cache_namespaces()
+        view_name = self.sync_view.__name__
+        state = (await abooks_watermark(self.get_watermarked_books()),
+                 await sync_to_async(get_versions)(*namespaces))
+        etag = page_etag(request, view_name, state)
+
+        response = not_modified_response(request, etag)
+        if response is None:
+            key = None
+            if not user.is_authenticated:
+                key = await sync_to_async(page_cache_key)(request, view_name, namespaces, state)
+                response = await sync_to_async(get_cached_page)(key)
+            if response is None:
+                response = await self.render_page(request)
+                if key:
+                    store_page(key, response)
+        return set_validators(request, response, etag)
+
+    async def render_page(self, request):
+        """
+        Returns the response rendering a page of books.
+        """
+        title = await self.get_title()
+        paginator = CursorPaginator(self.get_queryset(), DataMixin.paginate_by, DataMixin.cursor_ordering)
+        page = await paginator.apage(request.GET.get('cursor'))
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'object_list': page.object_list,
+            'books': page.object_list,
+            'navbar': navbar,
+            'title': title,
+        }
+        return TemplateResponse(request, self.template_name, context)
+
+
+class AsyncAllPublishedBooks(AsyncBookListView):
+    """
+    Async version of `AllPublishedBooks`.
+    """
+    sync_view = views.AllPublishedBooks
+
+    def get_cache_namespaces(self):
+        return BOOKS, TAGS
+
+    def get_queryset(self):
+        return Book.published.for_listing()
+
+    async def get_title(self):
+        return views.AllPublishedBooks.page_title
+
+
+class AsyncBookGenres(AsyncBookListView):
+    """
+    Async version of `BookGenres`.
+    """
+    sync_view = views.BookGenres
+
+    def get_cache_namespaces(self):
+        return genre_namespace(self.kwargs['tag_slug']), TAGS
+
+    def get_queryset(self):
+        return Book.published.filter(genres__slug=self.kwargs['tag_slug']).for_listing()
+
+    def get_watermarked_books(self):
+        return Book.published.filter(genres__slug=self.kwargs['tag_slug'])
+
+    async def get_title(self):
+        genre = await Genres.objects.filter(slug=self.kwargs['tag_slug']).values_list('genre', flat=True).afirst()
+        if genre is None:
+            raise Http404('No genre found')
+        return 'Genre: ' + genre
+
+
+class AsyncLikeCommentView(View):
+    """
+    Async version of `LikeCommentView`.
+    """
+    async def post(self, request, comment_id):
+        """
+        Likes or unlikes the comment and returns the new state as JSON.
+        """
+        user = await get_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        comment = await Comment.objects.only('id').filter(pk=comment_id).afirst()
+        if comment is None:
+            raise Http404('No comment found')
+        liked, likes_count = await sync_to_async(comment.toggle_like)(user)
+        return JsonResponse({'liked': liked, 'likes_count': likes_count})
@@ -0,0 +1,353 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks never touch the configured database: they run against a temporary
+test database that is created (and migrated) on start and destroyed at the end.
+
+The route benchmark (`bench_routes`) requests every named route of `books.urls` and
+`users.urls` as an anonymous and as an authenticated user and records the number of
+queries, the latency percentiles and the response size of each one. The results are
+compared with `BASELINE_PATH`, so a new N+1 query fails the benchmark (and the
+query-count test in books/tests.py).
+"""
+import json
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from books.models import Book, Comment, Genres, LikedComment
+from books.popularity import refresh_popularity
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'benchmark_baseline.json'
+
+ROLES = ('anonymous', 'authenticated')
+
+# Transaction control statements differ between databases and test/non-test runs,
+# they are not counted as queries
+TRANSACTION_STATEMENTS = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT', 'COMMIT', 'ROLLBACK')
+
+
+@contextmanager
+def temporary_database(keepdb=False):
+    """
+    Creates a migrated test database, switches the default connection to it and destroys it afterwards.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+
+
+def timed(func, repeat):
+    """
+    Calls `func` `repeat` times and returns the list of durations in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def percentile(values, percent):
+    """
+    Returns the given percentile (0-100) of the values.
+    """
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def seed_books(count, author=None, chunk_size=10000, stdout=None):
+    """
+    Inserts `count` published books with bulk_create. Every chunk gets its own creation time
+    (older chunks first) so that the rows are spread over the time_create index.
+    Returns the author of the books.
+    """
+    if author is None:
+        author, _ = get_user_model().objects.get_or_create(username='benchmark')
+    start = Book.objects.count()
+    now = timezone.now()
+    for offset in range(0, count, chunk_size):
+        size = min(chunk_size, count - offset)
+        books = [Book(title=f'Benchmark book {start + offset + i}',
+                      slug=f'benchmark-book-{start + offset + i}',
+                      description='Benchmark description',
+                      is_published=Book.Status.PUBLISHED,
+                      author=author)
+                 for i in range(size)]
+        created = Book.objects.bulk_create(books, batch_size=chunk_size)
+        if created and created[0].pk is not None:
+            ids = [book.pk for book in created]
+        else:
+            ids = list(Book.objects.order_by('-id').values_list('id', flat=True)[:size])
+        Book.objects.filter(pk__in=ids).update(time_create=now - timedelta(minutes=(count - offset) // chunk_size))
+        if stdout:
+            stdout.write(f'  seeded {offset + size}/{count} books')
+    return author
+
+
+def seed_site(users=100, books=5000, genres=30, comments=20000, likes=50000, stdout=None, seed=0):
+    """
+    Fills the database with synthetic users, genres, books, comments and likes using bulk inserts.
+    Returns the objects the route benchmark requests (see `benchmark_data`).
+    """
+    rnd = random.Random(seed)
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com'})
+    User.objects.bulk_create([User(username=f'benchmark-user-{i}', password='!',
+                                   email=f'benchmark-user-{i}@example.com')
+                              for i in range(users)])
+    others = list(User.objects.filter(username__startswith='benchmark-user-'))
+    authors = [user] + others
+
+    Genres.objects.bulk_create([Genres(genre=f'Genre {i}', slug=f'benchmark-genre-{i}') for i in range(genres)])
+    genre_ids = list(Genres.objects.filter(slug__startswith='benchmark-genre-').values_list('pk', flat=True))
+
+    start = Book.objects.count()
+    now = timezone.now()
+    Book.objects.bulk_create([Book(title=f'Benchmark book {start + i}',
+                                   slug=f'benchmark-book-{start + i}',
+                                   description=f'Benchmark description {i} ' * 20,
+                                   is_published=Book.Status.PUBLISHED if i % 10 else Book.Status.DRAFT,
+                                   author=authors[i % len(authors)])
+                              for i in range(books)], batch_size=1000)
+    book_ids = list(Book.objects.filter(slug__startswith='benchmark-book-').values_list('pk', flat=True))
+    # Spread the books over time, newest last
+    for offset in range(0, len(book_ids), 1000):
+        chunk = book_ids[offset:offset + 1000]
+        Book.objects.filter(pk__in=chunk).update(time_create=now - timedelta(minutes=len(book_ids) - offset))
+    if stdout:
+        stdout.write(f'  seeded {len(authors)} users, {len(genre_ids)} genres, {len(book_ids)} books')
+
+    Through = Book.genres.through
+    Through.objects.bulk_create([Through(book_id=book_id, genres_id=genre_id)
+                                 for book_id in book_ids
+                                 for genre_id in rnd.sample(genre_ids, min(len(genre_ids), rnd.randint(1, 3)))],
+                                batch_size=5000, ignore_conflicts=True)
+
+    book = Book.objects.filter(author=user, is_published=Book.Status.PUBLISHED).latest('time_create')
+    # The benchmarked book always has several pages of comments
+    commented = [book.pk] * max(20, comments // 20) + [rnd.choice(book_ids) for _ in range(comments)]
+    Comment.objects.bulk_create([Comment(book_id=book_id, author=rnd.choice(authors), content=f'Comment {i}')
+                                 for i, book_id in enumerate(commented)], batch_size=5000)
+    comment_ids = list(Comment.objects.values_list('pk', flat=True))
+    # The benchmark user never likes a comment, so toggling a like always starts with a like
+    LikedComment.objects.bulk_create([LikedComment(user=rnd.choice(others), comment_id=rnd.choice(comment_ids))
+                                      for _ in range(likes)] if others else [],
+                                     batch_size=5000, ignore_conflicts=True)
+    if stdout:
+        stdout.write(f'  seeded {len(comment_ids)} comments, {LikedComment.objects.count()} likes')
+
+    Comment.objects.rebuild_likes_count()
+    Genres.objects.refresh_books_count()
+    Book.objects.update_search_vector()
+    Book.objects.update_excerpts()
+    refresh_popularity(full=True)
+    Book.objects.create(title='Benchmark scratch', slug='benchmark-scratch', author=user,
+                        is_published=Book.Status.DRAFT)
+    return benchmark_data()
+
+
+def benchmark_data():
+    """
+    Returns the seeded objects requested by the route benchmark: the benchmark user, their
+    newest published book (with one of its genres and comments) and a draft book for
+    throwaway comments. Returns None if the site is not seeded.
+    """
+    user = get_user_model().objects.filter(username='benchmark').first()
+    scratch = Book.objects.filter(slug='benchmark-scratch').first()
+    if user is None or scratch is None:
+        return None
+    book = Book.objects.filter(author=user, is_published=Book.Status.PUBLISHED).latest('time_create')
+    return {
+        'user': user,
+        'book': book,
+        'genre': book.genres.order_by('pk').first(),
+        'comment': book.comments.latest('created_at'),
+        'scratch_book': scratch,
+    }
+
+
+def _scratch_comment(data):
+    comment = Comment.objects.create(book=data['scratch_book'], author=data['user'], content='Benchmark')
+    return comment.pk
+
+
+def _book_slug(data):
+    return {'book_slug': data['book'].slug}
+
+
+def _genre_slug(data):
+    return {'tag_slug': data['genre'].slug}
+
+
+def _password_reset_token(data):
+    return {'uidb64': urlsafe_base64_encode(force_bytes(data['user'].pk)),
+            'token': default_token_generator.make_token(data['user'])}
+
+
+# The request made for every named route. `kwargs` builds the URL arguments (outside the
+# measured time), `query` holds GET parameters (the form data of POST requests).
+# Unsafe routes are only requested when repeating them leaves the data unchanged (likes
+# toggle, deleted and replied comments are throwaway ones, book deletion only shows the
+# confirmation page).
+ROUTES = {
+    'home': {},
+    'add_book': {},
+    'feedback': {},
+    'feedback_success': {},
+    'books': {},
+    'popular_books': {},
+    'search': {'query': {'q': 'benchmark book'}},
+    'user_books': {},
+    'user_books_by_tag': {'kwargs': _genre_slug},
+    'book': {'kwargs': _book_slug},
+    'delete_comment': {'method': 'post', 'kwargs': lambda data: {'comment_id': _scratch_comment(data)}},
+    'reply_comment': {'method': 'post', 'kwargs': lambda data: {'comment_id': _scratch_comment(data)},
+                      'query': {'content': 'Benchmark reply'}},
+    'like_comment': {'method': 'post', 'kwargs': lambda data: {'comment_id': data['comment'].pk}},
+    'edit_book': {'kwargs': _book_slug},
+    'edit_success': {},
+    'delete_book': {'kwargs': _book_slug},
+    'tag': {'kwargs': _genre_slug},
+    'users:login': {},
+    'users:logout': {'method': 'post'},
+    'users:register': {},
+    'users:register_success': {},
+    'users:password_change': {},
+    'users:password_change_done': {},
+    'users:password_reset': {},
+    'users:password_reset_done': {},
+    'users:password_reset_confirm': {'kwargs': _password_reset_token},
+    'users:password_reset_complete': {},
+    'users:profile': {},
+    'api:books': {'query': {'include': 'renditions'}},
+    'api:book': {'kwargs': _book_slug, 'query': {'include': 'genres,renditions'}},
+    'api:comments': {'kwargs': _book_slug, 'query': {'include': 'liked'}},
+    'api:comment': {'method': 'delete', 'kwargs': lambda data: {'comment_id': _scratch_comment(data)}},
+    'api:like_comment': {'method': 'post', 'kwargs': lambda data: {'comment_id': data['comment'].pk}},
+    'api:genres': {},
+}
+
+
+def named_routes():
+    """
+    Returns the names of all routes of `books.urls`, `books.api_urls` and `users.urls`.
+    """
+    from books import api_urls
+    from books import urls as books_urls
+    from users import urls as users_urls
+
+    names = [pattern.name for pattern in books_urls.urlpatterns
+             if isinstance(pattern, URLPattern) and pattern.name]
+    for urls in (users_urls, api_urls):
+        names += [f'{urls.app_name}:{pattern.name}' for pattern in urls.urlpatterns
+                  if isinstance(pattern, URLPattern) and pattern.name]
+    return names
+
+
+def count_queries(captured):
+    """
+    Returns the number of queries in a CaptureQueriesContext, without transaction control statements.
+    """
+    return sum(1 for query in captured.captured_queries
+               if not query['sql'].upper().startswith(TRANSACTION_STATEMENTS))
+
+
+def measure_routes(data, repeat=20, roles=ROLES, routes=None):
+    """
+    Requests every route `repeat + 1` times per role. The first request runs with an empty
+    cache and gives the query count, status and size; the others give the latency.
+    Returns {'<role>:<route>': {'status', 'queries', 'p50_ms', 'p95_ms', 'bytes'}}.
+    """
+    routes = routes or ROUTES
+    client = Client()
+    results = {}
+    for role in roles:
+        for name, spec in routes.items():
+            method = getattr(client, spec.get('method', 'get'))
+            durations = []
+            for attempt in range(repeat + 1):
+                if attempt == 0:
+                    cache.clear()
+                if role == 'authenticated':
+                    client.force_login(data['user'])
+                else:
+                    client.logout()
+                url = reverse(name, kwargs=spec['kwargs'](data) if 'kwargs' in spec else None)
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    response = method(url, spec.get('query', {}))
+                    elapsed = (time.perf_counter() - start) * 1000
+                if attempt == 0:
+                    result = {'status': response.status_code, 'queries': count_queries(captured),
+                              'bytes': len(response.content)}
+                else:
+                    durations.append(elapsed)
+            if durations:
+                result['p50_ms'] = round(percentile(durations, 50), 2)
+                result['p95_ms'] = round(percentile(durations, 95), 2)
+            results[f'{role}:{name}'] = result
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    """
+    Returns the stored baseline results ({} when there is no baseline yet).
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def save_baseline(results, scale, path=BASELINE_PATH):
+    """
+    Stores the results as the new baseline.
+    """
+    baseline = {'database': connection.vendor, 'scale': scale, 'routes': results}
+    Path(path).write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+
+
+def compare_with_baseline(results, baseline, size_tolerance=0.1, latency_tolerance=None):
+    """
+    Returns a description of every result that is worse than the baseline:
+    more queries, a different status, a response more than `size_tolerance` larger or
+    (when `latency_tolerance` is given) a p95 latency more than `latency_tolerance` slower.
+    Pass `size_tolerance=None` to skip the size check.
+    """
+    expected_routes = baseline.get('routes', {})
+    regressions = []
+    for key, result in sorted(results.items()):
+        expected = expected_routes.get(key)
+        if expected is None:
+            regressions.append(f'{key}: not in the baseline')
+            continue
+        if result['status'] != expected['status']:
+            regressions.append(f"{key}: status {result['status']} (baseline {expected['status']})")
+        if result['queries'] > expected['queries']:
+            regressions.append(f"{key}: {result['queries']} queries (baseline {expected['queries']})")
+        if size_tolerance is not None and result['bytes'] > expected['bytes'] * (1 + size_tolerance):
+            regressions.append(f"{key}: {result['bytes']} bytes (baseline {expected['bytes']})")
+        if (latency_tolerance is not None and 'p95_ms' in result and 'p95_ms' in expected
+                and result['p95_ms'] > expected['p95_ms'] * (1 + latency_tolerance)):
+            regressions.append(f"{key}: p95 {result['p95_ms']} ms (baseline {expected['p95_ms']} ms)")
+    return regressions
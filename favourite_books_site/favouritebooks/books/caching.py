@@ -0,0 +1,382 @@
+"""
+Caching of public book pages and of the genre (tag) lists.
+
+Cached data is grouped into namespaces (all books, a single genre, the genre cloud, ...).
+Every namespace has a version number stored in the cache and the version is part of
+each key, so invalidating a namespace is a single `incr` and never requires
+scanning keys. Versions (like the cached data) live in the cache, so every process that
+serves pages or changes data (web workers, management commands) must use the same cache:
+Redis (`REDIS_URL`). The local-memory cache is private to a process and only suits a
+single-process development server; `check --deploy` warns about it.
+
+The browser's and the CDN's copies are validated by `ConditionalGetMixin`, which answers
+revalidation requests with 304 Not Modified. Its page state starts with a watermark of the
+listed books read from the database (latest `update_time` and number of books), so a change
+saved by any process moves the ETag even if its invalidation never reaches this process;
+the versions only add what the watermark cannot see (e.g. renamed genres). Cached pages are
+stored under the same state.
+"""
+import hashlib
+import logging
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+
+from books.models import Genres
+from books.profiling import note_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+# Pages listing all published books (and the home page)
+BOOKS = 'books'
+# Pages that show the genre cloud: changes when a genre appears in or leaves the cloud
+TAGS = 'tags'
+# The genre cloud data itself, including the per-genre book counts
+GENRE_CLOUD = 'genre-cloud'
+# Genre names and slugs, used by the per-user genre lists
+GENRES = 'genres'
+# Pages showing the popularity ranking (home page, popular books)
+POPULAR = 'popular'
+
+STATS_HITS_KEY = 'books:page-cache:hits'
+STATS_MISSES_KEY = 'books:page-cache:misses'
+
+
+def is_shared_cache():
+    """
+    Returns True if the default cache is shared by all processes (not the per-process
+    local-memory or dummy cache).
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], (LocMemCache, DummyCache))
+
+
+def genre_namespace(slug):
+    """
+    Returns the namespace of the cached pages of a single genre.
+    """
+    return f'genre:{slug}'
+
+
+def user_namespace(user_id):
+    """
+    Returns the namespace of the cached data of a single user (e.g. the genres of their books).
+    """
+    return f'user:{user_id}'
+
+
+def books_watermark(books):
+    """
+    Returns (time of the last change, number) of the books of the queryset. An edited or
+    published book moves the time, a deleted or unpublished one lowers the number.
+    """
+    books = books.aggregate(latest=Max('update_time'), total=Count('id'))
+    return books['latest'], books['total']
+
+
+async def abooks_watermark(books):
+    """
+    Async version of `books_watermark`.
+    """
+    books = await books.aaggregate(latest=Max('update_time'), total=Count('id'))
+    return books['latest'], books['total']
+
+
+def _version_key(namespace):
+    return f'books:page-cache:version:{namespace}'
+
+
+def get_versions(*namespaces):
+    """
+    Returns the current version of every namespace, creating missing versions.
+    A missing version starts from the current time so an evicted counter never
+    reuses a version that still has pages stored under it.
+    """
+    keys = [_version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*namespaces):
+    """
+    Moves the given namespaces to a new version, which invalidates all of their pages.
+    """
+    for namespace in set(namespaces):
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_namespaces(*namespaces):
+    """
+    Invalidates the cached data of the given namespaces now and once more after the
+    current transaction commits, so data read before the commit cannot stay in the cache.
+    """
+    if not namespaces:
+        return
+    bump_versions(*namespaces)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump_versions(*namespaces))
+    logger.debug("Invalidated cache namespaces: %s", namespaces)
+
+
+def _versioned_key(prefix, *namespaces):
+    versions = '.'.join(str(version) for version in get_versions(*namespaces))
+    return f"{prefix}:{versions}"
+
+
+def get_genre_cloud():
+    """
+    Returns the genres that have at least one published book, with `books_count` set.
+    The list is read from the cache and only rebuilt after the counts change.
+    """
+    key = _versioned_key('books:genre-cloud', GENRE_CLOUD)
+    tags = cache.get(key)
+    note_cache_lookup(tags is not None)
+    if tags is None:
+        tags = list(Genres.objects.filter(books_count__gt=0).only('genre', 'slug', 'books_count'))
+        cache.set(key, tags, settings.PAGE_CACHE_TIMEOUT)
+    return tags
+
+
+def get_user_genres(user):
+    """
+    Returns the genres of the user's books (published or not) with `user_books_count` set.
+    The list is cached per user until that user's books or their genres change.
+    """
+    key = _versioned_key(f'books:user-genres:{user.pk}', user_namespace(user.pk), GENRES)
+    tags = cache.get(key)
+    note_cache_lookup(tags is not None)
+    if tags is None:
+        tags = list(Genres.objects
+                    .filter(genres__author=user)
+                    .annotate(user_books_count=Count('genres'))
+                    .only('genre', 'slug')
+                    .order_by('genre'))
+        cache.set(key, tags, settings.PAGE_CACHE_TIMEOUT)
+    return tags
+
+
+def get_request_user_genres(request):
+    """
+    Returns `get_user_genres` of the request's user, looked up once per request even when
+    both the view and the sidebar tag need it.
+    """
+    if not hasattr(request, '_user_genres'):
+        request._user_genres = get_user_genres(request.user)
+    return request._user_genres
+
+
+def refresh_genre_counts(genre_ids):
+    """
+    Recalculates the published book counts of the given genres and invalidates the
+    genre cloud data if a count changed, and the pages showing the cloud if a genre
+    appeared in it or left it.
+    """
+    genre_ids = set(genre_ids)
+    if not genre_ids:
+        return
+    genres = Genres.objects.filter(pk__in=genre_ids)
+    before = dict(genres.values_list('pk', 'books_count'))
+    genres.refresh_books_count()
+    after = dict(genres.values_list('pk', 'books_count'))
+    if before != after:
+        namespaces = [GENRE_CLOUD]
+        if {pk for pk, total in before.items() if total} != {pk for pk, total in after.items() if total}:
+            namespaces.append(TAGS)
+        invalidate_namespaces(*namespaces)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_cache_stats():
+    """
+    Returns the number of cache hits and misses of the anonymous page cache.
+    """
+    stats = cache.get_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+    return {'hits': stats.get(STATS_HITS_KEY, 0), 'misses': stats.get(STATS_MISSES_KEY, 0)}
+
+
+def reset_cache_stats():
+    """
+    Resets the hit and miss counters.
+    """
+    cache.delete_many([STATS_HITS_KEY, STATS_MISSES_KEY])
+
+
+def page_cache_key(request, view_name, namespaces, state=None):
+    """
+    Returns the cache key of a page: view, namespace versions, query string (page number or
+    cursor, and the other parameters kept by the pagination links) and the page state of the
+    conditional GET (so a page is never served from the cache after a change that moved the
+    database watermark).
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    page = hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()
+    key = _versioned_key(f"books:page:{view_name}:{':'.join(namespaces)}:{page}", *namespaces)
+    if state is not None:
+        key = f"{key}:{hashlib.md5(repr(state).encode(), usedforsecurity=False).hexdigest()}"
+    return key
+
+
+def get_cached_page(key):
+    """
+    Returns the cached response stored under the key (or None) and counts the hit or miss.
+    """
+    cached = cache.get(key)
+    note_cache_lookup(cached is not None)
+    if cached is None:
+        _count(STATS_MISSES_KEY)
+        return None
+    _count(STATS_HITS_KEY)
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def store_page(key, response):
+    """
+    Stores a successful response in the cache (once it is rendered, for template responses).
+    """
+    if response.status_code != 200:
+        return
+    def store(rendered):
+        cache.set(key, (rendered.content, rendered['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+    if hasattr(response, 'add_post_render_callback'):
+        response.add_post_render_callback(store)
+    else:
+        store(response)
+
+
+class AnonymousCacheMixin:
+    """
+    Mixin that caches the rendered GET response of a view for anonymous visitors.
+    Logged-in users are always served a freshly rendered page.
+    """
+    cache_namespaces = (BOOKS,)
+
+    def get_cache_namespaces(self):
+        """
+        Returns the namespaces whose invalidation must drop this page.
+        """
+        return self.cache_namespaces
+
+    def get_cache_key(self):
+        """
+        Returns the cache key of the page: view, namespace versions, page number or cursor
+        and the page state computed by `ConditionalGetMixin` (when the view uses it).
+        """
+        return page_cache_key(self.request, self.__class__.__name__, self.get_cache_namespaces(),
+                              getattr(self, 'page_state', None))
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Serves anonymous GET requests from the cache and stores successful responses.
+        """
+        if request.method != 'GET' or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self.get_cache_key()
+        cached = get_cached_page(key)
+        if cached is not None:
+            return cached
+        response = super().dispatch(request, *args, **kwargs)
+        store_page(key, response)
+        return response
+
+
+def page_etag(request, view_name, state):
+    """
+    Returns the weak ETag of a page in the given state for the current user.
+    """
+    source = repr((view_name, request.user.pk, request.get_full_path(), settings.PAGE_ETAG_SALT, state))
+    return f'W/"{hashlib.md5(source.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def not_modified_response(request, etag, last_modified=None):
+    """
+    Returns 304 Not Modified if the client's copy matches the ETag (or modification time), otherwise None.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(request, response, etag, last_modified=None):
+    """
+    Adds the validators and the caching headers of a conditional page to the response.
+    """
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(int(last_modified.timestamp()))
+    patch_vary_headers(response, ['Cookie'])
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Mixin that answers a GET request with 304 Not Modified, without running the view or
+    rendering the template, when the client's copy of the page is still current.
+    `get_page_state` returns cheap values that change whenever the page does; the weak ETag
+    hashes them with the user, the full path and `PAGE_ETAG_SALT`, and `Vary: Cookie` keeps
+    shared caches from serving the page of one user to another.
+    """
+    def get_watermarked_books(self):
+        """
+        Returns the queryset of the books the page lists (None if it lists no books).
+        """
+        return None
+
+    def get_page_state(self):
+        """
+        Returns the values the page depends on and the time of its last change (or None).
+        By default these are the watermark of `get_watermarked_books` and the versions of the
+        page cache namespaces of the view.
+        """
+        if not hasattr(self, 'get_cache_namespaces'):
+            return None, None
+        books = self.get_watermarked_books()
+        watermark = books_watermark(books) if books is not None else None
+        return (watermark, get_versions(*self.get_cache_namespaces())), None
+
+    def dispatch(self, request, *args, **kwargs):
+        """
+        Returns 304 if the client's ETag (or modification time) matches the page state,
+        otherwise renders the page and adds the validators to the response.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        state, last_modified = self.get_page_state()
+        self.page_state = state
+        if state is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        etag = page_etag(request, self.__class__.__name__, state)
+        response = not_modified_response(request, etag, last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        return set_validators(request, response, etag, last_modified)
@@ -0,0 +1,22 @@
+"""
+System checks of the settings the books app relies on in production (`check --deploy`).
+"""
+from django.core.checks import Tags, Warning, register
+
+from books.caching import is_shared_cache
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Warns when the cache is private to each process: invalidations made by one web worker or
+    by a management command would not reach the pages cached by the other processes.
+    """
+    if is_shared_cache():
+        return []
+    return [Warning(
+        'The default cache is private to each process.',
+        hint='Set REDIS_URL so that all web workers and management commands share the page cache, '
+             'its versions and the profiling statistics.',
+        id='books.W001',
+    )]
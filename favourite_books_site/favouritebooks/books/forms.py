@@ -36,9 +36,9 @@ class AddBookForm(forms.ModelForm):
         title = self.cleaned_data['title']
         title_length = 100
         if len(title) > title_length:
-            logger.warning(f"Book title too long: '{title}' (length={len(title)})")
+            logger.warning("Book title too long: '%s' (length=%s)", title, len(title))
             raise ValidationError(f'The length of the Book name cannot exceed {title_length} characters')
-        logger.info(f"Validated book title: '{title}'")
+        logger.debug("Validated book title: '%s'", title)
         return title
 
 
@@ -78,5 +78,5 @@ class CommentCreateForm(forms.ModelForm):
         comment = super(CommentCreateForm, self).save(commit=False)
         if commit:
             comment.save()
-            logger.info(f"Comment saved via form by user {comment.author}")
+            logger.info("Comment saved via form by user id=%s", comment.author_id)
         return comment
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Background processing of uploaded book images.
+
+Uploaded originals are stored as sent. After the transaction that saved the book
+commits, the image is resized into the renditions listed in `RENDITION_WIDTHS`
+(each one in WebP and JPEG) by a small in-process thread pool, so the request that
+uploaded the image never waits for Pillow. Set `IMAGE_RENDITIONS_SYNC = True` to
+process images in the calling thread instead (tests, management commands), and use
+`python manage.py build_renditions` to (re)build missing renditions from a separate process.
+
+Templates use the renditions through the `book_image` tag and fall back to the
+original image until the renditions of the current file exist.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from books.caching import BOOKS, genre_namespace, invalidate_namespaces
+from books.models import Book, BookImageRendition
+
+logger = logging.getLogger(__name__)
+
+# Maximum width (px) of every rendition kind; smaller originals are never upscaled
+RENDITION_WIDTHS = {
+    BookImageRendition.Kind.THUMB: 480,
+    BookImageRendition.Kind.DETAIL: 1200,
+}
+
+# Pillow save options of every rendition format
+FORMAT_OPTIONS = {
+    BookImageRendition.Format.WEBP: {'format': 'WEBP', 'quality': 80, 'method': 4},
+    BookImageRendition.Format.JPEG: {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.IMAGE_RENDITION_WORKERS,
+                                       thread_name_prefix='book-images')
+    return _executor
+
+
+def _resize(image, width):
+    """
+    Returns the image scaled down to the given width, keeping the aspect ratio.
+    """
+    if image.width <= width:
+        return image.copy()
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def _encode(image, image_format):
+    """
+    Returns the image encoded in the given rendition format.
+    """
+    if image_format == BookImageRendition.Format.JPEG and image.mode != 'RGB':
+        # JPEG has no alpha channel: put transparent images on a white background
+        background = Image.new('RGB', image.size, 'white')
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    buffer = BytesIO()
+    image.save(buffer, **FORMAT_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def build_renditions(book_id):
+    """
+    Creates all renditions of the current image of a book, replacing older ones.
+    Returns the number of created renditions.
+    """
+    book = Book.objects.filter(pk=book_id).only('id', 'image', 'is_published').first()
+    if book is None or not book.image:
+        return 0
+    source = book.image.name
+
+    with book.image.open('rb') as original:
+        with Image.open(original) as image:
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    basename = os.path.splitext(os.path.basename(source))[0]
+    files = []
+    for kind, width in RENDITION_WIDTHS.items():
+        resized = _resize(image, width)
+        for image_format in FORMAT_OPTIONS:
+            content = _encode(resized, image_format)
+            files.append((kind, image_format, ContentFile(content, name=f'{basename}-{kind}.{image_format}')))
+
+    # Names of the rendition files written to storage, removed again if the transaction fails
+    written = []
+    try:
+        with transaction.atomic():
+            # The image may have been replaced while it was being resized
+            book = Book.objects.select_for_update().filter(pk=book_id, image=source).first()
+            if book is None:
+                return 0
+            for rendition in book.renditions.all():
+                rendition.delete()
+            for kind, image_format, content in files:
+                rendition = BookImageRendition(book=book, kind=kind, format=image_format, source=source)
+                rendition.image.save(content.name, content, save=False)
+                written.append(rendition.image.name)
+                rendition.save()
+            # The pages of the book show the new renditions
+            Book.objects.filter(pk=book_id).update(update_time=timezone.now())
+            if book.is_published == Book.Status.PUBLISHED:
+                slugs = book.genres.values_list('slug', flat=True)
+                invalidate_namespaces(BOOKS, *[genre_namespace(slug) for slug in slugs])
+    except Exception:
+        # No rolled back row points to these files any more
+        storage = BookImageRendition._meta.get_field('image').storage
+        for name in written:
+            storage.delete(name)
+        raise
+    logger.info("Built %s image renditions for book id=%s", len(files), book_id)
+    return len(files)
+
+
+def _build_in_worker(book_id):
+    try:
+        build_renditions(book_id)
+    except Exception:
+        logger.exception("Failed to build image renditions for book id=%s", book_id)
+    finally:
+        # Worker threads open their own database connections
+        connections.close_all()
+
+
+def schedule_renditions(book_id):
+    """
+    Builds the renditions of a book image once the current transaction commits,
+    in the background thread pool (or right away with `IMAGE_RENDITIONS_SYNC`).
+    """
+    if settings.IMAGE_RENDITIONS_SYNC:
+        transaction.on_commit(lambda: build_renditions(book_id))
+    else:
+        transaction.on_commit(lambda: _get_executor().submit(_build_in_worker, book_id))
@@ -0,0 +1,76 @@
+"""
+Logging helpers used by `LOGGING` in settings.py.
+
+Request threads only put log records on an in-memory queue (`QueueListenerHandler`); a
+`QueueListener` thread passes them to the handlers that do the I/O, so a slow console,
+file or log shipper never delays a request. The message is merged with its arguments on
+the calling thread (the arguments may be mutable objects), which is why log calls pass
+%-style arguments instead of f-strings: nothing is formatted for disabled levels.
+`JsonFormatter` writes every record as one JSON line with the fields passed in `extra`.
+"""
+import copy
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.config import ConvertingList
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes of every LogRecord, anything else was passed with `extra`
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object with time, level, logger, message and extra fields.
+    """
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        data.update((key, value) for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Queue handler that starts a listener thread passing the records to `handlers`,
+    given in LOGGING as references such as 'cfg://handlers.console'.
+    """
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__(queue.SimpleQueue())
+        if isinstance(handlers, ConvertingList):
+            # Indexing resolves the cfg:// references to the configured handlers
+            handlers = [handlers[index] for index in range(len(handlers))]
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=respect_handler_level)
+        self.listener.start()
+        self._stopped = False
+
+    def prepare(self, record):
+        """
+        Merges the message with its arguments and renders the traceback into `exc_text`,
+        so the listener gets a self-contained record and the traceback stays a separate field.
+        """
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def close(self):
+        """
+        Writes out the queued records and stops the listener (called by logging.shutdown at exit).
+        """
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+        super().close()
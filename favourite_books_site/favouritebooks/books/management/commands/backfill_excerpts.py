@@ -0,0 +1,25 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to recalculate the stored description excerpts of books.
+    """
+    help = 'Recalculate the stored description excerpt of every book (e.g. after bulk updates of descriptions)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Books updated per query')
+
+    def handle(self, *args, **options):
+        """
+        Recalculates `Book.excerpt` from the descriptions and stores the changed ones.
+        """
+        updated = Book.objects.update_excerpts(batch_size=options['batch_size'])
+        logger.info("Backfilled excerpt for %s books", updated)
+        self.stdout.write(self.style.SUCCESS(f'Updated the excerpt of {updated} books.'))
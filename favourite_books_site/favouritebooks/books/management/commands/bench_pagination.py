@@ -0,0 +1,63 @@
+import statistics
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+
+from books.benchmarks import seed_books, temporary_database, timed
+from books.models import Book
+from books.pagination import CursorPaginator
+
+
+class Command(BaseCommand):
+    """
+    Management command comparing offset and cursor (keyset) pagination of the book list.
+    Runs against a temporary test database.
+    """
+    help = 'Benchmark offset vs cursor pagination of published books on a temporary database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='Number of books to seed')
+        parser.add_argument('--per-page', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=5, help='Measurements per page depth')
+        parser.add_argument('--depths', type=int, nargs='*', default=[1, 10, 100, 1000, 10000, 100000],
+                            help='Page numbers to measure (the last page is always added)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep and reuse the seeded database')
+
+    def handle(self, *args, **options):
+        with temporary_database(keepdb=options['keepdb']):
+            missing = options['rows'] - Book.objects.count()
+            if missing > 0:
+                self.stdout.write(f'Seeding {missing} books...')
+                seed_books(missing, stdout=self.stdout)
+            self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        """
+        Measures the time to fetch the same page with both paginators.
+        """
+        per_page = options['per_page']
+        queryset = Book.published.all()
+        total = queryset.count()
+        last_page = max(1, (total + per_page - 1) // per_page)
+        depths = sorted({depth for depth in options['depths'] if depth <= last_page} | {last_page})
+
+        self.stdout.write(f'{total} published books, {per_page} per page\n')
+        self.stdout.write(f"{'page':>10} {'offset, ms':>12} {'cursor, ms':>12} {'speedup':>9}")
+        for depth in depths:
+            def offset_page():
+                list(Paginator(queryset.order_by('-time_create', '-id'), per_page).page(depth).object_list)
+
+            cursor_paginator = CursorPaginator(queryset, per_page)
+            cursor = None
+            if depth > 1:
+                position = (depth - 1) * per_page - 1
+                time_create, pk = queryset.order_by('-time_create', '-id').values_list('time_create', 'id')[position]
+                cursor = cursor_paginator.encode_cursor(Book(pk=pk, time_create=time_create))
+
+            def cursor_page():
+                list(CursorPaginator(queryset, per_page).page(cursor))
+
+            offset_ms = statistics.median(timed(offset_page, options['repeat']))
+            cursor_ms = statistics.median(timed(cursor_page, options['repeat']))
+            speedup = offset_ms / cursor_ms if cursor_ms else 0
+            self.stdout.write(f'{depth:>10} {offset_ms:>12.2f} {cursor_ms:>12.2f} {speedup:>8.1f}x')
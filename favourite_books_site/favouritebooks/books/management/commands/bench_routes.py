@@ -0,0 +1,90 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from books.benchmarks import (BASELINE_PATH, ROUTES, benchmark_data,
+                              compare_with_baseline, load_baseline,
+                              measure_routes, named_routes, save_baseline,
+                              seed_site, temporary_database)
+
+
+class Command(BaseCommand):
+    """
+    Management command measuring queries, latency and response size of every named route.
+    Runs against a temporary test database and fails when the results exceed the baseline.
+    """
+    help = 'Benchmark every route of books/users as anonymous and authenticated user and compare with the baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Number of users to seed')
+        parser.add_argument('--books', type=int, default=5000, help='Number of books to seed')
+        parser.add_argument('--genres', type=int, default=30, help='Number of genres to seed')
+        parser.add_argument('--comments', type=int, default=20000, help='Number of comments to seed')
+        parser.add_argument('--likes', type=int, default=50000, help='Number of comment likes to seed')
+        parser.add_argument('--repeat', type=int, default=20, help='Measured requests per route and role')
+        parser.add_argument('--routes', nargs='*', help='Only benchmark these route names')
+        parser.add_argument('--baseline', default=str(BASELINE_PATH), help='Baseline JSON file')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Store the results as the new baseline instead of comparing')
+        parser.add_argument('--size-tolerance', type=float, default=0.1,
+                            help='Allowed relative growth of the response size')
+        parser.add_argument('--latency-tolerance', type=float, default=None,
+                            help='Also fail when p95 latency grows by more than this ratio '
+                                 '(only meaningful on the machine that recorded the baseline)')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--keepdb', action='store_true', help='Keep and reuse the seeded database')
+
+    def handle(self, *args, **options):
+        """
+        Seeds the temporary database, measures the routes and compares the results with the baseline.
+        """
+        missing = set(named_routes()) - set(ROUTES)
+        if missing:
+            raise CommandError(f"No benchmark request defined for: {', '.join(sorted(missing))} "
+                               f"(add them to books.benchmarks.ROUTES)")
+        routes = ROUTES
+        if options['routes']:
+            routes = {name: ROUTES[name] for name in options['routes']}
+        scale = {name: options[name] for name in ('users', 'books', 'genres', 'comments', 'likes')}
+
+        setup_test_environment()
+        try:
+            with temporary_database(keepdb=options['keepdb']):
+                data = benchmark_data()
+                if data is None:
+                    self.stdout.write('Seeding...')
+                    data = seed_site(**scale, stdout=self.stdout)
+                results = measure_routes(data, repeat=options['repeat'], routes=routes)
+        finally:
+            teardown_test_environment()
+
+        self.print_results(results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        if options['update_baseline']:
+            save_baseline(results, scale, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {options['baseline']}."))
+            return
+
+        baseline = load_baseline(options['baseline'])
+        if not baseline:
+            raise CommandError(f"No baseline at {options['baseline']}, run with --update-baseline first.")
+        regressions = compare_with_baseline(results, baseline,
+                                            size_tolerance=options['size_tolerance'],
+                                            latency_tolerance=options['latency_tolerance'])
+        if regressions:
+            raise CommandError('Benchmark exceeds the baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('All routes are within the baseline.'))
+
+    def print_results(self, results):
+        """
+        Prints one line per route and role.
+        """
+        self.stdout.write(f"{'route':<45} {'status':>6} {'queries':>8} {'p50, ms':>9} {'p95, ms':>9} {'KB':>8}")
+        for key, result in results.items():
+            self.stdout.write(f"{key:<45} {result['status']:>6} {result['queries']:>8} "
+                              f"{result.get('p50_ms', 0):>9.2f} {result.get('p95_ms', 0):>9.2f} "
+                              f"{result['bytes'] / 1024:>8.1f}")
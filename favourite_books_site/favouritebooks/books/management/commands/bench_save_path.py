@@ -0,0 +1,95 @@
+import logging
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from books.benchmarks import count_queries, percentile, temporary_database, timed
+from books.log import JsonFormatter, QueueListenerHandler
+from books.models import Book, Comment, Genres
+
+MODES = ('disabled', 'file', 'queue')
+
+
+class SlowFileHandler(logging.FileHandler):
+    """
+    File handler waiting `delay` seconds per record, like a blocked pipe or a remote log sink.
+    """
+    def __init__(self, path, delay):
+        super().__init__(path)
+        self.delay = delay
+
+    def emit(self, record):
+        if self.delay:
+            time.sleep(self.delay)
+        super().emit(record)
+
+
+@contextmanager
+def books_logging(mode, path, delay=0):
+    """
+    Sends the `books` loggers to a JSON log file, directly ('file') or through the queue
+    handler ('queue'), or disables their INFO messages ('disabled').
+    """
+    logger = logging.getLogger('books')
+    saved = logger.handlers[:], logger.level, logger.propagate
+    file_handler = SlowFileHandler(path, delay)
+    file_handler.setFormatter(JsonFormatter())
+    handler = QueueListenerHandler([file_handler]) if mode == 'queue' else file_handler
+    logger.handlers = [handler]
+    logger.setLevel(logging.WARNING if mode == 'disabled' else logging.INFO)
+    logger.propagate = False
+    try:
+        yield
+    finally:
+        logger.handlers, level, logger.propagate = saved
+        logger.setLevel(level)
+        handler.close()
+        file_handler.close()
+
+
+class Command(BaseCommand):
+    """
+    Management command measuring what logging adds to the save path of books, genres and comments.
+    Runs against a temporary test database.
+    """
+    help = 'Time Book, Genre and Comment saves with logging disabled, written to a file and written through the queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=500, help='Saves per operation and mode')
+        parser.add_argument('--modes', nargs='*', choices=MODES, default=list(MODES))
+        parser.add_argument('--sink-delay-ms', type=float, default=0,
+                            help='Time the log file takes to write a record, to model a slow log sink')
+
+    def handle(self, *args, **options):
+        """
+        Prints the median and p95 duration and the queries of every save for every logging mode.
+        """
+        with temporary_database(), tempfile.TemporaryDirectory() as directory:
+            user = get_user_model().objects.create_user(username='bench-saver', password='bench-pass')
+            genre = Genres.objects.create(genre='Bench genre')
+            book = Book.objects.create(title='Bench book', description='Description ' * 50,
+                                       is_published=1, author=user)
+            book.genres.add(genre)
+            # Saved as in the views: the comment only knows the ids of its book and author
+            operations = {
+                'book.save': book.save,
+                'genre.save': genre.save,
+                'comment.create': lambda: Comment(book_id=book.pk, author_id=user.pk, content='Comment').save(),
+            }
+
+            self.stdout.write(f"{'operation':<16} {'logging':<10} {'queries':>8} {'p50, µs':>9} {'p95, µs':>9}")
+            for name, operation in operations.items():
+                for mode in options['modes']:
+                    with books_logging(mode, Path(directory) / f'{mode}.log', options['sink_delay_ms'] / 1000):
+                        with CaptureQueriesContext(connection) as captured:
+                            operation()
+                        durations = [ms * 1000 for ms in timed(operation, options['repeat'])]
+                    self.stdout.write(f"{name:<16} {mode:<10} {count_queries(captured):>8} "
+                                      f"{statistics.median(durations):>9.0f} {percentile(durations, 95):>9.0f}")
@@ -0,0 +1,39 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from books.images import FORMAT_OPTIONS, RENDITION_WIDTHS, build_renditions
+from books.models import Book
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to build the resized renditions of book images.
+    """
+    help = 'Build missing or outdated book image renditions (use --all to rebuild every image)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild the renditions of every book image, not only the missing ones')
+
+    def handle(self, *args, **options):
+        """
+        Builds the renditions of every book whose current image has no complete set of renditions.
+        """
+        books = Book.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            expected = len(RENDITION_WIDTHS) * len(FORMAT_OPTIONS)
+            books = books.annotate(
+                current=Count('renditions', filter=Q(renditions__source=F('image')))
+            ).exclude(current=expected)
+        built = 0
+        for book_id in books.values_list('pk', flat=True).iterator():
+            try:
+                built += build_renditions(book_id)
+            except Exception:
+                logger.exception("Failed to build image renditions for book id=%s", book_id)
+                self.stderr.write(self.style.ERROR(f'Failed to build renditions for book id={book_id}.'))
+        self.stdout.write(self.style.SUCCESS(f'Built {built} image renditions.'))
@@ -0,0 +1,44 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.models import Book
+from books.transfer import FORMATS, detect_format, export_rows, open_text, write_rows
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to dump books to a JSON Lines or CSV file.
+    """
+    help = 'Export books to a JSON Lines or CSV file (use - for stdout, .gz files are compressed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write')
+        parser.add_argument('--format', choices=FORMATS, help='File format (detected from the extension by default)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Books read per query')
+        parser.add_argument('--published', action='store_true', help='Only export published books')
+
+    def handle(self, *args, **options):
+        """
+        Streams the books into the file and reports the throughput.
+        """
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot detect the file format, use --format.')
+        queryset = Book.published.all() if options['published'] else Book.objects.all()
+
+        started = time.perf_counter()
+        try:
+            with open_text(options['path'], 'w') as file:
+                written = write_rows(export_rows(queryset, chunk_size=options['chunk_size']), file, file_format)
+        except OSError as error:
+            raise CommandError(error)
+        seconds = time.perf_counter() - started
+
+        logger.info("Exported %s books to %s in %.1fs", written, options['path'], seconds)
+        if options['path'] != '-':
+            rate = written / seconds if seconds else 0
+            self.stdout.write(self.style.SUCCESS(f'Exported {written} books in {seconds:.1f}s ({rate:.0f} rows/s).'))
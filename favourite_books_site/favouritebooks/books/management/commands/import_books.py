@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from books.transfer import FORMATS, BookImporter, detect_format, open_text, read_rows
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to create books in bulk from a JSON Lines or CSV file.
+    """
+    help = 'Import books from a JSON Lines or CSV file (use - for stdin, .gz files are decompressed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=FORMATS, help='File format (detected from the extension by default)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Books inserted per query')
+        parser.add_argument('--images-dir', help='Directory the image paths of the rows are relative to')
+        parser.add_argument('--author', help='Username of the author of rows without one')
+        parser.add_argument('--create-genres', action='store_true',
+                            help='Create genres for unknown genre slugs instead of ignoring them')
+        parser.add_argument('--progress-interval', type=float, default=5,
+                            help='Seconds between progress reports')
+
+    def handle(self, *args, **options):
+        """
+        Streams the file through the importer and reports the throughput.
+        """
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Cannot detect the file format, use --format.')
+        if options['author'] and not get_user_model().objects.filter(username=options['author']).exists():
+            raise CommandError(f"User {options['author']!r} does not exist.")
+
+        importer = BookImporter(chunk_size=options['chunk_size'],
+                                images_dir=options['images_dir'],
+                                default_author=options['author'],
+                                create_genres=options['create_genres'])
+        last_report = time.perf_counter()
+
+        def progress(stats):
+            nonlocal last_report
+            if time.perf_counter() - last_report >= options['progress_interval']:
+                last_report = time.perf_counter()
+                self.stdout.write(f"{stats['created']} books imported ({self.rate(stats):.0f} rows/s)")
+
+        try:
+            with open_text(options['path'], 'r') as file:
+                stats = importer.run(read_rows(file, file_format), progress=progress)
+        except OSError as error:
+            raise CommandError(error)
+
+        logger.info("Imported %s books from %s in %.1fs", stats['created'], options['path'], stats['seconds'])
+        for key in ('skipped', 'missing_images', 'unknown_authors', 'unknown_genres'):
+            if stats[key]:
+                self.stdout.write(self.style.WARNING(f"{key.replace('_', ' ').capitalize()}: {stats[key]}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['created']} books in {stats['seconds']:.1f}s ({self.rate(stats):.0f} rows/s)."))
+        if stats['images']:
+            self.stdout.write(f"{stats['images']} images attached, run build_renditions to resize them.")
+
+    @staticmethod
+    def rate(stats):
+        return (stats['created'] + stats['skipped']) / stats['seconds'] if stats['seconds'] else 0
@@ -0,0 +1,68 @@
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Management command to load a running server with concurrent requests, e.g. to compare
+    the throughput of the WSGI and ASGI modes of a worker (see gunicorn.conf.py).
+    """
+    help = 'Send concurrent GET requests to the given URLs and report throughput, latency and errors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs requested in turn, e.g. http://localhost:8000/books/')
+        parser.add_argument('--concurrency', type=int, default=50, help='Number of requests in flight')
+        parser.add_argument('--requests', type=int, default=1000, help='Total number of requests')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a response')
+        parser.add_argument('--cookie', help='Cookie header sent with every request (e.g. sessionid=...)')
+
+    def handle(self, *args, **options):
+        """
+        Sends the requests from a pool of threads and prints the results.
+        """
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive.')
+        headers = {'Cookie': options['cookie']} if options['cookie'] else {}
+        urls = islice(cycle(options['urls']), options['requests'])
+
+        def fetch(url):
+            request = urllib.request.Request(url, headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as error:
+                status = error.code
+            except (urllib.error.URLError, OSError):
+                status = None
+            return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(fetch, urls))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency in results)
+        errors = sum(1 for status, _ in results if status is None or status >= 500)
+        self.stdout.write(f"Requests: {len(results)}, concurrency: {options['concurrency']}, "
+                          f"errors: {errors}")
+        self.stdout.write(f"Throughput: {len(results) / elapsed:.1f} req/s")
+        self.stdout.write(f"Latency p50: {percentile(latencies, 0.5) * 1000:.1f} ms, "
+                          f"p95: {percentile(latencies, 0.95) * 1000:.1f} ms, "
+                          f"max: {latencies[-1] * 1000:.1f} ms")
+        if errors:
+            raise CommandError(f'{errors} requests failed.')
+        self.stdout.write(self.style.SUCCESS('Load test finished.'))
+
+
+def percentile(values, fraction):
+    """
+    Returns the value below which the given fraction of the sorted values lies.
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
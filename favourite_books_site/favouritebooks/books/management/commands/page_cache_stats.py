@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from books.caching import get_cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    """
+    Management command to show the hit/miss counters of the anonymous page cache.
+    """
+    help = 'Show hit/miss counters of the public page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them')
+
+    def handle(self, *args, **options):
+        """
+        Prints hits, misses and the hit ratio.
+        """
+        stats = get_cache_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total * 100 if total else 0
+        self.stdout.write(f"hits: {stats['hits']}\nmisses: {stats['misses']}\nhit ratio: {ratio:.1f}%")
+        if options['reset']:
+            reset_cache_stats()
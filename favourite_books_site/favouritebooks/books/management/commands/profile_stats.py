@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.caching import is_shared_cache
+from books.profiling import get_route_stats, reset_route_stats
+
+
+class Command(BaseCommand):
+    """
+    Management command to show the per-route histograms collected by the profiling middleware.
+    """
+    help = 'Show request counts, latency percentiles, SQL, template and cache numbers of the sampled requests per route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=['requests', 'mean_ms', 'mean_sql_ms', 'mean_sql_count'],
+                            default='mean_ms', help='Column to sort the routes by (descending)')
+        parser.add_argument('--histogram', action='store_true', help='Also print the latency histogram of every route')
+        parser.add_argument('--json', action='store_true', help='Print the statistics as JSON')
+        parser.add_argument('--reset', action='store_true', help='Reset the statistics after printing them')
+
+    def handle(self, *args, **options):
+        """
+        Prints one line per route, slowest first by default.
+        """
+        if not is_shared_cache():
+            raise CommandError('The statistics are kept in the cache shared by the web workers, '
+                               'but the default cache is private to each process: set REDIS_URL.')
+        stats = get_route_stats()
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2, sort_keys=True))
+        elif not stats:
+            self.stdout.write('No sampled requests yet (see PROFILING_SAMPLE_RATE).')
+        else:
+            self.stdout.write(f"{'route':<30} {'requests':>8} {'mean, ms':>9} {'p50, ms':>8} {'p95, ms':>8} "
+                              f"{'queries':>8} {'sql, ms':>8} {'tpl, ms':>8} {'cache hit':>9}")
+            for route, row in sorted(stats.items(), key=lambda item: item[1][options['sort']], reverse=True):
+                lookups = row['cache_hits'] + row['cache_misses']
+                hit_ratio = f"{row['cache_hits'] / lookups * 100:.0f}%" if lookups else '-'
+                self.stdout.write(f"{route:<30} {row['requests']:>8} {row['mean_ms']:>9.1f} "
+                                  f"{'≤' + row['p50_ms']:>8} {'≤' + row['p95_ms']:>8} "
+                                  f"{row['mean_sql_count']:>8.1f} {row['mean_sql_ms']:>8.1f} "
+                                  f"{row['mean_template_ms']:>8.1f} {hit_ratio:>9}")
+                if options['histogram']:
+                    for bucket, count in row['histogram'].items():
+                        self.stdout.write(f"    ≤{bucket:>5} ms {count:>8} {'#' * round(count / row['requests'] * 40)}")
+        if options['reset']:
+            reset_route_stats()
+            self.stdout.write(self.style.SUCCESS('Statistics reset.'))
@@ -0,0 +1,28 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from books.caching import GENRE_CLOUD, TAGS, invalidate_namespaces
+from books.models import Comment, Genres
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to rebuild denormalized counters from their source tables.
+    """
+    help = 'Rebuild stored counters (comment likes, published books per genre) from the source tables'
+
+    def handle(self, *args, **options):
+        """
+        Recalculates `Comment.likes_count` and `Genres.books_count`.
+        """
+        updated = Comment.objects.rebuild_likes_count()
+        logger.info("Rebuilt likes_count for %s comments", updated)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt likes count for {updated} comments.'))
+
+        updated = Genres.objects.refresh_books_count()
+        invalidate_namespaces(GENRE_CLOUD, TAGS)
+        logger.info("Rebuilt books_count for %s genres", updated)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt books count for {updated} genres.'))
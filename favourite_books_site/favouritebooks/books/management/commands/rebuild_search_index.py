@@ -0,0 +1,22 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from books.models import Book
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to rebuild the full-text search vectors of all books.
+    """
+    help = 'Rebuild the stored full-text search vectors of all books (PostgreSQL only)'
+
+    def handle(self, *args, **options):
+        """
+        Recalculates `Book.search_vector` from titles, genres and descriptions.
+        """
+        updated = Book.objects.update_search_vector()
+        logger.info("Rebuilt search_vector for %s books", updated)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt search index for {updated} books.'))
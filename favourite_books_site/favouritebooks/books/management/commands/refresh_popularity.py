@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.popularity import refresh_popularity
+
+
+class Command(BaseCommand):
+    """
+    Management command to update the popularity ranking of books from recent comments and likes.
+    """
+    help = ('Recompute the popularity of the books with comments or likes since the last refresh '
+            '(--full: of all books active in the window; --loop: keep refreshing periodically)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recompute all books with activity in the window and drop inactive ones')
+        parser.add_argument('--batch-size', type=int, default=500, help='Books recomputed per batch')
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing instead of exiting')
+        parser.add_argument('--interval', type=float, default=300,
+                            help='Seconds between refreshes (with --loop)')
+        parser.add_argument('--full-interval', type=float, default=24 * 3600,
+                            help='Seconds between full refreshes (with --loop)')
+
+    def handle(self, *args, **options):
+        """
+        Refreshes once, or (with --loop) every --interval seconds with a full refresh every --full-interval.
+        """
+        last_full = None
+        while True:
+            full = options['full'] or (options['loop'] and (last_full is None
+                                                          or time.monotonic() - last_full >= options['full_interval']))
+            ranked, removed = refresh_popularity(full=full, batch_size=options['batch_size'])
+            if full:
+                last_full = time.monotonic()
+            self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} books, removed {removed}.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,40 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from books.outbox import send_batch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Management command to deliver the emails queued in the outbox.
+    """
+    help = 'Send the queued outbox emails in batches over a single connection (use --loop to keep running)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+                            help='Maximum number of emails sent over one connection')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling the outbox instead of exiting when it is empty')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait between polls when the outbox is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        """
+        Sends batches until no message is due, then exits or (with --loop) waits for new ones.
+        """
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_batch(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} emails, {total_failed} failed.'))
@@ -0,0 +1,57 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from books.models import Book
+from books.publishing import set_books_status
+
+
+class Command(BaseCommand):
+    """
+    Management command to publish or unpublish many books at once.
+    """
+    help = 'Publish or unpublish the selected books in batches, updating genre counters and cached pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('status', choices=['published', 'draft'], help='New status of the books')
+        parser.add_argument('--ids', nargs='*', type=int, default=[], help='Ids of the books')
+        parser.add_argument('--slugs', nargs='*', default=[], help='Slugs of the books')
+        parser.add_argument('--file', help='File with one book id or slug per line (- for stdin)')
+        parser.add_argument('--author', help='Select all books of this username')
+        parser.add_argument('--genre', help='Select all books of this genre slug')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Books updated per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many books would change')
+
+    def handle(self, *args, **options):
+        """
+        Selects the books and changes their status through the bulk publishing service.
+        """
+        ids, slugs = list(options['ids']), list(options['slugs'])
+        if options['file']:
+            file = sys.stdin if options['file'] == '-' else open(options['file'], encoding='utf-8')
+            with file:
+                for line in file:
+                    value = line.strip()
+                    if value.isdigit():
+                        ids.append(int(value))
+                    elif value:
+                        slugs.append(value)
+
+        books = Book.objects.all()
+        if ids or slugs:
+            books = books.filter(Q(pk__in=ids) | Q(slug__in=slugs))
+        elif not (options['author'] or options['genre']):
+            raise CommandError('Select the books with --ids, --slugs, --file, --author or --genre.')
+        if options['author']:
+            books = books.filter(author__username=options['author'])
+        if options['genre']:
+            books = books.filter(genres__slug=options['genre'])
+
+        status = Book.Status.PUBLISHED if options['status'] == 'published' else Book.Status.DRAFT
+        if options['dry_run']:
+            count = books.exclude(is_published=status).count()
+            self.stdout.write(f"{count} books would be set to {options['status']}.")
+            return
+        count = set_books_status(books, status, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Set {count} books to {options['status']}."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_likes_count(apps, schema_editor):
+    Comment = apps.get_model('books', 'Comment')
+    likes = (Comment.likes.through.objects
+             .filter(comment_id=OuterRef('pk'))
+             .order_by()
+             .values('comment_id')
+             .annotate(total=Count('pk'))
+             .values('total'))
+    Comment.objects.update(likes_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_alter_comment_content'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_likes_count, migrations.RunPython.noop),
+    ]
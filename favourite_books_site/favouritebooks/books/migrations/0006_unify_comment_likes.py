@@ -0,0 +1,88 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def merge_likes(apps, schema_editor):
+    """
+    Moves likes from the implicit Comment.likes table into LikedComment,
+    dropping duplicated (comment, user) pairs on the way, and recounts
+    Comment.likes_count from the merged table.
+    """
+    Comment = apps.get_model('books', 'Comment')
+    LikedComment = apps.get_model('books', 'LikedComment')
+
+    duplicates = (LikedComment.objects
+                  .values('comment_id', 'user_id')
+                  .annotate(first_id=Min('id'), total=Count('id'))
+                  .filter(total__gt=1))
+    for row in duplicates.iterator():
+        (LikedComment.objects
+         .filter(comment_id=row['comment_id'], user_id=row['user_id'])
+         .exclude(id=row['first_id'])
+         .delete())
+
+    existing = set(LikedComment.objects.values_list('comment_id', 'user_id'))
+    batch = []
+    for pair in Comment.likes.through.objects.values_list('comment_id', 'user_id').iterator():
+        if pair in existing:
+            continue
+        existing.add(pair)
+        batch.append(LikedComment(comment_id=pair[0], user_id=pair[1]))
+        if len(batch) >= 1000:
+            LikedComment.objects.bulk_create(batch)
+            batch = []
+    LikedComment.objects.bulk_create(batch)
+
+    # 0005 counted only the implicit table
+    likes = (LikedComment.objects
+             .filter(comment_id=OuterRef('pk'))
+             .order_by()
+             .values('comment_id')
+             .annotate(total=Count('pk'))
+             .values('total'))
+    Comment.objects.update(likes_count=Coalesce(Subquery(likes), 0))
+
+
+def split_likes(apps, schema_editor):
+    """
+    Copies likes back into the implicit Comment.likes table.
+    """
+    Comment = apps.get_model('books', 'Comment')
+    LikedComment = apps.get_model('books', 'LikedComment')
+    through = Comment.likes.through
+    batch = []
+    for comment_id, user_id in LikedComment.objects.values_list('comment_id', 'user_id').iterator():
+        batch.append(through(comment_id=comment_id, user_id=user_id))
+        if len(batch) >= 1000:
+            through.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    through.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_comment_likes_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_likes, split_likes),
+        migrations.AddConstraint(
+            model_name='likedcomment',
+            constraint=models.UniqueConstraint(fields=('comment', 'user'), name='unique_comment_like'),
+        ),
+        migrations.RemoveField(
+            model_name='comment',
+            name='likes',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='likes',
+            field=models.ManyToManyField(blank=True, related_name='comment_likes', through='books.LikedComment', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:41
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_books_count(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Genres = apps.get_model('books', 'Genres')
+    published = (Book.genres.through.objects
+                 .filter(genres_id=OuterRef('pk'), book__is_published=1)
+                 .order_by()
+                 .values('genres_id')
+                 .annotate(total=Count('pk'))
+                 .values('total'))
+    Genres.objects.update(books_count=Coalesce(Subquery(published), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_unify_comment_likes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genres',
+            name='books_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_books_count, migrations.RunPython.noop),
+    ]
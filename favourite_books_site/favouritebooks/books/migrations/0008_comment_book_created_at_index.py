@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0007_genres_books_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', '-created_at', '-id'], name='books_comme_book_id_103d4d_idx'),
+        ),
+    ]
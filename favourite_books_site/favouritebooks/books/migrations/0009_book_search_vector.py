@@ -0,0 +1,49 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:22
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Book = apps.get_model('books', 'Book')
+    Genres = apps.get_model('books', 'Genres')
+    genre_names = (Genres.objects
+                   .filter(genres=OuterRef('pk'))
+                   .order_by()
+                   .values('genres')
+                   .annotate(names=StringAgg('genre', ' '))
+                   .values('names'))
+    Book.objects.update(search_vector=(
+        SearchVector('title', weight='A', config='english')
+        + SearchVector(Coalesce(Subquery(genre_names), Value('')), weight='B', config='english')
+        + SearchVector('description', weight='C', config='english')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0008_comment_book_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='books_book_search_gin'),
+        ),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+    ]
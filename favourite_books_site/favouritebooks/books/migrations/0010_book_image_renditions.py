@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_search_vector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookImageRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('thumb', 'Thumbnail'), ('detail', 'Detail')], max_length=10)),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('source', models.CharField(help_text='Name of the original image file the rendition was made from', max_length=255)),
+                ('image', models.ImageField(height_field='height', upload_to='book_images/renditions/%Y/%m/%d/', width_field='width')),
+                ('width', models.PositiveIntegerField(editable=False)),
+                ('height', models.PositiveIntegerField(editable=False)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='books.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('book', 'kind', 'format'), name='unique_book_image_rendition')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.1 on 2026-10-17 22:45
+
+import re
+from itertools import islice
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def make_excerpt(description):
+    words = list(islice(re.finditer(r'\S+', description), 26))
+    if len(words) > 25:
+        description = description[:words[24].end()] + '…'
+    return Truncator(description.strip()).chars(500)
+
+
+def fill_excerpt(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    batch = []
+    for book in Book.objects.only('pk', 'description').order_by('pk').iterator(chunk_size=1000):
+        book.excerpt = make_excerpt(book.description)
+        batch.append(book)
+        if len(batch) >= 1000:
+            Book.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    Book.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.RunPython(fill_excerpt, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_book_excerpt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookPopularity',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='books.book')),
+                ('score', models.FloatField(help_text='Base 2 logarithm of the time-decayed activity, comparable between books')),
+                ('comments_count', models.PositiveIntegerField(default=0, help_text='Comments within the popularity window')),
+                ('likes_count', models.PositiveIntegerField(default=0, help_text='Comment likes within the popularity window')),
+                ('refreshed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'Book popularity',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['created_at'], name='books_comme_created_b864ef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likedcomment',
+            index=models.Index(fields=['created_at'], name='books_liked_created_7e620c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookpopularity',
+            index=models.Index(fields=['-score'], name='books_bookp_score_da66d5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookpopularity',
+            index=models.Index(fields=['refreshed_at'], name='books_bookp_refresh_a6b638_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.1 on 2026-10-17 23:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+STEP_WIDTH = 12
+
+
+def build_paths(apps, schema_editor):
+    """
+    Sets the thread, path and depth of the existing replies, one level of replies at a time.
+    """
+    Comment = apps.get_model('books', 'Comment')
+    # pk -> (thread_id, path, depth) of the comments of the previous level
+    level = {pk: (pk, '', 0) for pk in Comment.objects.filter(parent_comment__isnull=True)
+                                                     .values_list('pk', flat=True).iterator()}
+    while level:
+        ids = list(level)
+        next_level = {}
+        for start in range(0, len(ids), 1000):
+            replies = []
+            for pk, parent_id in (Comment.objects
+                                  .filter(parent_comment_id__in=ids[start:start + 1000])
+                                  .values_list('pk', 'parent_comment_id')):
+                thread_id, path, depth = level[parent_id]
+                reply = Comment(pk=pk, thread_id=thread_id, path=f'{path}{parent_id:0{STEP_WIDTH}d}/',
+                                depth=depth + 1)
+                next_level[pk] = (thread_id, reply.path, reply.depth)
+                replies.append(reply)
+            Comment.objects.bulk_update(replies, ['thread', 'path', 'depth'], batch_size=1000)
+        level = next_level
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_book_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='thread',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='thread_replies', to='books.comment'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
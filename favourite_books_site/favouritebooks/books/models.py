@@ -1,14 +1,240 @@
 import logging
+import re
+from itertools import islice
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Concat, LPad
 from django.urls import reverse
-from django_unique_slugify import unique_slugify
+from django.utils import timezone
+from django.utils.text import Truncator, slugify
 
 
 logger = logging.getLogger(__name__)
 
 
-class PublishedManager(models.Manager):
+class LoadedValuesMixin:
+    """
+    Mixin that remembers the field values an instance was loaded with,
+    so that save handlers can tell which fields have changed.
+    """
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_loaded_value(self, field_name, default=None):
+        """
+        Returns the value the field had when the instance was loaded from the database.
+        """
+        return getattr(self, '_loaded_values', {}).get(field_name, default)
+
+    def reset_loaded_values(self):
+        """
+        Marks the current field values as saved, so the next save compares against them.
+        """
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+
+class UniqueSlugMixin:
+    """
+    Mixin that keeps a unique `slug` generated from `slug_source_field`.
+    The slug is only (re)generated when the instance is created or the source field changes
+    (requires LoadedValuesMixin). Taken suffixes are read with a single prefix query on the
+    slug index, and an insert that loses the race for a slug is retried with the next free one.
+    """
+    slug_source_field = None
+    slug_save_attempts = 5
+
+    def slug_needs_update(self):
+        """
+        Returns True if the slug has to be generated on this save.
+        """
+        loaded_values = getattr(self, '_loaded_values', {})
+        if not self.slug or self._state.adding or self.slug_source_field not in loaded_values:
+            return True
+        return loaded_values[self.slug_source_field] != getattr(self, self.slug_source_field)
+
+    @classmethod
+    def slug_base(cls, value):
+        """
+        Returns the slug of a source value without a suffix, cut to the length of the slug field.
+        """
+        max_length = cls._meta.get_field('slug').max_length
+        return slugify(value)[:max_length].strip('-') or cls._meta.model_name
+
+    @classmethod
+    def slug_candidate(cls, base, number):
+        """
+        Returns the base slug with the `-N` suffix, shortened to fit the slug field.
+        """
+        max_length = cls._meta.get_field('slug').max_length
+        suffix = f'-{number}'
+        return base[:max_length - len(suffix)].rstrip('-') + suffix
+
+    @classmethod
+    def taken_slugs(cls, base, exclude_pk=None):
+        """
+        Returns the set of stored slugs among the base slug and its numbered variants.
+        """
+        max_length = cls._meta.get_field('slug').max_length
+        # One query for the base slug and all its numbered variants (an index range scan on `slug`);
+        # every candidate with a suffix of up to 10 characters starts with the prefix
+        prefix = base[:max_length - 10].rstrip('-')
+        taken = cls._default_manager.filter(slug__startswith=prefix)
+        if prefix == base:
+            taken = taken.filter(Q(slug=base) | Q(slug__regex=rf'^{re.escape(base)}-[0-9]+$'))
+        if exclude_pk is not None:
+            taken = taken.exclude(pk=exclude_pk)
+        return set(taken.values_list('slug', flat=True))
+
+    @classmethod
+    def first_free_slug(cls, base, taken):
+        """
+        Returns the base slug, or its variant with the lowest `-N` suffix that is not in `taken`.
+        """
+        if base not in taken:
+            return base
+        number = 2
+        while cls.slug_candidate(base, number) in taken:
+            number += 1
+        return cls.slug_candidate(base, number)
+
+    def generate_unique_slug(self):
+        """
+        Returns the slug of the source value, with the lowest free `-N` suffix if it is taken.
+        """
+        base = self.slug_base(getattr(self, self.slug_source_field))
+        return self.first_free_slug(base, self.taken_slugs(base, exclude_pk=self.pk))
+
+    def save(self, *args, **kwargs):
+        """
+        Generates the slug when needed and saves, retrying with a new slug if a concurrent
+        save has taken it in the meantime.
+        """
+        if not self.slug_needs_update():
+            return super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'slug'}
+        for attempt in range(1, self.slug_save_attempts + 1):
+            self.slug = self.generate_unique_slug()
+            try:
+                with transaction.atomic(using=kwargs.get('using')):
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                slug_taken = (self.__class__._default_manager.filter(slug=self.slug)
+                              .exclude(pk=self.pk).exists())
+                if not slug_taken or attempt == self.slug_save_attempts:
+                    raise
+                logger.info("Slug '%s' was taken concurrently, retrying", self.slug)
+
+
+# PostgreSQL text search configuration used for the book search vector
+SEARCH_CONFIG = 'english'
+
+# Book cards show the first EXCERPT_WORDS words of the description, stored in `Book.excerpt`
+EXCERPT_WORDS = 25
+EXCERPT_LENGTH = 500
+
+
+def make_excerpt(description):
+    """
+    Returns the excerpt of a book description shown on the book cards: its first
+    `EXCERPT_WORDS` words with the line breaks kept (the cards render it with `linebreaks`).
+    """
+    words = list(islice(re.finditer(r'\S+', description), EXCERPT_WORDS + 1))
+    if len(words) > EXCERPT_WORDS:
+        description = description[:words[EXCERPT_WORDS - 1].end()] + '…'
+    return Truncator(description.strip()).chars(EXCERPT_LENGTH)
+
+
+class BookQuerySet(models.QuerySet):
+    """
+    Custom queryset for books with list rendering and full-text search helpers.
+    """
+    def _is_postgresql(self):
+        return connections[self.db].vendor == 'postgresql'
+
+    def for_listing(self):
+        """
+        Returns books ready to be rendered as cards: the author is joined, image renditions
+        are prefetched and the full description (and the search vector) is not loaded,
+        the cards use the stored `excerpt`.
+        """
+        return (self.select_related('author')
+                .prefetch_related('renditions')
+                .defer('description', 'search_vector'))
+
+    def popular(self):
+        """
+        Returns the ranked books, most popular first (an index scan of `BookPopularity.score`).
+        """
+        return self.filter(popularity__isnull=False).order_by('-popularity__score')
+
+    def update_excerpts(self, batch_size=1000):
+        """
+        Recalculates the stored `excerpt` of the selected books in batches.
+        Returns the number of changed books.
+        """
+        updated = 0
+        books = self.only('pk', 'description', 'excerpt').order_by('pk')
+        batch = []
+        for book in books.iterator(chunk_size=batch_size):
+            excerpt = make_excerpt(book.description)
+            if book.excerpt != excerpt:
+                book.excerpt = excerpt
+                batch.append(book)
+            if len(batch) >= batch_size:
+                updated += Book.objects.bulk_update(batch, ['excerpt'])
+                batch = []
+        if batch:
+            updated += Book.objects.bulk_update(batch, ['excerpt'])
+        return updated
+
+    def search(self, query):
+        """
+        Returns books matching the query, best matches first.
+        On PostgreSQL the GIN-indexed `search_vector` is used (title, genres and description,
+        in that order of weight). Other databases fall back to a case-insensitive substring match.
+        """
+        if self._is_postgresql():
+            search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+            return (self.filter(search_vector=search_query)
+                    .annotate(rank=SearchRank(F('search_vector'), search_query))
+                    .order_by('-rank', '-time_create'))
+        matches = Q(title__icontains=query) | Q(description__icontains=query) | Q(genres__genre__icontains=query)
+        return self.filter(pk__in=Book.objects.filter(matches).values('pk'))
+
+    def update_search_vector(self):
+        """
+        Recalculates `search_vector` of the selected books in a single UPDATE.
+        Does nothing on databases other than PostgreSQL. Returns the number of updated books.
+        """
+        if not self._is_postgresql():
+            return 0
+        genre_names = (Genres.objects
+                       .filter(genres=OuterRef('pk'))
+                       .order_by()
+                       .values('genres')
+                       .annotate(names=StringAgg('genre', ' '))
+                       .values('names'))
+        return self.update(search_vector=(
+            SearchVector('title', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(Coalesce(Subquery(genre_names), Value('')), weight='B', config=SEARCH_CONFIG)
+            + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+        ))
+
+
+class PublishedManager(models.Manager.from_queryset(BookQuerySet)):
     """
     Custom manager to return only published books.
     """
@@ -19,7 +245,7 @@ class PublishedManager(models.Manager):
         return super().get_queryset().filter(is_published=Book.Status.PUBLISHED)
 
 
-class Book(models.Model):
+class Book(UniqueSlugMixin, LoadedValuesMixin, models.Model):
     """
     Model representing a book with title, description, publication status, genres, image, and author.
     """
@@ -30,6 +256,7 @@ class Book(models.Model):
     title = models.CharField(max_length=255,
                              verbose_name='Book name')
     description = models.TextField(blank=True)
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
     time_create = models.DateTimeField(auto_now_add=True)
     update_time = models.DateTimeField(auto_now=True)
     is_published = models.BooleanField(choices=Status.choices, default=Status.PUBLISHED)
@@ -49,9 +276,11 @@ class Book(models.Model):
                                related_name='books',
                                null=True,
                                default=None)
+    search_vector = SearchVectorField(null=True, editable=False)
 
-    objects = models.Manager()
+    objects = BookQuerySet.as_manager()
     published = PublishedManager()
+    slug_source_field = 'title'
 
     def __str__(self):
         """
@@ -64,7 +293,8 @@ class Book(models.Model):
         verbose_name_plural = 'Books'
         ordering = ['-time_create']
         indexes = [
-            models.Index(fields=['-time_create'])
+            models.Index(fields=['-time_create']),
+            GinIndex(fields=['search_vector'], name='books_book_search_gin'),
         ]
 
     def get_absolute_url(self):
@@ -75,20 +305,46 @@ class Book(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Overridden save method to generate a unique slug from the book title.
+        Overridden save method to generate the excerpt from the description
+        (the unique slug is generated from the title by UniqueSlugMixin).
         """
-        slug_str = self.title
-        unique_slugify(self, slug_str)
+        self.excerpt = make_excerpt(self.description)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'description' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'excerpt'}
         super().save(*args, **kwargs)
-        logger.info(f"Book '{self.title}' saved/updated (id={self.id})")
+        self.reset_loaded_values()
+        logger.info("Book '%s' saved/updated (id=%s)", self.title, self.id)
 
 
-class Genres(models.Model):
+class GenresQuerySet(models.QuerySet):
+    """
+    Custom queryset for genres.
+    """
+    def refresh_books_count(self):
+        """
+        Recalculates the stored number of published books of the selected genres.
+        Returns the number of updated genres.
+        """
+        published = (Book.genres.through.objects
+                     .filter(genres_id=OuterRef('pk'), book__is_published=Book.Status.PUBLISHED)
+                     .order_by()
+                     .values('genres_id')
+                     .annotate(total=Count('pk'))
+                     .values('total'))
+        return self.update(books_count=Coalesce(Subquery(published), 0))
+
+
+class Genres(UniqueSlugMixin, LoadedValuesMixin, models.Model):
     """
     Model representing a genre/tag for books.
     """
     genre = models.CharField(max_length=100, db_index=True)
     slug = models.SlugField(max_length=255, unique=True, db_index=True)
+    books_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = GenresQuerySet.as_manager()
+    slug_source_field = 'genre'
 
     def __str__(self):
         """
@@ -108,26 +364,81 @@ class Genres(models.Model):
 
     def save(self, *args, **kwargs):
         """
-        Overridden save method to generate a unique slug from the genre name.
+        Overridden save method (the unique slug is generated from the genre name by UniqueSlugMixin).
         """
-        slug_str = self.genre
-        unique_slugify(self, slug_str)
         super().save(*args, **kwargs)
-        logger.info(f"Genre '{self.genre}' saved/updated (id={self.id})")
+        self.reset_loaded_values()
+        logger.info("Genre '%s' saved/updated (id=%s)", self.genre, self.id)
+
+
+class CommentQuerySet(models.QuerySet):
+    """
+    Custom queryset for comments with helpers used to render comment lists.
+    """
+    def for_listing(self, user):
+        """
+        Joins comment authors and annotates a per-viewer `liked_by_me` flag,
+        so a page of comments is rendered with a fixed number of queries.
+        """
+        queryset = self.select_related('author')
+        if user.is_authenticated:
+            user_likes = LikedComment.objects.filter(comment_id=OuterRef('pk'), user_id=user.pk)
+            return queryset.annotate(liked_by_me=Exists(user_likes))
+        return queryset.annotate(liked_by_me=Value(False, output_field=models.BooleanField()))
+
+    def in_tree_order(self):
+        """
+        Orders comments by their materialized path (`path` followed by their own id): thread
+        by thread, every comment followed by its replies, siblings oldest first.
+        """
+        own_step = LPad(Cast('id', models.CharField()), Comment.PATH_STEP_WIDTH, Value('0'))
+        return (self
+                .annotate(tree_path=Concat('path', own_step, Value(Comment.PATH_SEPARATOR),
+                                           output_field=models.CharField()))
+                .order_by('tree_path'))
+
+    def rebuild_likes_count(self):
+        """
+        Recalculates the stored `likes_count` of the selected comments from the likes table.
+        Returns the number of updated comments.
+        """
+        likes = (LikedComment.objects
+                 .filter(comment_id=OuterRef('pk'))
+                 .order_by()
+                 .values('comment_id')
+                 .annotate(total=Count('pk'))
+                 .values('total'))
+        return self.update(likes_count=Coalesce(Subquery(likes), 0))
 
 
 class Comment(models.Model):
     """
     Model representing a comment on a book, with support for likes and nested replies.
+
+    Replies are stored with a materialized path: `path` holds the ids of all the ancestors of
+    the comment (zero-padded, root first) and `thread` its top-level comment, so a page of
+    threads is read by one query (see `ThreadPaginator`). Both are known before the INSERT.
     """
+    PATH_STEP_WIDTH = 12
+    PATH_SEPARATOR = '/'
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     content = models.TextField(max_length=500)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
-    likes = models.ManyToManyField(get_user_model(), related_name='comment_likes', blank=True)
+    likes = models.ManyToManyField(get_user_model(),
+                                   through='LikedComment',
+                                   related_name='comment_likes',
+                                   blank=True)
     parent_comment = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True)
     is_deleted = models.BooleanField(default=False)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    thread = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True,
+                               related_name='thread_replies', editable=False)
+    path = models.CharField(max_length=255, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = CommentQuerySet.as_manager()
 
     def __str__(self):
         """
@@ -137,18 +448,91 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['book', '-created_at', '-id']),
+            # New comments since the last popularity refresh
+            models.Index(fields=['created_at']),
+        ]
 
     def save(self, *args, **kwargs):
         """
         Overridden save method for Comment
         """
+        if self._state.adding and self.parent_comment_id and not self.path:
+            self.place_under(self.parent_comment)
         super().save(*args, **kwargs)
-        logger.info(f"Comment by '{self.author}' on book id={self.book.id} saved/updated (id={self.id})")
+        # Ids only: logging must not load the author or the book
+        logger.info("Comment by user id=%s on book id=%s saved/updated (id=%s)",
+                    self.author_id, self.book_id, self.id)
+
+    @property
+    def accepts_replies(self):
+        """
+        Returns True if the comment is not nested too deep to be replied to.
+        """
+        return self.depth < settings.COMMENT_MAX_DEPTH
+
+    def place_under(self, parent):
+        """
+        Makes the comment a reply to `parent`: sets its parent, thread, path and depth.
+        """
+        self.parent_comment = parent
+        self.book_id = parent.book_id
+        self.thread_id = parent.thread_id or parent.pk
+        self.path = f'{parent.path}{parent.pk:0{self.PATH_STEP_WIDTH}d}{self.PATH_SEPARATOR}'
+        self.depth = parent.depth + 1
+
+    def reply_to(self, parent):
+        """
+        Makes the comment a reply to `parent` within the limits that keep a thread small
+        enough to render: `COMMENT_MAX_DEPTH` levels of replies, `COMMENT_MAX_REPLIES` direct
+        replies per comment and `COMMENT_MAX_THREAD_REPLIES` replies per thread.
+        Raises ValidationError if the reply would exceed one of them.
+        """
+        if not parent.accepts_replies:
+            raise ValidationError(f'Replies cannot be nested more than {settings.COMMENT_MAX_DEPTH} levels deep.',
+                                  code='max_depth')
+        replies = Comment.objects.filter(thread_id=parent.thread_id or parent.pk).aggregate(
+            thread=Count('id'), siblings=Count('id', filter=Q(parent_comment_id=parent.pk)))
+        if replies['siblings'] >= settings.COMMENT_MAX_REPLIES:
+            raise ValidationError(f'A comment cannot have more than {settings.COMMENT_MAX_REPLIES} replies.',
+                                  code='max_replies')
+        if replies['thread'] >= settings.COMMENT_MAX_THREAD_REPLIES:
+            raise ValidationError(f'A thread cannot have more than {settings.COMMENT_MAX_THREAD_REPLIES} replies.',
+                                  code='max_thread_replies')
+        self.place_under(parent)
+
+    def toggle_like(self, user):
+        """
+        Likes or unlikes the comment on behalf of the user and keeps `likes_count` in sync.
+        The like row is removed by a single conditional DELETE or added by a single INSERT,
+        and the counter is changed with an atomic F() update, so concurrent clicks cannot
+        leave the counter out of step with the likes table.
+        Returns a tuple (liked, likes_count).
+        """
+        with transaction.atomic():
+            deleted, _ = LikedComment.objects.filter(comment_id=self.pk, user_id=user.pk).delete()
+            if deleted:
+                liked, delta = False, -1
+            else:
+                try:
+                    with transaction.atomic():
+                        LikedComment.objects.create(comment_id=self.pk, user_id=user.pk)
+                    liked, delta = True, 1
+                except IntegrityError:
+                    # A concurrent request has already stored the same like
+                    liked, delta = True, 0
+            if delta:
+                # Moving `updated_at` also changes the validators of the cached book page
+                Comment.objects.filter(pk=self.pk).update(likes_count=F('likes_count') + delta,
+                                                          updated_at=timezone.now())
+            self.likes_count = Comment.objects.values_list('likes_count', flat=True).get(pk=self.pk)
+        return liked, self.likes_count
 
 
 class LikedComment(models.Model):
     """
-    Model representing a like on a comment by a user.
+    Model representing a like on a comment by a user (the storage behind `Comment.likes`).
     """
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE)
@@ -160,9 +544,113 @@ class LikedComment(models.Model):
         """
         return f"{self.user} - {self.comment}"
 
-    def save(self, *args, **kwargs):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['comment', 'user'], name='unique_comment_like')
+        ]
+        indexes = [
+            # New likes since the last popularity refresh
+            models.Index(fields=['created_at']),
+        ]
+
+
+class BookPopularity(models.Model):
+    """
+    Model holding the popularity ranking of a book: a summary of its recent comment and like
+    activity, kept up to date by the `refresh_popularity` command (see books/popularity.py).
+    Books without activity in the popularity window have no row.
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    score = models.FloatField(help_text='Base 2 logarithm of the time-decayed activity, comparable between books')
+    comments_count = models.PositiveIntegerField(default=0, help_text='Comments within the popularity window')
+    likes_count = models.PositiveIntegerField(default=0, help_text='Comment likes within the popularity window')
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self):
         """
-        Overridden save method for LikedComment
+        String representation of the BookPopularity object (shows book and score).
         """
-        super().save(*args, **kwargs)
-        logger.info(f"LikedComment by '{self.user}' on comment id={self.comment.id} saved/updated (id={self.id})")
+        return f"{self.book_id}: {self.score:.2f}"
+
+    class Meta:
+        verbose_name_plural = 'Book popularity'
+        indexes = [
+            models.Index(fields=['-score']),
+            models.Index(fields=['refreshed_at']),
+        ]
+
+
+class BookImageRendition(models.Model):
+    """
+    Model representing a resized copy of a book image (a size and a file format of the uploaded original).
+    """
+    class Kind(models.TextChoices):
+        THUMB = 'thumb', 'Thumbnail'
+        DETAIL = 'detail', 'Detail'
+
+    class Format(models.TextChoices):
+        WEBP = 'webp', 'WebP'
+        JPEG = 'jpeg', 'JPEG'
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='renditions')
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    format = models.CharField(max_length=10, choices=Format.choices)
+    source = models.CharField(max_length=255,
+                              help_text='Name of the original image file the rendition was made from')
+    image = models.ImageField(upload_to='book_images/renditions/%Y/%m/%d/',
+                              width_field='width',
+                              height_field='height')
+    width = models.PositiveIntegerField(editable=False)
+    height = models.PositiveIntegerField(editable=False)
+
+    def __str__(self):
+        """
+        String representation of the BookImageRendition object (shows book, kind, format and size).
+        """
+        return f"{self.book_id} {self.kind}.{self.format} ({self.width}x{self.height})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'kind', 'format'], name='unique_book_image_rendition')
+        ]
+
+
+class OutboxEmail(models.Model):
+    """
+    Model representing an outgoing email waiting in the outbox for the background sender.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    subject = models.CharField(max_length=998)
+    body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    headers = models.JSONField(default=dict, blank=True)
+    alternatives = models.JSONField(default=list, blank=True,
+                                    help_text='Alternative bodies as [content, mimetype] pairs')
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        """
+        String representation of the OutboxEmail object (shows subject and recipients).
+        """
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+    class Meta:
+        verbose_name = 'Outbox email'
+        verbose_name_plural = 'Outbox emails'
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
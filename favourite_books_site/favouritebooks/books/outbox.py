@@ -0,0 +1,149 @@
+"""
+Outbox for outgoing email.
+
+`OutboxEmailBackend` is the site's EMAIL_BACKEND: sending a message (feedback, password
+reset, ...) only stores it as an `OutboxEmail` row, so a slow SMTP server never holds up
+a request. The `send_outbox` management command delivers the queued messages with
+`OUTBOX_DELIVERY_BACKEND` (SMTP by default), a batch at a time over a single
+connection, and retries failed messages with exponential backoff.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.utils import timezone
+
+from books.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed batch is hidden from other senders; after a crash it is sent again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """
+    Email backend that queues messages in the outbox instead of sending them.
+    """
+    def send_messages(self, email_messages):
+        """
+        Stores the messages in the outbox and returns their number.
+        """
+        rows = []
+        for message in email_messages:
+            if message.attachments:
+                raise ValueError('Emails with attachments cannot be queued in the outbox.')
+            if not message.recipients():
+                continue
+            rows.append(OutboxEmail(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email or '',
+                to=list(message.to),
+                cc=list(message.cc),
+                bcc=list(message.bcc),
+                reply_to=list(message.reply_to),
+                headers=dict(message.extra_headers),
+                alternatives=[list(alternative) for alternative in getattr(message, 'alternatives', [])],
+            ))
+        OutboxEmail.objects.bulk_create(rows)
+        logger.info("Queued %s emails in the outbox", len(rows))
+        return len(rows)
+
+
+def to_message(email, connection=None):
+    """
+    Returns the Django email message stored in an outbox row.
+    """
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or None,
+        to=email.to,
+        cc=email.cc,
+        bcc=email.bcc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+        alternatives=[tuple(alternative) for alternative in email.alternatives],
+        connection=connection,
+    )
+    return message
+
+
+def retry_delay(attempts):
+    """
+    Returns how long to wait before the next attempt after the given number of failed attempts.
+    """
+    return timedelta(seconds=settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def claim_batch(batch_size):
+    """
+    Claims up to `batch_size` due messages for this sender and returns them.
+    Claimed messages are not due again before `CLAIM_TIMEOUT`, so concurrent senders
+    never pick the same message.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(OutboxEmail.objects.select_for_update(skip_locked=True)
+                   .filter(status=OutboxEmail.Status.PENDING, next_attempt_at__lte=now)
+                   .order_by('next_attempt_at', 'id')
+                   .values_list('id', flat=True)[:batch_size])
+        OutboxEmail.objects.filter(id__in=ids).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return list(OutboxEmail.objects.filter(id__in=ids).order_by('id'))
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = f'{type(error).__name__}: {error}'
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.Status.FAILED
+        logger.error("Giving up on outbox email id=%s after %s attempts: %s", email.id, email.attempts, email.last_error)
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+        logger.warning("Outbox email id=%s failed (attempt %s), retrying at %s: %s",
+                       email.id, email.attempts, email.next_attempt_at, email.last_error)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def send_batch(batch_size=None):
+    """
+    Sends one batch of due messages over a single connection.
+    Returns the numbers of sent and failed messages.
+    """
+    emails = claim_batch(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0, 0
+    sent_ids, failed = [], 0
+    connection = get_connection(settings.OUTBOX_DELIVERY_BACKEND, fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:
+        # The server is unreachable: every message of the batch waits for the next attempt
+        for email in emails:
+            _mark_failed(email, error)
+        return 0, len(emails)
+    try:
+        for email in emails:
+            try:
+                connection.send_messages([to_message(email, connection)])
+            except Exception as error:
+                _mark_failed(email, error)
+                failed += 1
+                # The session may be broken after an error, start a new one for the rest
+                try:
+                    connection.close()
+                    connection.open()
+                except Exception:
+                    logger.warning("Could not reopen the email connection, the next message will retry")
+            else:
+                sent_ids.append(email.id)
+    finally:
+        connection.close()
+    OutboxEmail.objects.filter(id__in=sent_ids).update(status=OutboxEmail.Status.SENT,
+                                                       sent_at=timezone.now(), last_error='')
+    logger.info("Outbox batch: %s sent, %s failed", len(sent_ids), failed)
+    return len(sent_ids), failed
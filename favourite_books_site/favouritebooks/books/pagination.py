@@ -0,0 +1,284 @@
+"""
+Cursor (keyset) pagination.
+
+Instead of OFFSET/LIMIT the next page is selected with a WHERE condition on the ordering
+columns of the last row already shown, e.g. for ordering ('-time_create', '-id'):
+
+    WHERE time_create <= %s AND (time_create < %s OR (time_create = %s AND id < %s))
+    ORDER BY time_create DESC, id DESC LIMIT per_page + 1
+
+so every page is read from the index in the same time, however deep it is, and
+no COUNT(*) is needed. The position is passed in an opaque URL-safe cursor.
+
+`ThreadPaginator` pages through the top-level comments of a book and reads them together
+with their replies.
+
+`EstimatedCountPaginator` keeps page numbers (for the admin) but takes the total of
+large unfiltered tables from the PostgreSQL statistics instead of a COUNT(*).
+"""
+import base64
+import json
+from functools import cached_property
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class CursorPage:
+    """
+    A page of objects returned by CursorPaginator.
+    """
+    def __init__(self, object_list, paginator, cursor, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage {self.cursor or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @cached_property
+    def next_cursor(self):
+        """
+        Cursor of the page following this one.
+        """
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1], reverse=False)
+
+    @cached_property
+    def previous_cursor(self):
+        """
+        Cursor of the page preceding this one.
+        """
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(self.object_list[0], reverse=True)
+
+
+class CursorPaginator:
+    """
+    Paginator that walks a queryset by the values of its ordering fields.
+    The ordering must end with a unique field (e.g. '-id') so that every row has a distinct position.
+    """
+    cursor_based = True
+
+    def __init__(self, queryset, per_page, ordering=('-time_create', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        self.descending = [name.startswith('-') for name in self.ordering]
+
+    @cached_property
+    def count(self):
+        """
+        Total number of objects. Only executed when a template asks for it.
+        """
+        return self.queryset.count()
+
+    def _field_value(self, obj, name):
+        if isinstance(obj, dict):
+            # A row of a values() queryset
+            return obj[name]
+        return getattr(obj, self.queryset.model._meta.get_field(name).attname)
+
+    def encode_cursor(self, obj, reverse=False):
+        """
+        Returns an opaque cursor pointing at the position of the object.
+        """
+        values = []
+        for name in self.fields:
+            value = self._field_value(obj, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """
+        Returns (values, reverse) stored in the cursor. Raises InvalidCursor for malformed cursors.
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = payload['v']
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            model_fields = [self.queryset.model._meta.get_field(name) for name in self.fields]
+            values = [field.to_python(value) for field, value in zip(model_fields, values)]
+            return values, bool(payload.get('r'))
+        except (ValueError, TypeError, KeyError, AttributeError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _seek_filter(self, values, reverse):
+        """
+        Builds f1 <= v1 AND ((f1 < v1) OR (f1 = v1 AND f2 < v2) OR ...) for the ordering direction.
+        The leading inclusive bound gives the database an index range to scan.
+        """
+        condition = Q()
+        for index, name in enumerate(self.fields):
+            descending = self.descending[index] != reverse
+            lookup = 'lt' if descending else 'gt'
+            term = Q(**{f'{name}__{lookup}': values[index]})
+            for prev_name, prev_value in zip(self.fields[:index], values[:index]):
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        first_lookup = 'lte' if self.descending[0] != reverse else 'gte'
+        return Q(**{f'{self.fields[0]}__{first_lookup}': values[0]}) & condition
+
+    def _page_query(self, cursor):
+        """
+        Returns (queryset of the page rows plus one, seek values, reverse, cursor).
+        """
+        values, reverse = None, False
+        if cursor:
+            try:
+                values, reverse = self.decode_cursor(cursor)
+            except InvalidCursor:
+                cursor = None
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(name[1:] if name.startswith('-') else f'-{name}' for name in ordering)
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek_filter(values, reverse))
+        return queryset[:self.per_page + 1], values, reverse, cursor
+
+    def _make_page(self, rows, values, reverse, cursor):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            return CursorPage(rows, self, cursor, has_next=True, has_previous=has_more)
+        return CursorPage(rows, self, cursor, has_next=has_more, has_previous=values is not None)
+
+    def page(self, cursor=None):
+        """
+        Returns the page after (or, for a reverse cursor, before) the cursor position.
+        An empty or malformed cursor returns the first page.
+        """
+        queryset, values, reverse, cursor = self._page_query(cursor)
+        return self._make_page(list(queryset), values, reverse, cursor)
+
+    async def apage(self, cursor=None):
+        """
+        Async version of `page`.
+        """
+        queryset, values, reverse, cursor = self._page_query(cursor)
+        return self._make_page([row async for row in queryset], values, reverse, cursor)
+
+
+class ThreadPaginator(CursorPaginator):
+    """
+    Cursor paginator over comment threads: a page holds top-level comments, each with its
+    replies in tree order in `replies`. The page of top-level comments is a subquery of a
+    single query that also selects their replies by `thread` and orders them all by path.
+    """
+    def __init__(self, comments, per_page, ordering=('-created_at', '-id')):
+        super().__init__(comments.filter(parent_comment__isnull=True), per_page, ordering)
+        self.comments = comments
+
+    @cached_property
+    def count(self):
+        """
+        Total number of comments, replies included.
+        """
+        return self.comments.count()
+
+    def _threads_query(self, cursor):
+        """
+        Returns (queryset of the page threads plus one in tree order, seek values, reverse, cursor).
+        """
+        threads, values, reverse, cursor = self._page_query(cursor)
+        thread_ids = threads.values('pk')
+        queryset = self.comments.filter(Q(pk__in=thread_ids) | Q(thread__in=thread_ids)).in_tree_order()
+        return queryset, values, reverse, cursor
+
+    def _make_thread_page(self, rows, values, reverse, cursor):
+        threads = []
+        for comment in rows:
+            if comment.parent_comment_id is None:
+                comment.replies = []
+                threads.append(comment)
+            else:
+                # Tree order puts the replies of a thread right after its top-level comment
+                threads[-1].replies.append(comment)
+        # Back into the page order (stable sorts, least significant field first)
+        for name, descending in reversed(list(zip(self.fields, self.descending))):
+            threads.sort(key=lambda comment: self._field_value(comment, name), reverse=descending != reverse)
+        return self._make_page(threads, values, reverse, cursor)
+
+    def page(self, cursor=None):
+        queryset, values, reverse, cursor = self._threads_query(cursor)
+        return self._make_thread_page(list(queryset), values, reverse, cursor)
+
+    async def apage(self, cursor=None):
+        queryset, values, reverse, cursor = self._threads_query(cursor)
+        return self._make_thread_page([row async for row in queryset], values, reverse, cursor)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose count of an unfiltered queryset is the row estimate of the table
+    (`pg_class.reltuples`, kept up to date by autovacuum/ANALYZE) on PostgreSQL.
+    Filtered querysets, small tables and other databases are counted exactly.
+    The last pages of an estimated count may be empty or missing.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        """
+        Returns the estimated number of rows for large tables, otherwise the exact number.
+        """
+        estimate = self.estimated_count()
+        if estimate is not None and estimate >= self.exact_count_threshold:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        """
+        Returns the planner estimate of the number of rows, or None if it cannot be used.
+        """
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return None
+        query = queryset.query
+        if query.where or query.distinct or query.combinator or query.low_mark or query.high_mark is not None:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = to_regclass(%s)',
+                           [connection.ops.quote_name(queryset.model._meta.db_table)])
+            row = cursor.fetchone()
+        # reltuples is -1 for tables that were never vacuumed or analyzed
+        if row is None or row[0] is None or row[0] < 0:
+            return None
+        return int(row[0])
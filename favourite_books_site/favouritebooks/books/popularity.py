@@ -0,0 +1,138 @@
+"""
+Popularity ranking of books from their comment and comment like activity.
+
+Every comment and like counts with a weight that halves every `POPULARITY_HALF_LIFE_HOURS`.
+Instead of decaying all stored scores at every refresh, the weight of an event is scaled up
+by how long after a fixed `EPOCH` it happened, 2 ** ((time - EPOCH) / half_life), which
+ranks the books exactly like the decayed sums. The stored score is the base 2 logarithm of
+that sum, so it never overflows.
+
+A book without new activity keeps its score and falls behind the books with newer activity
+by itself, so a refresh only recomputes the books with comments or likes since the previous
+refresh (the newest `refreshed_at` in the table). A full refresh also drops the books whose
+activity left the window (`POPULARITY_WINDOW_DAYS`) and takes deleted comments and likes
+into account.
+
+Refreshes run in the `refresh_popularity` worker process, so the pages showing the ranking
+also validate against `ranking_watermark`, read from the database.
+"""
+import logging
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from books.caching import POPULAR, invalidate_namespaces
+from books.models import BookPopularity, Comment, LikedComment
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+COMMENT_WEIGHT = 2
+LIKE_WEIGHT = 1
+# Activity committed shortly before the previous refresh may have been missed by it
+REFRESH_OVERLAP = timedelta(minutes=5)
+
+
+def event_exponent(time, weight):
+    """
+    Returns the base 2 logarithm of the weight of an event scaled by its time.
+    """
+    half_life = timedelta(hours=settings.POPULARITY_HALF_LIFE_HOURS)
+    return math.log2(weight) + (time - EPOCH) / half_life
+
+
+def log2_sum(exponents):
+    """
+    Returns log2(sum(2 ** exponent)) without overflowing.
+    """
+    top = max(exponents)
+    return top + math.log2(sum(2 ** (exponent - top) for exponent in exponents))
+
+
+def changed_books(since):
+    """
+    Returns the ids of the books with comments or likes created after `since`.
+    """
+    commented = Comment.objects.filter(created_at__gte=since).order_by().values_list('book_id', flat=True).distinct()
+    liked = (LikedComment.objects
+             .filter(created_at__gte=since)
+             .order_by()
+             .values_list('comment__book_id', flat=True)
+             .distinct())
+    return set(commented) | set(liked)
+
+
+def book_activity(book_ids, since):
+    """
+    Returns {book_id: (score, comments_count, likes_count)} of the given books that have
+    comments or likes created after `since`.
+    """
+    exponents = defaultdict(list)
+    counts = defaultdict(lambda: [0, 0])
+    comments = (Comment.objects
+                .filter(book_id__in=book_ids, created_at__gte=since, is_deleted=False)
+                .order_by()
+                .values_list('book_id', 'created_at'))
+    for book_id, created_at in comments.iterator():
+        exponents[book_id].append(event_exponent(created_at, COMMENT_WEIGHT))
+        counts[book_id][0] += 1
+    likes = (LikedComment.objects
+             .filter(comment__book_id__in=book_ids, comment__is_deleted=False, created_at__gte=since)
+             .order_by()
+             .values_list('comment__book_id', 'created_at'))
+    for book_id, created_at in likes.iterator():
+        exponents[book_id].append(event_exponent(created_at, LIKE_WEIGHT))
+        counts[book_id][1] += 1
+    return {book_id: (log2_sum(values), *counts[book_id]) for book_id, values in exponents.items()}
+
+
+def ranking_watermark():
+    """
+    Returns (time of the last refresh, number of ranked books) of the popularity ranking.
+    A refresh moves the time of the books it recomputes and drops the inactive ones.
+    """
+    ranking = BookPopularity.objects.aggregate(latest=Max('refreshed_at'), total=Count('pk'))
+    return ranking['latest'], ranking['total']
+
+
+def refresh_popularity(full=False, batch_size=500):
+    """
+    Recomputes the popularity of the books with activity since the previous refresh (of all
+    books with activity in the window when `full` is set or the table is empty) in batches,
+    and invalidates the pages showing the ranking. Returns (ranked, removed) book counts.
+    """
+    now = timezone.now()
+    window_start = now - timedelta(days=settings.POPULARITY_WINDOW_DAYS)
+    last_refresh = None if full else BookPopularity.objects.aggregate(last=Max('refreshed_at'))['last']
+    full = last_refresh is None
+    since = window_start if full else max(window_start, last_refresh - REFRESH_OVERLAP)
+    book_ids = sorted(changed_books(since))
+
+    ranked = removed = 0
+    for start in range(0, len(book_ids), batch_size):
+        batch = book_ids[start:start + batch_size]
+        activity = book_activity(batch, window_start)
+        BookPopularity.objects.bulk_create(
+            [BookPopularity(book_id=book_id, score=score, comments_count=comments, likes_count=likes,
+                            refreshed_at=now)
+             for book_id, (score, comments, likes) in activity.items()],
+            update_conflicts=True,
+            unique_fields=['book'],
+            update_fields=['score', 'comments_count', 'likes_count', 'refreshed_at'],
+        )
+        # Books whose only recent comments were deleted in the meantime
+        removed += BookPopularity.objects.filter(book_id__in=batch).exclude(book_id__in=activity).delete()[0]
+        ranked += len(activity)
+    if full:
+        # Books without activity in the window
+        removed += BookPopularity.objects.filter(refreshed_at__lt=now).delete()[0]
+    if ranked or removed:
+        invalidate_namespaces(POPULAR)
+    logger.info("Refreshed popularity (%s): %s books ranked, %s removed",
+                'full' if full else 'incremental', ranked, removed)
+    return ranked, removed
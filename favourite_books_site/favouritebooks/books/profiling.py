@@ -0,0 +1,314 @@
+"""
+Sampling request profiler that can stay enabled in production.
+
+`ProfilingMiddleware` times every request. For a sample of them (`PROFILING_SAMPLE_RATE`)
+it also records the SQL queries (count, time and the slowest ones), the template render
+time and the cache lookups, adds a `Server-Timing` header (`PROFILING_SERVER_TIMING`) and
+adds the request to the latency histogram of its route. The histograms are counters in the
+shared cache (Redis), so all workers add to the same numbers: `python manage.py profile_stats`.
+With a per-process cache (local memory) every process would count on its own and the command
+could not read the numbers, so the histograms are not recorded and the command refuses to run.
+Requests slower than `PROFILING_SLOW_REQUEST_MS` are logged, sampled ones with their
+slowest queries.
+
+Queries are recorded by an execute wrapper installed on every database connection. It does
+nothing unless the current request is sampled, so an unsampled request only pays a context
+variable lookup per query.
+"""
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (ms) of the latency histogram buckets, slower requests go to the last bucket
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNTERS = ('requests', 'total_ms', 'sql_count', 'sql_ms', 'template_ms', 'cache_hits', 'cache_misses')
+ROUTES_KEY = 'books:profiling:routes'
+TOP_QUERIES = 5
+
+_current_profile = ContextVar('books_request_profile', default=None)
+
+
+class RequestProfile:
+    """
+    Measurements of a sampled request; durations are in milliseconds.
+    """
+    def __init__(self):
+        self.queries = []
+        self.template_ms = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._render_started = None
+
+    @property
+    def sql_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+    def top_queries(self, number=TOP_QUERIES):
+        """
+        Returns the slowest queries as (sql, duration) pairs.
+        """
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:number]
+
+    def render_started(self):
+        self._render_started = time.perf_counter()
+
+    def render_finished(self, response):
+        self.template_ms += (time.perf_counter() - self._render_started) * 1000
+        return response
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper adding the query and its duration to the sampled request.
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries.append((sql, (time.perf_counter() - started) * 1000))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    `connection_created` receiver adding `record_queries` to the connection. It goes first
+    so that wrappers pushed and popped with `connection.execute_wrapper()` don't remove it.
+    """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_queries)
+
+
+def note_cache_lookup(hit):
+    """
+    Counts a cache hit or miss in the sampled request (no-op otherwise).
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        if hit:
+            profile.cache_hits += 1
+        else:
+            profile.cache_misses += 1
+
+
+def route_name(request):
+    """
+    Returns the name of the route of the request ('unresolved' for unknown paths), so the
+    number of histograms is bounded by the number of routes.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+def server_timing(total_ms, profile):
+    """
+    Returns the value of the `Server-Timing` header of a sampled request.
+    """
+    return ', '.join([
+        f'sql;dur={profile.sql_ms:.1f};desc="{len(profile.queries)} queries"',
+        f'template;dur={profile.template_ms:.1f}',
+        f'cache;desc="{profile.cache_hits} hits, {profile.cache_misses} misses"',
+        f'total;dur={total_ms:.1f}',
+    ])
+
+
+def _key(route, name):
+    return f'books:profiling:{route}:{name}'
+
+
+def _add(key, value):
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        if not cache.add(key, value, timeout=None):
+            cache.incr(key, value)
+
+
+def bucket_of(total_ms):
+    """
+    Returns the label of the histogram bucket of the duration.
+    """
+    for bound in BUCKETS_MS:
+        if total_ms <= bound:
+            return str(bound)
+    return 'inf'
+
+
+def record_request(route, total_ms, profile):
+    """
+    Adds a sampled request to the counters and the latency histogram of its route.
+    """
+    routes = cache.get(ROUTES_KEY) or []
+    if route not in routes:
+        cache.set(ROUTES_KEY, sorted([*routes, route]), timeout=None)
+    values = {
+        'requests': 1,
+        'total_ms': total_ms,
+        'sql_count': len(profile.queries),
+        'sql_ms': profile.sql_ms,
+        'template_ms': profile.template_ms,
+        'cache_hits': profile.cache_hits,
+        'cache_misses': profile.cache_misses,
+    }
+    for name, value in values.items():
+        if value:
+            _add(_key(route, name), round(value))
+    _add(_key(route, f'le:{bucket_of(total_ms)}'), 1)
+
+
+def _percentile(histogram, total, fraction):
+    seen = 0
+    for bucket, count in histogram.items():
+        seen += count
+        if seen >= total * fraction:
+            return bucket
+    return 'inf'
+
+
+def get_route_stats():
+    """
+    Returns the counters, means, histogram and p50/p95 bucket of every sampled route.
+    """
+    routes = cache.get(ROUTES_KEY) or []
+    buckets = [str(bound) for bound in BUCKETS_MS] + ['inf']
+    keys = {(route, name): _key(route, name)
+            for route in routes for name in [*COUNTERS, *(f'le:{bucket}' for bucket in buckets)]}
+    values = cache.get_many(list(keys.values()))
+    stats = {}
+    for route in routes:
+        counters = {name: values.get(keys[route, name], 0) for name in COUNTERS}
+        requests = counters['requests']
+        if not requests:
+            continue
+        histogram = {bucket: values.get(keys[route, f'le:{bucket}'], 0) for bucket in buckets}
+        stats[route] = {
+            **counters,
+            'mean_ms': counters['total_ms'] / requests,
+            'mean_sql_count': counters['sql_count'] / requests,
+            'mean_sql_ms': counters['sql_ms'] / requests,
+            'mean_template_ms': counters['template_ms'] / requests,
+            'p50_ms': _percentile(histogram, requests, 0.5),
+            'p95_ms': _percentile(histogram, requests, 0.95),
+            'histogram': histogram,
+        }
+    return stats
+
+
+def reset_route_stats():
+    """
+    Deletes the counters and histograms of all routes.
+    """
+    routes = cache.get(ROUTES_KEY) or []
+    names = [*COUNTERS, *(f'le:{bound}' for bound in BUCKETS_MS), 'le:inf']
+    cache.delete_many([_key(route, name) for route in routes for name in names] + [ROUTES_KEY])
+
+
+def time_rendering(response):
+    """
+    Adds the render time of the template response to the sampled request.
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.render_started()
+        response.add_post_render_callback(profile.render_finished)
+    return response
+
+
+class ProfilingMiddleware:
+    """
+    Middleware timing every request and profiling a sample of them (see the module docstring).
+    Keep it first in MIDDLEWARE so that the other middleware is included in the timings.
+    It supports both modes, so under ASGI the requests are not moved to a thread for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        # books.caching imports this module
+        from books.caching import is_shared_cache
+        self.get_response = get_response
+        self.record_routes = is_shared_cache()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        profile = RequestProfile() if random.random() < settings.PROFILING_SAMPLE_RATE else None
+        token = _current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        route = route_name(request)
+        if profile is not None and self.record_routes:
+            record_request(route, total_ms, profile)
+        return self.finish(request, response, route, total_ms, profile)
+
+    async def __acall__(self, request):
+        """
+        Async version of `__call__`.
+        """
+        started = time.perf_counter()
+        profile = RequestProfile() if random.random() < settings.PROFILING_SAMPLE_RATE else None
+        token = _current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        route = route_name(request)
+        if profile is not None and self.record_routes:
+            # The cache client blocks, keep it off the event loop (sampled requests only)
+            await sync_to_async(record_request)(route, total_ms, profile)
+        return self.finish(request, response, route, total_ms, profile)
+
+    def finish(self, request, response, route, total_ms, profile):
+        """
+        Adds the Server-Timing header of a sampled request and logs a slow request.
+        """
+        if profile is not None and settings.PROFILING_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(total_ms, profile)
+        if total_ms >= settings.PROFILING_SLOW_REQUEST_MS:
+            self.log_slow_request(request, route, total_ms, profile)
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        Times the rendering of template responses of sampled requests. Being the outermost
+        middleware, this hook runs right before the response is rendered.
+        """
+        return time_rendering(response)
+
+    async def aprocess_template_response(self, request, response):
+        """
+        Async version of `process_template_response`, used in async mode.
+        """
+        return time_rendering(response)
+
+    def log_slow_request(self, request, route, total_ms, profile):
+        """
+        Logs a slow request, with its SQL and slowest queries when it was sampled.
+        """
+        if profile is None:
+            logger.warning("Slow request %s %s (%s): %.0f ms", request.method, request.path, route, total_ms)
+            return
+        queries = '\n'.join(f"  {duration:.1f} ms: {sql[:300]}" for sql, duration in profile.top_queries())
+        logger.warning("Slow request %s %s (%s): %.0f ms, %s queries in %.0f ms, template %.0f ms\n%s",
+                       request.method, request.path, route, total_ms, len(profile.queries),
+                       profile.sql_ms, profile.template_ms, queries)
@@ -0,0 +1,43 @@
+"""
+Bulk publishing and unpublishing of books.
+
+`queryset.update()` skips `Book.save()` and the signals, so the genre counters and the
+cached pages would keep showing the old status. `set_books_status` changes the status
+in batches and, for every batch, refreshes the derived data in set form: one UPDATE,
+one query for the genres of the batch, one counter refresh for those genres and one
+cache invalidation. Slugs, excerpts and search vectors do not depend on the status.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from books.caching import (BOOKS, genre_namespace, invalidate_namespaces,
+                           refresh_genre_counts)
+from books.models import Book
+
+logger = logging.getLogger(__name__)
+
+
+def set_books_status(books, status, batch_size=1000):
+    """
+    Sets the publication status of the books of the queryset that do not have it yet.
+    Returns the number of changed books.
+    """
+    ids = list(books.exclude(is_published=status).order_by('pk').values_list('pk', flat=True))
+    changed = 0
+    for start in range(0, len(ids), batch_size):
+        batch = ids[start:start + batch_size]
+        with transaction.atomic():
+            changed += (Book.objects
+                        .filter(pk__in=batch)
+                        .exclude(is_published=status)
+                        .update(is_published=status, update_time=timezone.now()))
+            genres = set(Book.genres.through.objects
+                         .filter(book_id__in=batch)
+                         .values_list('genres_id', 'genres__slug')
+                         .distinct())
+            refresh_genre_counts(pk for pk, _ in genres)
+            invalidate_namespaces(BOOKS, *[genre_namespace(slug) for _, slug in genres])
+    logger.info("Set status %s on %s books", status, changed)
+    return changed
@@ -0,0 +1,175 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from books.caching import (BOOKS, GENRE_CLOUD, GENRES, TAGS, genre_namespace,
+                           invalidate_namespaces, refresh_genre_counts,
+                           user_namespace)
+from books.images import schedule_renditions
+from books.models import Book, BookImageRendition, Genres
+
+logger = logging.getLogger(__name__)
+
+
+def _was_published(book):
+    """
+    Returns True if the book was published before the current change.
+    """
+    return book.get_loaded_value('is_published', default=False) == Book.Status.PUBLISHED
+
+
+def _genre_namespaces(slugs):
+    return [genre_namespace(slug) for slug in slugs]
+
+
+def _search_fields_changed(book):
+    """
+    Returns True if a field indexed by the search vector has changed.
+    """
+    return any(book.get_loaded_value(name) != getattr(book, name) for name in ('title', 'description'))
+
+
+def _image_changed(book):
+    """
+    Returns True if a different image file has been stored for the book.
+    """
+    return str(book.get_loaded_value('image') or '') != (book.image.name or '')
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, **kwargs):
+    """
+    Invalidates the public pages that show the saved book and refreshes the genre
+    counts when the book is published or unpublished, the search vector when
+    the title or description has changed and the image renditions when a new image is uploaded.
+    Drafts that stay drafts are not visible anywhere, so no pages are invalidated for them.
+    """
+    if created or _search_fields_changed(instance):
+        Book.objects.filter(pk=instance.pk).update_search_vector()
+    if created or _image_changed(instance):
+        if instance.image:
+            schedule_renditions(instance.pk)
+        else:
+            instance.renditions.all().delete()
+    is_published = instance.is_published == Book.Status.PUBLISHED
+    if created:
+        # A new book has no genres yet, they are added through m2m_changed
+        if is_published:
+            invalidate_namespaces(BOOKS)
+        return
+    was_published = _was_published(instance)
+    if not (is_published or was_published):
+        return
+    genres = list(instance.genres.values_list('pk', 'slug'))
+    invalidate_namespaces(BOOKS, *_genre_namespaces(slug for _, slug in genres))
+    if is_published != was_published:
+        refresh_genre_counts(pk for pk, _ in genres)
+
+
+@receiver(pre_delete, sender=Book)
+def book_deleting(sender, instance, **kwargs):
+    """
+    Remembers the genres of a book before its genre links are deleted.
+    """
+    instance._deleted_genres = list(instance.genres.values_list('pk', 'slug'))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    """
+    Invalidates the pages and genre lists that showed the deleted book.
+    """
+    genres = getattr(instance, '_deleted_genres', [])
+    if instance.author_id and genres:
+        invalidate_namespaces(user_namespace(instance.author_id))
+    if instance.is_published == Book.Status.PUBLISHED:
+        invalidate_namespaces(BOOKS, *_genre_namespaces(slug for _, slug in genres))
+        refresh_genre_counts(pk for pk, _ in genres)
+
+
+@receiver(m2m_changed, sender=Book.genres.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keeps genre counts, genre pages, per-user genre lists and search vectors in sync
+    when books are retagged.
+    """
+    if action == 'pre_clear':
+        if reverse:
+            books = list(Book.objects.filter(genres=instance).values_list('pk', 'author_id'))
+            instance._cleared_books = [pk for pk, _ in books]
+            instance._cleared_authors = {author_id for _, author_id in books}
+        else:
+            instance._cleared_genres = list(instance.genres.values_list('pk', 'slug'))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        # instance is a genre and pk_set holds book ids
+        if action == 'post_clear':
+            book_ids, authors = instance._cleared_books, instance._cleared_authors
+        else:
+            book_ids = pk_set
+            authors = set(Book.objects.filter(pk__in=pk_set).values_list('author_id', flat=True))
+        Book.objects.filter(pk__in=book_ids).update_search_vector()
+        invalidate_namespaces(genre_namespace(instance.slug),
+                              *[user_namespace(author_id) for author_id in authors if author_id])
+        refresh_genre_counts([instance.pk])
+        return
+
+    # instance is a book and pk_set holds genre ids
+    Book.objects.filter(pk=instance.pk).update_search_vector()
+    if instance.author_id:
+        invalidate_namespaces(user_namespace(instance.author_id))
+    if instance.is_published != Book.Status.PUBLISHED:
+        return
+    if action == 'post_clear':
+        genres = instance._cleared_genres
+    else:
+        genres = list(Genres.objects.filter(pk__in=pk_set).values_list('pk', 'slug'))
+    invalidate_namespaces(*_genre_namespaces(slug for _, slug in genres))
+    refresh_genre_counts(pk for pk, _ in genres)
+
+
+@receiver(post_save, sender=Genres)
+def genre_saved(sender, instance, created, **kwargs):
+    """
+    Invalidates the pages and genre lists that show the genre name. A new genre has no books yet.
+    """
+    if created:
+        return
+    if instance.get_loaded_value('genre') != instance.genre:
+        Book.objects.filter(genres=instance).update_search_vector()
+    old_slug = instance.get_loaded_value('slug', default=instance.slug)
+    invalidate_namespaces(TAGS, GENRE_CLOUD, GENRES, genre_namespace(instance.slug), genre_namespace(old_slug))
+
+
+@receiver(pre_delete, sender=Genres)
+def genre_deleting(sender, instance, **kwargs):
+    """
+    Remembers the books of a genre before its book links are deleted.
+    """
+    instance._deleted_book_ids = list(Book.objects.filter(genres=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Genres)
+def genre_deleted(sender, instance, **kwargs):
+    """
+    Invalidates the pages of the deleted genre and the genre lists, and drops the
+    genre from the search vectors of its books.
+    """
+    Book.objects.filter(pk__in=getattr(instance, '_deleted_book_ids', [])).update_search_vector()
+    invalidate_namespaces(TAGS, GENRE_CLOUD, GENRES, genre_namespace(instance.slug))
+
+
+@receiver(post_delete, sender=BookImageRendition)
+def rendition_deleted(sender, instance, **kwargs):
+    """
+    Removes the file of a deleted rendition once the deletion is committed.
+    """
+    storage, name = instance.image.storage, instance.image.name
+    if name:
+        transaction.on_commit(lambda: storage.delete(name))
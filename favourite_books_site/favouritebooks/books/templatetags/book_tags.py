@@ -1,24 +1,63 @@
 from django import template
-from django.db.models import Count
 
-from books.models import Book, Genres
+from books.caching import get_genre_cloud, get_request_user_genres
+from books.models import BookImageRendition
 
 register = template.Library()
 
 @register.inclusion_tag('books/list_tags.html')
 def show_all_tags():
     '''
-    Select only those tags that are related to at least one book
+    Select only those tags that are related to at least one published book (cached genre cloud)
     '''
-    return {'tags': Genres.objects.annotate(total=Count('genres')).filter(total__gt=0)}
+    return {'tags': get_genre_cloud()}
 
 
 @register.inclusion_tag('books/list_user_tags.html', takes_context=True)
 def show_user_tags(context):
-    request = context['request']
-    user = request.user
-    # Get genre IDs related the current user's books
-    user_genre_ids = Book.objects.filter(author=user).values_list('genres', flat=True)
-    # Fetch distinct genres associated with the user's books
-    tags = Genres.objects.filter(id__in=user_genre_ids).distinct()
-    return {'tags': tags}
\ No newline at end of file
+    # Genres related to the current user's books (cached per user, shared with the view)
+    return {'tags': get_request_user_genres(context['request'])}
+
+
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor):
+    '''
+    Query string of the current page with the cursor replaced, keeping the other parameters (e.g. the search query)
+    '''
+    query = context['request'].GET.copy()
+    query['cursor'] = cursor
+    return f'?{query.urlencode()}'
+
+
+# Rendered width of every rendition kind, used as the `sizes` attribute of the picture
+IMAGE_SIZES = {
+    BookImageRendition.Kind.THUMB: '(max-width: 736px) 100vw, 33vw',
+    BookImageRendition.Kind.DETAIL: '(max-width: 736px) 100vw, 500px',
+}
+
+
+@register.inclusion_tag('books/book_image.html')
+def book_image(book, kind=BookImageRendition.Kind.THUMB):
+    '''
+    Picture of a book: resized renditions with srcset once they are built, otherwise the original image
+    '''
+    # Only renditions of the current image (uses the prefetched renditions when available)
+    renditions = [r for r in book.renditions.all() if r.source == book.image.name] if book.image else []
+    srcsets = {}
+    fallback = None
+    for rendition in sorted(renditions, key=lambda r: r.width):
+        candidates = srcsets.setdefault(rendition.format, {})
+        # A small original gives renditions of the same width, list each width once
+        candidates.setdefault(rendition.width, rendition.image.url)
+        if rendition.kind == kind and rendition.format == BookImageRendition.Format.JPEG:
+            fallback = rendition
+    return {
+        'book': book,
+        'fallback': fallback,
+        'webp_srcset': ', '.join(f'{url} {width}w' for width, url in
+                                 srcsets.get(BookImageRendition.Format.WEBP, {}).items()),
+        'jpeg_srcset': ', '.join(f'{url} {width}w' for width, url in
+                                 srcsets.get(BookImageRendition.Format.JPEG, {}).items()),
+        'sizes': IMAGE_SIZES[kind],
+        'lazy': kind == BookImageRendition.Kind.THUMB,
+    }
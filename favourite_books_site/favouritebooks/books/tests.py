@@ -1,13 +1,50 @@
 from http import HTTPStatus
+import gzip
+import importlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-from django.test import TestCase
-from django.urls import reverse
+from asgiref.sync import iscoroutinefunction
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.checks import Tags, run_checks
+from django.core.exceptions import ValidationError
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.template.response import TemplateResponse
+from django.test import LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
 
 from books.models import Book
 from django.contrib.auth import get_user_model
-from books.models import Genres, Comment
+from books.models import Genres, Comment, LikedComment, BookImageRendition, OutboxEmail, BookPopularity
 from django.contrib.auth.models import Permission
+from books.benchmarks import (ROUTES, compare_with_baseline, load_baseline, measure_routes,
+                              named_routes, seed_site)
+from books.caching import get_cache_stats, get_genre_cloud, get_user_genres
+from books.pagination import CursorPaginator, EstimatedCountPaginator, ThreadPaginator
+from books.images import build_renditions
+from books.log import JsonFormatter, QueueListenerHandler
+from books.popularity import refresh_popularity
+from books.profiling import ProfilingMiddleware, get_route_stats
+from books.publishing import set_books_status
 from django.test import Client
+from PIL import Image
+from captcha.models import CaptchaStore
+from smtplib import SMTPRecipientsRefused
+from django.utils import timezone
 
 
 class GetPagesTestCase(TestCase):
@@ -26,6 +63,7 @@ class GetPagesTestCase(TestCase):
 
     def setUp(self):
         "init"
+        cache.clear()
 
 
     def test_main_page(self):
@@ -99,6 +137,7 @@ class GetPagesTestCase(TestCase):
 
 class BooksFlowsTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.user = get_user_model().objects.create_user(username='testuser', password='testpass', email='test@example.com')
         self.user2 = get_user_model().objects.create_user(username='otheruser', password='testpass2', email='other@example.com')
         self.genre = Genres.objects.create(genre='Fiction', slug='fiction')
@@ -227,3 +266,1410 @@ class BooksFlowsTestCase(TestCase):
         response = self.client.get(reverse('add_book'))
         self.assertEqual(response.status_code, 302)
         self.assertIn(reverse('users:login'), response.url)
+
+
+class CommentListQueriesTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='reader', password='testpass')
+        self.book = Book.objects.create(title='Queries', description='Desc', is_published=1, author=self.user)
+        self.url = reverse('book', kwargs={'book_slug': self.book.slug})
+
+    def add_comments(self, count):
+        for i in range(count):
+            author = get_user_model().objects.create(username=f'commenter{self.book.comments.count()}')
+            comment = Comment.objects.create(book=self.book, author=author, content=f'Comment {i}')
+            comment.toggle_like(self.user)
+            comment.toggle_like(author)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_comment_section_query_count_is_constant(self):
+        self.client.force_login(self.user)
+        self.add_comments(1)
+        one_comment = self.count_queries()
+        self.add_comments(4)
+        five_comments = self.count_queries()
+        self.assertEqual(one_comment, five_comments)
+
+    def test_liked_by_me_and_likes_count(self):
+        self.add_comments(1)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        comment = response.context['comments_page'][0]
+        self.assertTrue(comment.liked_by_me)
+        self.assertEqual(comment.likes_count, 2)
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertFalse(response.context['comments_page'][0].liked_by_me)
+
+
+class CommentLikesCounterTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='liker', password='testpass')
+        self.book = Book.objects.create(title='Likes', description='Desc', is_published=1, author=self.user)
+        self.comment = Comment.objects.create(book=self.book, author=self.user, content='Like me')
+        self.url = reverse('like_comment', kwargs={'comment_id': self.comment.id})
+
+    def test_toggle_updates_stored_counter(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url)
+        self.assertEqual(response.json(), {'liked': True, 'likes_count': 1})
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+        response = self.client.post(self.url)
+        self.assertEqual(response.json(), {'liked': False, 'likes_count': 0})
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 0)
+
+    def test_likes_are_stored_once_per_user(self):
+        self.comment.toggle_like(self.user)
+        like = LikedComment.objects.get(comment=self.comment, user=self.user)
+        self.assertIsNotNone(like.created_at)
+        self.assertEqual(list(self.comment.likes.all()), [self.user])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            LikedComment.objects.create(comment=self.comment, user=self.user)
+
+    def test_like_unknown_comment(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('like_comment', kwargs={'comment_id': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_rebuild_counters_command(self):
+        self.comment.likes.add(self.user)
+        Comment.objects.filter(pk=self.comment.pk).update(likes_count=42)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+
+
+class PageCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='cacher', password='testpass')
+        self.genre = Genres.objects.create(genre='Drama')
+        self.other_genre = Genres.objects.create(genre='Poetry')
+        self.book = Book.objects.create(title='Cached', description='Desc', is_published=1, author=self.user)
+        self.book.genres.add(self.genre)
+
+    def test_anonymous_pages_are_served_from_cache(self):
+        self.client.get(reverse('books'))
+        # Only the watermark of the published books is read
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('books'))
+        self.assertContains(response, 'Cached')
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_authenticated_pages_are_not_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('books'))
+        self.client.get(reverse('books'))
+        self.assertEqual(get_cache_stats(), {'hits': 0, 'misses': 0})
+
+    def test_book_changes_invalidate_listing(self):
+        self.client.get(reverse('books'))
+        Book.objects.create(title='Fresh', description='Desc', is_published=1, author=self.user)
+        self.assertContains(self.client.get(reverse('books')), 'Fresh')
+        self.book.title = 'Renamed'
+        self.book.save()
+        self.assertContains(self.client.get(reverse('books')), 'Renamed')
+
+    def test_retagging_invalidates_only_affected_genres(self):
+        drama_url = reverse('tag', kwargs={'tag_slug': self.genre.slug})
+        poetry_url = reverse('tag', kwargs={'tag_slug': self.other_genre.slug})
+        self.client.get(drama_url)
+        self.client.get(poetry_url)
+        self.client.get(reverse('home'))
+        self.book.genres.set([self.other_genre])
+        self.assertNotContains(self.client.get(drama_url), 'Cached')
+        self.assertContains(self.client.get(poetry_url), 'Cached')
+        # The home page does not depend on book genres
+        self.client.get(reverse('home'))
+        self.assertEqual(get_cache_stats()['hits'], 1)
+
+    def test_draft_changes_keep_cache(self):
+        draft = Book.objects.create(title='Draft', description='Desc', is_published=0, author=self.user)
+        self.client.get(reverse('books'))
+        draft.description = 'Still a draft'
+        draft.save()
+        self.client.get(reverse('books'))
+        self.assertEqual(get_cache_stats()['hits'], 1)
+        draft.is_published = Book.Status.PUBLISHED
+        draft.save()
+        self.assertContains(self.client.get(reverse('books')), 'Draft')
+
+    def test_deploy_check_requires_shared_cache(self):
+        checks = run_checks(include_deployment_checks=True, tags=[Tags.caches])
+        self.assertIn('books.W001', [check.id for check in checks])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+                             'LOCATION': 'redis://localhost:6379/0'}}
+        with override_settings(CACHES=redis):
+            checks = run_checks(include_deployment_checks=True, tags=[Tags.caches])
+        self.assertNotIn('books.W001', [check.id for check in checks])
+
+
+class GenreCloudTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='tagger', password='testpass')
+        self.drama = Genres.objects.create(genre='Drama')
+        self.poetry = Genres.objects.create(genre='Poetry')
+        self.book = Book.objects.create(title='Tagged', description='Desc', is_published=1, author=self.user)
+
+    def cloud(self):
+        return {tag.genre: tag.books_count for tag in get_genre_cloud()}
+
+    def test_cloud_follows_retagging_and_publication(self):
+        self.assertEqual(self.cloud(), {})
+        self.book.genres.add(self.drama, self.poetry)
+        self.assertEqual(self.cloud(), {'Drama': 1, 'Poetry': 1})
+        self.book.genres.remove(self.poetry)
+        self.assertEqual(self.cloud(), {'Drama': 1})
+        self.book.is_published = Book.Status.DRAFT
+        self.book.save()
+        self.assertEqual(self.cloud(), {})
+        self.book.is_published = Book.Status.PUBLISHED
+        self.book.save()
+        self.assertEqual(self.cloud(), {'Drama': 1})
+        self.book.delete()
+        self.assertEqual(self.cloud(), {})
+
+    def test_cloud_is_read_from_cache(self):
+        self.book.genres.add(self.drama)
+        get_genre_cloud()
+        with self.assertNumQueries(0):
+            get_genre_cloud()
+
+    def test_user_genres_with_counts(self):
+        self.book.genres.add(self.drama)
+        draft = Book.objects.create(title='Draft', description='Desc', is_published=0, author=self.user)
+        draft.genres.add(self.drama, self.poetry)
+        tags = {tag.genre: tag.user_books_count for tag in get_user_genres(self.user)}
+        self.assertEqual(tags, {'Drama': 2, 'Poetry': 1})
+        with self.assertNumQueries(0):
+            get_user_genres(self.user)
+        self.poetry.genre = 'Verse'
+        self.poetry.save()
+        tags = {tag.genre: tag.user_books_count for tag in get_user_genres(self.user)}
+        self.assertEqual(tags, {'Drama': 2, 'Verse': 1})
+        draft.delete()
+        self.assertEqual([tag.genre for tag in get_user_genres(self.user)], ['Drama'])
+
+
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='pager', password='testpass')
+        for i in range(10):
+            Book.objects.create(title=f'Paged {i}', description='Desc', is_published=1, author=self.user)
+        # Same creation time for several books: the id breaks the tie
+        Book.objects.filter(title__in=['Paged 3', 'Paged 4', 'Paged 5']).update(
+            time_create=Book.objects.get(title='Paged 4').time_create)
+        self.ordered = list(Book.objects.order_by('-time_create', '-id').values_list('title', flat=True))
+
+    def test_walk_forward_and_back(self):
+        paginator = CursorPaginator(Book.objects.all(), per_page=4)
+        page = paginator.page()
+        pages = [[book.title for book in page]]
+        self.assertFalse(page.has_previous())
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append([book.title for book in page])
+        self.assertEqual(sum(pages, []), self.ordered)
+        self.assertEqual([len(titles) for titles in pages], [4, 4, 2])
+
+        page = paginator.page(page.previous_cursor)
+        self.assertEqual([book.title for book in page], pages[1])
+        page = paginator.page(page.previous_cursor)
+        self.assertEqual([book.title for book in page], pages[0])
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        page = CursorPaginator(Book.objects.all(), per_page=4).page('not-a-cursor')
+        self.assertEqual([book.title for book in page], self.ordered[:4])
+
+    def test_books_view_uses_cursor_links(self):
+        response = self.client.get(reverse('books'))
+        page = response.context['page_obj']
+        self.assertContains(response, f'?cursor={page.next_cursor}')
+        response = self.client.get(reverse('books'), {'cursor': page.next_cursor})
+        self.assertEqual([book.title for book in response.context['books']], self.ordered[4:8])
+
+    def test_cursor_links_keep_other_parameters(self):
+        self.client.get(reverse('books'))
+        response = self.client.get(reverse('books'), {'utm_source': 'mail'})
+        page = response.context['page_obj']
+        self.assertContains(response, f'href="?utm_source=mail&amp;cursor={page.next_cursor}"')
+
+
+class BookSearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='reader', password='testpass')
+        self.genre = Genres.objects.create(genre='Mystery')
+        self.by_title = Book.objects.create(title='The Hound', description='Moor', is_published=1, author=self.user)
+        self.by_description = Book.objects.create(title='Dune', description='A desert hound story',
+                                                  is_published=1, author=self.user)
+        self.by_genre = Book.objects.create(title='Rebecca', description='Manderley', is_published=1,
+                                            author=self.user)
+        self.by_genre.genres.add(self.genre)
+        self.draft = Book.objects.create(title='Hound draft', description='Draft', is_published=0,
+                                         author=self.user)
+
+    def test_search_matches_title_description_and_genre(self):
+        found = set(Book.published.search('hound'))
+        self.assertEqual(found, {self.by_title, self.by_description})
+        self.assertEqual(list(Book.published.search('mystery')), [self.by_genre])
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'hound'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'The Hound')
+        self.assertNotContains(response, 'Hound draft')
+
+    def test_empty_query_returns_nothing(self):
+        response = self.client.get(reverse('search'), {'q': '  '})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.context['books']), 0)
+
+
+def make_image(width, height, name='cover.png'):
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height), (200, 30, 30, 128)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class BookImageRenditionsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS_SYNC=True)
+        self.settings_override.enable()
+        self.user = get_user_model().objects.create_user(username='painter', password='testpass')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def create_book(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Book.objects.create(title='Covered', description='Desc', is_published=1,
+                                       author=self.user, image=image)
+
+    def test_renditions_are_built_after_upload(self):
+        book = self.create_book(make_image(2000, 1000))
+        sizes = {(r.kind, r.format): (r.width, r.height) for r in book.renditions.all()}
+        self.assertEqual(sizes, {
+            ('thumb', 'webp'): (480, 240), ('thumb', 'jpeg'): (480, 240),
+            ('detail', 'webp'): (1200, 600), ('detail', 'jpeg'): (1200, 600),
+        })
+        self.assertTrue(all(r.source == book.image.name for r in book.renditions.all()))
+
+    def test_small_images_are_not_upscaled(self):
+        book = self.create_book(make_image(300, 400))
+        self.assertEqual(set(book.renditions.values_list('width', 'height')), {(300, 400)})
+
+    def test_new_image_replaces_renditions(self):
+        book = self.create_book(make_image(2000, 1000))
+        old_files = [r.image.path for r in book.renditions.all()]
+        book = Book.objects.get(pk=book.pk)
+        book.image = make_image(1000, 1000, name='other.png')
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertEqual(book.renditions.count(), 4)
+        self.assertTrue(all(r.source == book.image.name for r in book.renditions.all()))
+        self.assertFalse(any(os.path.exists(path) for path in old_files))
+
+    def test_list_page_uses_srcset(self):
+        self.create_book(make_image(2000, 1000))
+        response = self.client.get(reverse('books'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '480w')
+        self.assertContains(response, '1200w')
+
+    def test_original_is_shown_until_renditions_exist(self):
+        book = Book.objects.create(title='Pending', description='Desc', is_published=1,
+                                   author=self.user, image=make_image(800, 600))
+        self.assertFalse(BookImageRendition.objects.exists())
+        response = self.client.get(book.get_absolute_url())
+        self.assertContains(response, book.image.url)
+        self.assertNotContains(response, 'srcset')
+
+    def test_failed_build_removes_written_files(self):
+        book = Book.objects.create(title='Pending', description='Desc', is_published=1,
+                                   author=self.user, image=make_image(2000, 1000))
+        save = BookImageRendition.save
+        calls = []
+
+        def failing_save(rendition, *args, **kwargs):
+            calls.append(rendition)
+            if len(calls) == 3:
+                raise IntegrityError('rendition row rejected')
+            return save(rendition, *args, **kwargs)
+
+        with mock.patch.object(BookImageRendition, 'save', failing_save), self.assertRaises(IntegrityError):
+            build_renditions(book.pk)
+        self.assertFalse(book.renditions.exists())
+        self.assertEqual([name for _, _, names in os.walk(os.path.join(self.media_root, 'book_images', 'renditions'))
+                          for name in names], [])
+
+    def test_build_renditions_command(self):
+        book = self.create_book(make_image(2000, 1000))
+        book.renditions.all().delete()
+        call_command('build_renditions', stdout=StringIO())
+        self.assertEqual(book.renditions.count(), 4)
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """
+    Locmem backend that counts opened connections and refuses recipients at bad.example.com.
+    """
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            refused = [r for r in message.recipients() if r.endswith('@bad.example.com')]
+            if refused:
+                raise SMTPRecipientsRefused({r: (550, b'No such user') for r in refused})
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='books.outbox.OutboxEmailBackend',
+                   OUTBOX_DELIVERY_BACKEND='books.tests.CountingEmailBackend',
+                   OUTBOX_RETRY_DELAY=60, OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        self.user = get_user_model().objects.create_user(username='writer', password='testpass')
+
+    @override_settings(EMAIL_HOST_USER='site@example.com')
+    def test_feedback_is_only_queued(self):
+        self.client.login(username='writer', password='testpass')
+        key = CaptchaStore.generate_key()
+        response = self.client.post(reverse('feedback'), {
+            'name': 'Writer', 'email': 'writer@example.com', 'content': 'Hello',
+            'captcha_0': key, 'captcha_1': CaptchaStore.objects.get(hashkey=key).response,
+        })
+        self.assertRedirects(response, reverse('feedback_success'))
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.reply_to, ['writer@example.com'])
+        self.assertIn('Message: Hello', email.body)
+
+    def test_batch_is_sent_over_one_connection(self):
+        for i in range(3):
+            mail.send_mail(f'Subject {i}', 'Body', 'site@example.com', [f'user{i}@example.com'],
+                           html_message='<p>Body</p>')
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.Status.PENDING).count(), 3)
+
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.Status.SENT).exists())
+
+    def test_failed_email_is_retried_with_backoff(self):
+        mail.send_mail('Good', 'Body', 'site@example.com', ['user@example.com'])
+        mail.send_mail('Bad', 'Body', 'site@example.com', ['user@bad.example.com'])
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual([message.subject for message in mail.outbox], ['Good'])
+
+        bad = OutboxEmail.objects.get(subject='Bad')
+        self.assertEqual((bad.status, bad.attempts), (OutboxEmail.Status.PENDING, 1))
+        self.assertIn('SMTPRecipientsRefused', bad.last_error)
+        self.assertGreater(bad.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+        # Not due yet
+        call_command('send_outbox', stdout=StringIO())
+        self.assertEqual(OutboxEmail.objects.get(subject='Bad').attempts, 1)
+
+        OutboxEmail.objects.filter(subject='Bad').update(next_attempt_at=timezone.now())
+        call_command('send_outbox', stdout=StringIO())
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), (OutboxEmail.Status.FAILED, 2))
+
+
+class RouteQueryCountTestCase(TestCase):
+    """
+    Small-scale run of the route benchmark: no route may use more queries than in the baseline
+    (books/benchmark_baseline.json, see `python manage.py bench_routes`).
+    """
+    def test_every_route_is_benchmarked(self):
+        self.assertEqual(set(named_routes()) - set(ROUTES), set())
+
+    def test_query_counts_within_baseline(self):
+        data = seed_site(users=5, books=30, genres=4, comments=40, likes=60)
+        results = measure_routes(data, repeat=0)
+        self.assertEqual(compare_with_baseline(results, load_baseline(), size_tolerance=None), [])
+
+
+class BookObjectQueriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='owner', password='testpass')
+        self.book = Book.objects.create(title='Single', description='Desc', is_published=1, author=self.user)
+        self.book.genres.add(Genres.objects.create(genre='Drama'))
+        self.client.login(username='owner', password='testpass')
+
+    def book_queries(self, url, method='get', data=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, data)
+        return response, [q['sql'] for q in captured.captured_queries
+                          if q['sql'].startswith('SELECT') and 'FROM "books_book"' in q['sql']]
+
+    def test_book_is_loaded_once(self):
+        for name in ('book', 'edit_book', 'delete_book'):
+            with self.subTest(name):
+                response, queries = self.book_queries(reverse(name, kwargs={'book_slug': self.book.slug}))
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(len(queries), 1, queries)
+                self.assertIn('"auth_user"', queries[0])
+
+    def test_comment_post_loads_book_once(self):
+        response, queries = self.book_queries(self.book.get_absolute_url(), 'post', {'content': 'Nice'})
+        self.assertRedirects(response, self.book.get_absolute_url())
+        self.assertEqual(len(queries), 1, queries)
+        self.assertTrue(Comment.objects.filter(book=self.book, content='Nice').exists())
+
+    def test_other_users_cannot_edit(self):
+        self.client.logout()
+        response = self.client.get(reverse('edit_book', kwargs={'book_slug': self.book.slug}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+class BookListingQueriesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.genre = Genres.objects.create(genre='Poetry')
+        self.user = get_user_model().objects.create_user(username='lister', password='testpass')
+        for i in range(4):
+            author = get_user_model().objects.create_user(username=f'author{i}', password='testpass')
+            book = Book.objects.create(title=f'Listed {i}', description='word ' * 1000, is_published=1, author=author)
+            book.genres.add(self.genre)
+            Book.objects.create(title=f'Mine {i}', description='word ' * 1000, is_published=1,
+                                author=self.user).genres.add(self.genre)
+
+    def test_listing_loads_excerpt_instead_of_description(self):
+        book = Book.published.for_listing().get(title='Listed 0')
+        self.assertEqual(book.get_deferred_fields(), {'description', 'search_vector'})
+        self.assertEqual(book.excerpt, 'word ' * 24 + 'word…')
+
+    def test_excerpt_follows_description(self):
+        book = Book.objects.get(title='Listed 0')
+        book.description = 'Short\nstory'
+        book.save(update_fields=['description'])
+        self.assertEqual(Book.objects.get(pk=book.pk).excerpt, 'Short\nstory')
+
+    def test_backfill_excerpts_command(self):
+        Book.objects.update(excerpt='')
+        out = StringIO()
+        call_command('backfill_excerpts', stdout=out)
+        self.assertIn('Updated the excerpt of 8 books', out.getvalue())
+        self.assertFalse(Book.objects.filter(excerpt='').exists())
+
+    def test_cards_do_not_query_per_book(self):
+        self.client.login(username='lister', password='testpass')
+        urls = [reverse('books'), reverse('tag', kwargs={'tag_slug': self.genre.slug}),
+                reverse('user_books'), reverse('user_books_by_tag', kwargs={'tag_slug': self.genre.slug})]
+        for url in urls:
+            with self.subTest(url), CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertEqual(len(response.context['books']), 4)
+                author_queries = [q for q in captured.captured_queries
+                                  if q['sql'].startswith('SELECT') and 'FROM "auth_user"' in q['sql']]
+                # Only the session user is loaded, authors come with the books
+                self.assertEqual(len(author_queries), 1)
+                self.assertContains(response, 'word word')
+
+
+class UniqueSlugTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='slugger', password='testpass')
+
+    def create(self, title, **kwargs):
+        return Book.objects.create(title=title, description='Desc', is_published=1, author=self.user, **kwargs)
+
+    def slug_queries(self, captured):
+        return [q for q in captured.captured_queries if '"books_book"."slug" LIKE' in q['sql']]
+
+    def test_collisions_resolved_with_one_query(self):
+        self.create('The Hobbit')
+        self.assertEqual([self.create('Dune').slug, self.create('Dune').slug], ['dune', 'dune-2'])
+        with CaptureQueriesContext(connection) as captured:
+            book = self.create('Dune')
+        self.assertEqual(book.slug, 'dune-3')
+        self.assertEqual(len(self.slug_queries(captured)), 1)
+        self.assertEqual(self.create('The').slug, 'the')
+
+    def test_slug_only_changes_with_title(self):
+        book = Book.objects.get(pk=self.create('Emma').pk)
+        book.description = 'New description'
+        with CaptureQueriesContext(connection) as captured:
+            book.save()
+        self.assertEqual(self.slug_queries(captured), [])
+        self.assertEqual(book.slug, 'emma')
+
+        book.title = 'Persuasion'
+        book.save(update_fields=['title'])
+        self.assertEqual(Book.objects.get(pk=book.pk).slug, 'persuasion')
+
+    def test_title_without_slug_characters(self):
+        self.assertEqual(self.create('!!!').slug, 'book')
+        self.assertEqual(Genres.objects.create(genre='***').slug, 'genres')
+
+    def test_concurrently_taken_slug_is_retried(self):
+        self.create('Ulysses')
+        original = Book.generate_unique_slug
+        calls = []
+
+        def stale_then_fresh(book):
+            # The first candidate was computed before the other book was saved
+            calls.append(1)
+            return 'ulysses' if len(calls) == 1 else original(book)
+
+        with mock.patch.object(Book, 'generate_unique_slug', stale_then_fresh):
+            book = self.create('Ulysses')
+        self.assertEqual(book.slug, 'ulysses-2')
+        self.assertEqual(len(calls), 2)
+
+
+class BookTransferTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='importer', password='testpass')
+        self.fantasy = Genres.objects.create(genre='Fantasy')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            file.write(content)
+        return path
+
+    def test_jsonl_import(self):
+        Book.objects.create(title='Dune', description='Desc', is_published=1, author=self.user)
+        path = self.write('books.jsonl', '\n'.join([
+            '{"title": "Dune", "description": "Spice", "author": "importer", "genres": ["fantasy", "unknown"]}',
+            '{"title": "Dune", "is_published": false, "time_create": "2001-02-03T04:05:06+00:00"}',
+            '{"description": "No title"}',
+            'not json',
+            '',
+            '{"title": "Emma", "slug": "emma-novel", "author": "nobody"}',
+        ]))
+        out = StringIO()
+        with CaptureQueriesContext(connection) as captured:
+            call_command('import_books', path, '--chunk-size', '2', stdout=out)
+        self.assertIn('Imported 3 books', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertFalse([q for q in captured.captured_queries if '"books_book"."slug" LIKE' in q['sql']][1:])
+
+        spice = Book.objects.get(slug='dune-2')
+        self.assertEqual((spice.author, spice.excerpt, list(spice.genres.all())), (self.user, 'Spice', [self.fantasy]))
+        draft = Book.objects.get(slug='dune-3')
+        self.assertEqual((draft.is_published, draft.time_create.year), (0, 2001))
+        self.assertIsNone(Book.objects.get(slug='emma-novel').author)
+        self.fantasy.refresh_from_db()
+        self.assertEqual(self.fantasy.books_count, 1)
+
+    def test_csv_round_trip_with_images(self):
+        images = os.path.join(self.directory, 'images')
+        os.makedirs(images)
+        Image.new('RGB', (10, 10), 'red').save(os.path.join(images, 'cover.png'))
+        path = self.write('books.csv', 'title,description,is_published,author,genres,image\n'
+                                       'Hobbit,"Line one\nline two",1,,fantasy|new-genre,cover.png\n'
+                                       'Silmarillion,,0,,,missing.png\n')
+        media = os.path.join(self.directory, 'media')
+        with override_settings(MEDIA_ROOT=media):
+            call_command('import_books', path, '--images-dir', images, '--author', 'importer',
+                         '--create-genres', stdout=StringIO())
+            hobbit = Book.objects.get(slug='hobbit')
+            self.assertTrue(os.path.isfile(hobbit.image.path))
+            self.assertEqual(Genres.objects.get(slug='new-genre').genre, 'New genre')
+
+            exported = os.path.join(self.directory, 'export.csv')
+            call_command('export_books', exported, stdout=StringIO())
+            Book.objects.all().delete()
+            call_command('import_books', exported, '--images-dir', media, stdout=StringIO())
+
+        hobbit = Book.objects.get(slug='hobbit')
+        self.assertEqual((hobbit.description, hobbit.author), ('Line one\nline two', self.user))
+        self.assertEqual(sorted(hobbit.genres.values_list('slug', flat=True)), ['fantasy', 'new-genre'])
+        self.assertTrue(hobbit.image)
+        silmarillion = Book.objects.get(slug='silmarillion')
+        self.assertEqual((silmarillion.is_published, bool(silmarillion.image)), (0, False))
+
+    def test_jsonl_export_streams_in_chunks(self):
+        for number in range(5):
+            book = Book.objects.create(title=f'Book {number}', description='Desc', is_published=number % 2,
+                                       author=self.user)
+            book.genres.add(self.fantasy)
+        path = os.path.join(self.directory, 'books.jsonl.gz')
+        with CaptureQueriesContext(connection) as captured:
+            call_command('export_books', path, '--published', '--chunk-size', '2', stdout=StringIO())
+        # Books and genres are read per chunk
+        self.assertLessEqual(len(captured), 4)
+        with gzip.open(path, 'rt', encoding='utf-8') as file:
+            rows = [json.loads(line) for line in file]
+        self.assertEqual([row['title'] for row in rows], ['Book 1', 'Book 3'])
+        self.assertEqual((rows[0]['author'], rows[0]['genres']), ('importer', ['fantasy']))
+
+
+class BookAdminTestCase(TestCase):
+    def setUp(self):
+        self.admin = get_user_model().objects.create_superuser(username='admin', password='testpass')
+        self.client.force_login(self.admin)
+        self.genres = [Genres.objects.create(genre=name) for name in ('Fantasy', 'Drama')]
+
+    def create_books(self, number):
+        for index in range(number):
+            author = get_user_model().objects.create_user(username=f'author-{Book.objects.count()}')
+            book = Book.objects.create(title=f'Book {index}', description='Desc', is_published=1, author=author)
+            book.genres.set(self.genres)
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('admin:books_book_changelist'), params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, len(captured)
+
+    def test_changelist_queries_do_not_depend_on_rows(self):
+        self.create_books(2)
+        _, few = self.changelist_queries()
+        self.create_books(8)
+        response, many = self.changelist_queries()
+        self.assertEqual(few, many)
+        self.assertContains(response, 'Drama, Fantasy', count=10)
+
+    def test_genre_filter_and_ordering(self):
+        self.create_books(3)
+        Book.objects.create(title='No genres', description='Desc', is_published=1)
+        response, _ = self.changelist_queries(genre='drama')
+        self.assertEqual(response.context_data['cl'].result_count, 3)
+        response, _ = self.changelist_queries(o='6')
+        self.assertEqual(response.context_data['cl'].result_list[0].title, 'No genres')
+
+    def test_estimated_count_paginator(self):
+        self.create_books(3)
+        paginator = EstimatedCountPaginator(Book.objects.order_by('pk'), 2)
+        # Only PostgreSQL has a row estimate: other databases are counted exactly
+        self.assertEqual(paginator.count, 3)
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=50000):
+            self.assertEqual(EstimatedCountPaginator(Book.objects.all(), 2).count, 50000)
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=100):
+            self.assertEqual(EstimatedCountPaginator(Book.objects.all(), 2).count, 3)
+        self.assertIsNone(EstimatedCountPaginator(Book.objects.filter(title='Book 1'), 2).estimated_count())
+
+
+class BulkPublishingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='moderator', password='testpass')
+        self.drama = Genres.objects.create(genre='Drama')
+        self.books = []
+        for number in range(6):
+            book = Book.objects.create(title=f'Bulk {number}', description='Desc', is_published=1, author=self.user)
+            book.genres.add(self.drama)
+            self.books.append(book)
+
+    def cloud(self):
+        return {tag.genre: tag.books_count for tag in get_genre_cloud()}
+
+    def test_status_change_updates_counters_and_pages(self):
+        self.assertContains(self.client.get(reverse('tag', kwargs={'tag_slug': 'drama'})), 'Bulk 5')
+        selected = Book.objects.filter(pk__in=[book.pk for book in self.books[3:]])
+        self.assertEqual(set_books_status(selected, Book.Status.DRAFT, batch_size=2), 3)
+        self.assertEqual(set_books_status(selected, Book.Status.DRAFT), 0)
+        self.assertEqual(self.cloud(), {'Drama': 3})
+        self.assertNotContains(self.client.get(reverse('tag', kwargs={'tag_slug': 'drama'})), 'Bulk 5')
+        self.assertGreater(Book.objects.get(pk=self.books[5].pk).update_time, self.books[5].update_time)
+
+    def test_queries_per_batch_do_not_depend_on_books(self):
+        with CaptureQueriesContext(connection) as one:
+            set_books_status(Book.objects.filter(pk=self.books[0].pk), Book.Status.DRAFT)
+        with CaptureQueriesContext(connection) as five:
+            set_books_status(Book.objects.all(), Book.Status.DRAFT)
+        self.assertEqual(len(one), len(five))
+        self.assertEqual(self.cloud(), {})
+
+    def test_admin_actions(self):
+        admin = get_user_model().objects.create_superuser(username='admin', password='testpass')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:books_book_changelist'),
+                                    {'action': 'set_draft', '_selected_action': [self.books[0].pk, self.books[1].pk]})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertEqual(self.cloud(), {'Drama': 4})
+        self.client.post(reverse('admin:books_book_changelist'),
+                         {'action': 'set_published', '_selected_action': [self.books[0].pk]})
+        self.assertEqual(self.cloud(), {'Drama': 5})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('set_books_status', 'draft', '--genre', 'drama', '--dry-run', stdout=out)
+        self.assertIn('6 books would be set to draft', out.getvalue())
+        path = os.path.join(tempfile.mkdtemp(), 'books.txt')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as file:
+            file.write(f'{self.books[0].pk}\n{self.books[1].slug}\n\n')
+        call_command('set_books_status', 'draft', '--file', path, '--slugs', self.books[2].slug, stdout=out)
+        self.assertIn('Set 3 books to draft', out.getvalue())
+        self.assertEqual(self.cloud(), {'Drama': 3})
+        call_command('set_books_status', 'published', '--author', 'moderator', stdout=out)
+        self.assertEqual(self.cloud(), {'Drama': 6})
+        with self.assertRaises(CommandError):
+            call_command('set_books_status', 'draft', stdout=out)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='reader', password='testpass')
+        self.other = get_user_model().objects.create_user(username='other', password='testpass')
+        self.book = Book.objects.create(title='Validators', description='Desc', is_published=1, author=self.user)
+        self.comment = Comment.objects.create(book=self.book, author=self.other, content='First')
+
+    def revalidate(self, url, response, **headers):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **headers)
+
+    def test_anonymous_listing_revalidates_with_one_query(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn('Cookie', response['Vary'])
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            not_modified = self.revalidate(url, response)
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+
+        Book.objects.create(title='Another', description='Desc', is_published=1, author=self.user)
+        self.assertEqual(self.revalidate(url, response).status_code, HTTPStatus.OK)
+        self.assertEqual(self.revalidate(url + '?cursor=x', response).status_code, HTTPStatus.OK)
+
+    def test_listing_follows_changes_of_other_processes(self):
+        url = reverse('books')
+        response = self.client.get(url)
+        # A queryset update skips the signals, like a change whose invalidation never reaches
+        # this process: the cache versions stay the same, the watermark moves
+        Book.objects.filter(pk=self.book.pk).update(title='Changed elsewhere', update_time=timezone.now())
+        changed = self.revalidate(url, response)
+        self.assertEqual(changed.status_code, HTTPStatus.OK)
+        self.assertContains(changed, 'Changed elsewhere')
+        Book.objects.filter(pk=self.book.pk).update(is_published=0)
+        self.assertNotContains(self.revalidate(url, changed), 'Changed elsewhere')
+
+    def test_book_page_follows_comments_and_user(self):
+        url = self.book.get_absolute_url()
+        self.client.force_login(self.other)
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        not_modified = self.revalidate(url, response)
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(not_modified.templates, [])
+
+        self.comment.toggle_like(self.user)
+        liked = self.revalidate(url, response)
+        self.assertEqual(liked.status_code, HTTPStatus.OK)
+        self.comment.delete()
+        self.assertEqual(self.revalidate(url, liked).status_code, HTTPStatus.OK)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.revalidate(url, response).status_code, HTTPStatus.OK)
+
+    def test_user_books_last_modified(self):
+        url = reverse('user_books')
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         HTTPStatus.NOT_MODIFIED)
+        self.assertEqual(self.revalidate(url, response).status_code, HTTPStatus.NOT_MODIFIED)
+        self.book.description = 'Changed'
+        self.book.save()
+        self.assertEqual(self.revalidate(url, response).status_code, HTTPStatus.OK)
+
+    def test_refused_requests_are_not_validated(self):
+        draft = Book.objects.create(title='Secret', description='Desc', is_published=0, author=self.user)
+        self.client.force_login(self.other)
+        response = self.client.get(draft.get_absolute_url())
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class BooksApiTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='client', password='testpass')
+        self.other = get_user_model().objects.create_user(username='stranger', password='testpass')
+        self.drama = Genres.objects.create(genre='Drama')
+        self.poetry = Genres.objects.create(genre='Poetry')
+        self.books = []
+        for number in range(5):
+            book = Book.objects.create(title=f'Api {number}', description=f'Description {number}',
+                                       is_published=1, author=self.user)
+            book.genres.add(self.drama)
+            self.books.append(book)
+        self.draft = Book.objects.create(title='Api draft', description='Desc', is_published=0, author=self.user)
+
+    def post_json(self, url, data, method='post'):
+        return getattr(self.client, method)(url, json.dumps(data), content_type='application/json')
+
+    def test_book_list_pages_fields_and_embeds(self):
+        url = reverse('api:books')
+        with self.assertNumQueries(2):
+            data = self.client.get(url, {'limit': 2, 'fields': 'slug,title', 'include': 'genres'}).json()
+        self.assertEqual(data['results'], [
+            {'slug': 'api-4', 'title': 'Api 4', 'genres': [{'slug': 'drama', 'genre': 'Drama'}]},
+            {'slug': 'api-3', 'title': 'Api 3', 'genres': [{'slug': 'drama', 'genre': 'Drama'}]},
+        ])
+        self.assertIsNone(data['previous'])
+        second = self.client.get(data['next']).json()
+        self.assertEqual([book['slug'] for book in second['results']], ['api-2', 'api-1'])
+        self.assertIn('fields=slug%2Ctitle', second['next'])
+
+        default = self.client.get(url).json()['results']
+        self.assertEqual(len(default), 5)
+        self.assertNotIn('description', default[0])
+        self.assertEqual((default[0]['author'], default[0]['url']), ('client', self.books[4].get_absolute_url()))
+        self.assertEqual(self.client.get(url, {'fields': 'secret'}).status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_book_list_filters(self):
+        self.books[0].genres.set([self.poetry])
+        url = reverse('api:books')
+        self.assertEqual([book['slug'] for book in self.client.get(url, {'genre': 'poetry'}).json()['results']],
+                         ['api-0'])
+        self.assertEqual(self.client.get(url, {'mine': 1}).status_code, HTTPStatus.UNAUTHORIZED)
+        self.client.force_login(self.user)
+        self.assertEqual(len(self.client.get(url, {'mine': 1}).json()['results']), 6)
+
+    def test_book_detail_visibility(self):
+        self.assertEqual(self.client.get(reverse('api:book', kwargs={'book_slug': 'api-1'})).json()['description'],
+                         'Description 1')
+        draft_url = reverse('api:book', kwargs={'book_slug': self.draft.slug})
+        self.assertEqual(self.client.get(draft_url).status_code, HTTPStatus.NOT_FOUND)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(draft_url).json()['is_published'], False)
+
+    def test_book_writes(self):
+        url = reverse('api:books')
+        self.assertEqual(self.post_json(url, {'title': 'New'}).status_code, HTTPStatus.UNAUTHORIZED)
+        self.client.force_login(self.user)
+        response = self.post_json(url, {'title': 'New', 'description': 'Text', 'genres': ['poetry']})
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual((response.json()['slug'], response['Location']), ('new', '/api/books/new/'))
+        self.assertEqual(list(Book.objects.get(slug='new').genres.all()), [self.poetry])
+        invalid = self.post_json(url, {'genres': ['unknown']})
+        self.assertEqual(invalid.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertEqual(set(invalid.json()['errors']), {'title', 'genres'})
+
+        book_url = reverse('api:book', kwargs={'book_slug': 'new'})
+        changed = self.post_json(book_url, {'is_published': False}, method='patch').json()
+        self.assertEqual((changed['title'], changed['is_published']), ('New', False))
+        self.assertEqual(list(Book.objects.get(slug='new').genres.all()), [self.poetry])
+
+        self.client.force_login(self.other)
+        self.assertEqual(self.post_json(reverse('api:book', kwargs={'book_slug': 'api-1'}), {}, method='patch')
+                         .status_code, HTTPStatus.FORBIDDEN)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.delete(book_url).status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(Book.objects.filter(slug='new').exists())
+
+    def test_comments(self):
+        url = reverse('api:comments', kwargs={'book_slug': 'api-1'})
+        self.client.force_login(self.other)
+        first = self.post_json(url, {'content': 'Great'}).json()
+        reply = self.post_json(url, {'content': 'Agreed', 'parent': first['id']}).json()
+        self.assertEqual((reply['parent'], reply['author']), (first['id'], 'stranger'))
+        self.assertEqual(self.post_json(url, {'content': 'x', 'parent': 'no'}).status_code, HTTPStatus.BAD_REQUEST)
+
+        like = self.client.post(reverse('api:like_comment', kwargs={'comment_id': first['id']})).json()
+        self.assertEqual(like, {'liked': True, 'likes_count': 1})
+        # Book, comments, session, user, likes
+        with self.assertNumQueries(5):
+            comments = self.client.get(url, {'include': 'liked', 'fields': 'id,likes_count'}).json()['results']
+        self.assertEqual(comments, [{'id': reply['id'], 'likes_count': 0, 'liked': False},
+                                    {'id': first['id'], 'likes_count': 1, 'liked': True}])
+
+        self.client.force_login(self.user)
+        comment_url = reverse('api:comment', kwargs={'comment_id': first['id']})
+        self.assertEqual(self.client.delete(comment_url).status_code, HTTPStatus.FORBIDDEN)
+        self.client.force_login(self.other)
+        with self.assertLogs('books.api', 'INFO') as logs:
+            self.assertEqual(self.client.delete(comment_url).status_code, HTTPStatus.NO_CONTENT)
+        self.assertIn(f"Comment (id={first['id']}) deleted", logs.output[0])
+
+    def test_genres(self):
+        response = self.client.get(reverse('api:genres'))
+        self.assertEqual(response.json()['results'], [
+            {'id': self.drama.pk, 'slug': 'drama', 'genre': 'Drama', 'books_count': 5},
+            {'id': self.poetry.pk, 'slug': 'poetry', 'genre': 'Poetry', 'books_count': 0},
+        ])
+        self.assertEqual(self.client.put(reverse('api:genres')).status_code, HTTPStatus.METHOD_NOT_ALLOWED)
+
+
+class UserGenresPageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='reader', password='testpass')
+        self.drama = Genres.objects.create(genre='Drama')
+        self.poetry = Genres.objects.create(genre='Poetry')
+        book = Book.objects.create(title='Mine', description='Desc', is_published=0, author=self.user)
+        book.genres.add(self.drama)
+        self.client.force_login(self.user)
+
+    def test_genres_are_computed_once_per_request(self):
+        url = reverse('user_books_by_tag', kwargs={'tag_slug': 'drama'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Mine')
+        self.assertEqual(response.context['title'], 'My books - Genre: Drama')
+        self.assertEqual(sum('user_books_count' in query['sql'] for query in queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('user_books'))
+        self.assertFalse(any('user_books_count' in query['sql'] for query in queries))
+
+    def test_unknown_genre_is_not_found(self):
+        self.client.get(reverse('user_books'))
+        # Session and user only: the genre is looked up in the cached genres of the user
+        for slug in ('unknown', 'poetry'):
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('user_books_by_tag', kwargs={'tag_slug': slug}))
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SLOW_REQUEST_MS=60000)
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='profiled', password='testpass')
+        self.book = Book.objects.create(title='Profiled', description='Desc', is_published=1, author=self.user)
+
+    def test_server_timing_matches_queries(self):
+        self.client.force_login(self.user)
+        url = reverse('book', kwargs={'book_slug': self.book.slug})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(queries)} queries"', timing)
+        self.assertIn('template;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                           'LOCATION': 'books_profiling_cache'}})
+    def test_route_histograms(self):
+        # The statistics need a cache shared by all processes
+        call_command('createcachetable', stdout=StringIO())
+        self.client.get(reverse('books'))
+        self.client.get(reverse('books'))
+        self.client.get('/no-such-page/')
+        stats = get_route_stats()
+        self.assertEqual(set(stats), {'books', 'unresolved'})
+        self.assertEqual(stats['books']['requests'], 2)
+        # The first request misses the page and the genre cloud, the second one hits the page
+        self.assertEqual((stats['books']['cache_hits'], stats['books']['cache_misses']), (1, 2))
+        self.assertEqual(sum(stats['books']['histogram'].values()), 2)
+
+        out = StringIO()
+        call_command('profile_stats', '--histogram', '--reset', stdout=out)
+        self.assertIn('books', out.getvalue())
+        self.assertEqual(get_route_stats(), {})
+
+    async def test_async_requests_stay_async(self):
+        # In debug mode loading the ASGI handler logs every middleware that needs a thread
+        with override_settings(DEBUG=True), self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+        async def view(request):
+            return TemplateResponse(request, 'books/feedback_success.html', {})
+        middleware = ProfilingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertTrue(iscoroutinefunction(middleware.process_template_response))
+        response = await middleware(RequestFactory().get('/'))
+        response = await middleware.process_template_response(None, response)
+        response.render()
+        self.assertIn('template;dur=', response['Server-Timing'])
+
+    def test_per_process_cache_is_not_recorded(self):
+        response = self.client.get(reverse('books'))
+        self.assertIn('Server-Timing', response)
+        self.assertEqual(get_route_stats(), {})
+        with self.assertRaisesMessage(CommandError, 'REDIS_URL'):
+            call_command('profile_stats', stdout=StringIO())
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.client.get(reverse('books'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(get_route_stats(), {})
+
+    @override_settings(PROFILING_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_queries(self):
+        with self.assertLogs('books.profiling', 'WARNING') as logs:
+            self.client.get(reverse('book', kwargs={'book_slug': self.book.slug}))
+        self.assertIn('Slow request GET', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class LoggingTestCase(TestCase):
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.lines = []
+
+        def emit(self, record):
+            self.lines.append(self.format(record))
+
+    def test_queue_handler_writes_json_lines(self):
+        target = self.ListHandler()
+        target.setFormatter(JsonFormatter())
+        handler = QueueListenerHandler([target])
+        logger = logging.getLogger('books.tests.queue')
+        logger.addHandler(handler)
+        logger.propagate = False
+        # Test runs only log warnings of the project's loggers
+        logger.setLevel(logging.INFO)
+        try:
+            logger.info("Book '%s' saved (id=%s)", 'Queued', 7, extra={'book_id': 7})
+            try:
+                raise ValueError('broken')
+            except ValueError:
+                logger.exception('Failed')
+        finally:
+            logger.setLevel(logging.NOTSET)
+            logger.removeHandler(handler)
+            handler.close()
+        first, second = [json.loads(line) for line in target.lines]
+        self.assertEqual((first['message'], first['book_id'], first['level']), ("Book 'Queued' saved (id=7)", 7, 'INFO'))
+        self.assertEqual(second['message'], 'Failed')
+        self.assertIn('ValueError: broken', second['exc_info'])
+
+    def test_saving_a_comment_does_not_load_related_rows(self):
+        user = get_user_model().objects.create_user(username='logger', password='testpass')
+        book = Book.objects.create(title='Logged', description='Desc', is_published=1, author=user)
+        with self.assertLogs('books.models', 'INFO') as logs, self.assertNumQueries(1):
+            Comment(book_id=book.pk, author_id=user.pk, content='Hi').save()
+        self.assertIn(f'Comment by user id={user.pk} on book id={book.pk}', logs.output[0])
+
+
+class PopularityTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='popular', password='testpass')
+        self.books = {title: Book.objects.create(title=title, description='Desc', is_published=1, author=self.user)
+                      for title in ('Old hit', 'Fresh', 'Quiet')}
+        self.draft = Book.objects.create(title='Hidden', description='Desc', is_published=0, author=self.user)
+        old = [Comment.objects.create(book=self.books['Old hit'], author=self.user, content=str(i)) for i in range(3)]
+        Comment.objects.filter(pk__in=[comment.pk for comment in old]).update(
+            created_at=timezone.now() - timedelta(days=10))
+        fresh = Comment.objects.create(book=self.books['Fresh'], author=self.user, content='New')
+        fresh.toggle_like(self.user)
+        Comment.objects.create(book=self.draft, author=self.user, content='Draft')
+
+    def ranking(self):
+        return list(Book.published.popular().values_list('title', flat=True))
+
+    def test_recent_activity_ranks_first(self):
+        self.assertEqual(refresh_popularity(), (3, 0))
+        self.assertEqual(self.ranking(), ['Fresh', 'Old hit'])
+        fresh = BookPopularity.objects.get(book=self.books['Fresh'])
+        self.assertEqual((fresh.comments_count, fresh.likes_count), (1, 1))
+
+    def test_incremental_refresh_only_recomputes_active_books(self):
+        two_hours_ago = timezone.now() - timedelta(hours=2)
+        Comment.objects.filter(created_at__gt=two_hours_ago).update(created_at=two_hours_ago)
+        LikedComment.objects.update(created_at=two_hours_ago)
+        refresh_popularity()
+        BookPopularity.objects.update(refreshed_at=timezone.now() - timedelta(hours=1))
+        Comment.objects.create(book=self.books['Quiet'], author=self.user, content='Finally')
+        Comment.objects.create(book=self.books['Quiet'], author=self.user, content='Again')
+        self.assertEqual(refresh_popularity(), (1, 0))
+        self.assertEqual(self.ranking(), ['Quiet', 'Fresh', 'Old hit'])
+        self.assertEqual(BookPopularity.objects.filter(refreshed_at__lt=timezone.now() - timedelta(minutes=30)).count(), 3)
+
+    def test_full_refresh_drops_inactive_books(self):
+        refresh_popularity()
+        Comment.objects.filter(book=self.books['Old hit']).update(created_at=timezone.now() - timedelta(days=60))
+        self.assertEqual(refresh_popularity(full=True), (2, 1))
+        self.assertEqual(self.ranking(), ['Fresh'])
+
+    def test_popular_pages(self):
+        self.client.get(reverse('popular_books'))
+        call_command('refresh_popularity', stdout=StringIO())
+        response = self.client.get(reverse('popular_books'))
+        self.assertEqual([book.title for book in response.context['books']], ['Fresh', 'Old hit'])
+        self.assertNotContains(response, 'Hidden')
+        home = self.client.get(reverse('home'))
+        self.assertContains(home, 'Popular now')
+        self.assertEqual([book.title for book in home.context['popular_books']], ['Fresh', 'Old hit'])
+
+    def test_popular_pages_follow_refreshes_of_the_worker(self):
+        home = self.client.get(reverse('home'))
+        popular = self.client.get(reverse('popular_books'))
+        # The worker's invalidation does not reach the web process (per-process cache)
+        with mock.patch('books.popularity.invalidate_namespaces'):
+            refresh_popularity()
+        response = self.client.get(reverse('popular_books'), HTTP_IF_NONE_MATCH=popular['ETag'])
+        self.assertEqual([book.title for book in response.context['books']], ['Fresh', 'Old hit'])
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=home['ETag'])
+        self.assertEqual([book.title for book in response.context['popular_books']], ['Fresh', 'Old hit'])
+
+
+class CommentThreadsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='threads', password='testpass')
+        self.book = Book.objects.create(title='Threads', description='Desc', is_published=1, author=self.user)
+        self.roots = [Comment.objects.create(book=self.book, author=self.user, content=f'Root {i}') for i in range(7)]
+
+    def reply(self, parent, content):
+        reply = Comment(author=self.user, content=content)
+        reply.reply_to(parent)
+        reply.save()
+        return reply
+
+    def test_reply_paths(self):
+        root = self.roots[0]
+        first = self.reply(root, 'First')
+        nested = self.reply(first, 'Nested')
+        self.assertEqual((first.thread_id, first.depth, first.path), (root.pk, 1, f'{root.pk:012d}/'))
+        self.assertEqual((nested.thread_id, nested.depth, nested.path),
+                         (root.pk, 2, f'{root.pk:012d}/{first.pk:012d}/'))
+        # A reply saved with only a parent id is placed in the tree too
+        direct = Comment.objects.create(book=self.book, author=self.user, content='Direct', parent_comment=nested)
+        self.assertEqual((direct.thread_id, direct.depth), (root.pk, 3))
+
+    def test_page_of_threads_is_one_query(self):
+        newest = self.roots[-1]
+        first = self.reply(newest, 'First')
+        second = self.reply(newest, 'Second')
+        nested = self.reply(first, 'Nested')
+        other = self.reply(self.roots[3], 'Other thread')
+        paginator = ThreadPaginator(self.book.comments.for_listing(self.user), per_page=5)
+        with self.assertNumQueries(1):
+            page = paginator.page()
+        self.assertEqual([comment.content for comment in page], [f'Root {i}' for i in range(6, 1, -1)])
+        self.assertEqual([reply.content for reply in page[0].replies], ['First', 'Nested', 'Second'])
+        self.assertEqual([reply.pk for reply in page[3].replies], [other.pk])
+        self.assertTrue(page.has_next())
+        self.assertEqual(paginator.count, 11)
+
+        last = paginator.page(page.next_cursor)
+        self.assertEqual([comment.content for comment in last], ['Root 1', 'Root 0'])
+        self.assertFalse(last.has_next())
+        back = paginator.page(last.previous_cursor)
+        self.assertEqual([comment.pk for comment in back], [comment.pk for comment in page])
+        self.assertEqual([reply.pk for reply in back[0].replies], [first.pk, nested.pk, second.pk])
+
+    def test_book_page_counts_comments_once(self):
+        self.reply(self.roots[0], 'Reply')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.book.get_absolute_url())
+        self.assertContains(response, 'Comments (8)')
+        # The aggregate of the page state gives the number
+        self.assertEqual(sum('COUNT(' in query['sql'].upper() for query in queries.captured_queries), 1)
+
+    def test_reply_endpoint(self):
+        root = self.roots[0]
+        url = reverse('reply_comment', kwargs={'comment_id': root.pk})
+        response = self.client.post(url, {'content': 'Anonymous'})
+        self.assertRedirects(response, f"{reverse('users:login')}?next={url}")
+
+        self.client.login(username='threads', password='testpass')
+        response = self.client.post(url, {'content': 'Signed in'})
+        reply = Comment.objects.get(content='Signed in')
+        self.assertRedirects(response, f'{self.book.get_absolute_url()}#comment-{reply.pk}')
+        self.assertEqual((reply.book_id, reply.parent_comment_id, reply.depth), (self.book.pk, root.pk, 1))
+
+        cursor = self.client.get(self.book.get_absolute_url()).context['comments_page'].next_cursor
+        response = self.client.get(self.book.get_absolute_url(), {'cursor': cursor})
+        self.assertContains(response, f'id="comment-{reply.pk}"')
+        self.assertContains(response, reverse('reply_comment', kwargs={'comment_id': reply.pk}))
+
+    @override_settings(COMMENT_MAX_DEPTH=2, COMMENT_MAX_REPLIES=2, COMMENT_MAX_THREAD_REPLIES=4)
+    def test_depth_and_fan_out_limits(self):
+        root = self.roots[0]
+        first = self.reply(root, 'First')
+        nested = self.reply(first, 'Nested')
+        self.assertFalse(nested.accepts_replies)
+        with self.assertRaisesMessage(ValidationError, 'nested more than 2 levels'):
+            self.reply(nested, 'Too deep')
+        self.reply(root, 'Second')
+        with self.assertRaisesMessage(ValidationError, 'more than 2 replies'):
+            self.reply(root, 'Third')
+        self.reply(first, 'Nested again')
+        with self.assertRaisesMessage(ValidationError, 'thread cannot have more than 4 replies'):
+            self.reply(self.roots[0].thread_replies.get(content='Second'), 'Too many')
+
+        self.client.login(username='threads', password='testpass')
+        # The book page is rendered again (not redirected to, which could be answered with 304)
+        cursor = self.client.get(self.book.get_absolute_url()).context['comments_page'].next_cursor
+        url = f"{reverse('reply_comment', kwargs={'comment_id': root.pk})}?cursor={cursor}"
+        response = self.client.post(url, {'content': 'Rejected'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.context['reply_error']['comment_id'], root.pk)
+        self.assertContains(response, 'more than 2 replies')
+        self.assertContains(response, '>Rejected</textarea>')
+        self.assertNotContains(self.client.get(self.book.get_absolute_url()), 'more than 2 replies')
+        response = self.client.post(reverse('api:comments', kwargs={'book_slug': self.book.slug}),
+                                    json.dumps({'content': 'Rejected', 'parent': nested.pk}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['parent'][0]['code'], 'max_depth')
+        self.assertFalse(Comment.objects.filter(content__in=['Rejected', 'Too deep', 'Third', 'Too many']).exists())
+
+    def test_deleting_a_comment_deletes_its_replies(self):
+        first = self.reply(self.roots[0], 'First')
+        self.reply(first, 'Nested')
+        self.client.login(username='threads', password='testpass')
+        self.client.post(reverse('delete_comment', kwargs={'comment_id': first.pk}))
+        self.assertEqual(self.roots[0].thread_replies.count(), 0)
+
+
+def reload_urlconf():
+    """
+    Rebuilds the routes after a change of the ASYNC_VIEWS setting.
+    """
+    import books.urls
+    import favouritebooks.urls
+    importlib.reload(books.urls)
+    importlib.reload(favouritebooks.urls)
+    clear_url_caches()
+
+
+@override_settings(ASYNC_VIEWS=True)
+class AsyncViewsTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        reload_urlconf()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        reload_urlconf()
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(username='async', password='testpass')
+        self.other = get_user_model().objects.create_user(username='other', password='testpass')
+        self.genre = Genres.objects.create(genre='Drama')
+        for i in range(6):
+            book = Book.objects.create(title=f'Async {i}', description='Desc', is_published=1, author=self.user)
+            book.genres.add(self.genre)
+        self.book = Book.objects.get(title='Async 0')
+        self.draft = Book.objects.create(title='Async draft', description='Desc', is_published=0, author=self.user)
+        self.comment = Comment.objects.create(book=self.book, author=self.other, content='Nice')
+
+    def test_routes_use_async_views(self):
+        from books import async_views
+        response = self.client.get(reverse('books'))
+        self.assertIsInstance(response.context['view'], async_views.AsyncAllPublishedBooks)
+
+    async def test_book_page(self):
+        url = reverse('book', kwargs={'book_slug': self.book.slug})
+        response = await self.async_client.get(url)
+        self.assertContains(response, 'Nice')
+        self.assertEqual(response.context['title'], 'Async 0')
+        revalidated = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(revalidated.status_code, HTTPStatus.NOT_MODIFIED)
+
+        draft_url = reverse('book', kwargs={'book_slug': self.draft.slug})
+        self.assertEqual((await self.async_client.get(draft_url)).status_code, HTTPStatus.NOT_FOUND)
+        await self.async_client.aforce_login(self.user)
+        self.assertEqual((await self.async_client.get(draft_url)).status_code, HTTPStatus.OK)
+
+    async def test_comment_is_posted_through_sync_view(self):
+        await self.async_client.aforce_login(self.other)
+        url = reverse('book', kwargs={'book_slug': self.book.slug})
+        response = await self.async_client.post(url, {'content': 'Posted'})
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+        self.assertTrue(await Comment.objects.filter(book=self.book, content='Posted').aexists())
+
+    async def test_listings_share_the_page_cache(self):
+        first = await self.async_client.get(reverse('books'))
+        self.assertEqual([book.title for book in first.context['books']], [f'Async {i}' for i in (5, 4, 3, 2)])
+        second = await self.async_client.get(reverse('books'), {'cursor': first.context['page_obj'].next_cursor})
+        self.assertEqual([book.title for book in second.context['books']], ['Async 1', 'Async 0'])
+        await self.async_client.get(reverse('books'))
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 2})
+
+        genre = await self.async_client.get(reverse('tag', kwargs={'tag_slug': 'drama'}))
+        self.assertEqual(genre.context['title'], 'Genre: Drama')
+        unknown = await self.async_client.get(reverse('tag', kwargs={'tag_slug': 'unknown'}))
+        self.assertEqual(unknown.status_code, HTTPStatus.NOT_FOUND)
+
+    async def test_like_toggle(self):
+        url = reverse('like_comment', kwargs={'comment_id': self.comment.pk})
+        self.assertEqual((await self.async_client.post(url)).status_code, HTTPStatus.FOUND)
+        await self.async_client.aforce_login(self.user)
+        self.assertEqual((await self.async_client.post(url)).json(), {'liked': True, 'likes_count': 1})
+        self.assertEqual((await self.async_client.post(url)).json(), {'liked': False, 'likes_count': 0})
+        missing = reverse('like_comment', kwargs={'comment_id': 0})
+        self.assertEqual((await self.async_client.post(missing)).status_code, HTTPStatus.NOT_FOUND)
+
+    async def test_async_cursor_page(self):
+        paginator = CursorPaginator(Book.published.all(), per_page=4)
+        page = await paginator.apage()
+        rest = await paginator.apage(page.next_cursor)
+        self.assertEqual([book.title for book in page] + [book.title for book in rest],
+                         [book.title async for book in Book.published.order_by('-time_create', '-id')])
+        self.assertFalse(rest.has_next())
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+    def test_reports_throughput(self):
+        out = StringIO()
+        url = self.live_server_url + reverse('books')
+        call_command('loadtest', url, '--requests', '10', '--concurrency', '3', stdout=out)
+        self.assertIn('Requests: 10, concurrency: 3, errors: 0', out.getvalue())
+        self.assertIn('req/s', out.getvalue())
+
+    def test_fails_on_server_errors(self):
+        with self.assertRaises(CommandError):
+            call_command('loadtest', 'http://127.0.0.1:1/', '--requests', '2', stdout=StringIO())
+
+
+class UnifyCommentLikesMigrationTestCase(TransactionTestCase):
+    """
+    Runs 0006_unify_comment_likes on likes stored in both the implicit table and LikedComment.
+    """
+    before = [('books', '0005_comment_likes_count')]
+    after = [('books', '0006_unify_comment_likes')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # Leave the schema at the latest migration for the next test cases
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_likes_count_includes_merged_likes(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('auth', 'User')
+        Book = apps.get_model('books', 'Book')
+        Comment = apps.get_model('books', 'Comment')
+        LikedComment = apps.get_model('books', 'LikedComment')
+        author, reader = User.objects.create(username='author'), User.objects.create(username='reader')
+        book = Book.objects.create(title='Old', slug='old', description='Desc', author_id=author.pk)
+        comment = Comment.objects.create(book=book, author_id=author.pk, content='Hi')
+        # Liked by both users in the implicit table, by the author once more and by the reader in LikedComment
+        Comment.likes.through.objects.create(comment_id=comment.pk, user_id=author.pk)
+        Comment.likes.through.objects.create(comment_id=comment.pk, user_id=reader.pk)
+        LikedComment.objects.create(comment_id=comment.pk, user_id=reader.pk)
+        other = Comment.objects.create(book=book, author_id=author.pk, content='Only here', likes_count=5)
+        LikedComment.objects.create(comment_id=other.pk, user_id=reader.pk)
+
+        apps = self.migrate(self.after)
+        Comment = apps.get_model('books', 'Comment')
+        self.assertEqual(dict(Comment.objects.values_list('content', 'likes_count')), {'Hi': 2, 'Only here': 1})
+        self.assertEqual(apps.get_model('books', 'LikedComment').objects.count(), 3)
@@ -0,0 +1,385 @@
+"""
+Bulk import and export of books as JSON Lines or CSV.
+
+Both directions stream: rows are read and written one at a time through generators and
+books are loaded and inserted in chunks, so memory use does not depend on the size of
+the file. Every row has the columns in `FIELDS`; `genres` is a list of genre slugs
+(`|`-separated in CSV), `author` a username and `image` a path relative to the images
+directory given to the import (the export writes the storage name, so the media root
+can be used as the images directory to copy books between sites).
+
+The import always creates new books. Slugs (given or generated from the title) get a
+numbered suffix when they are taken, the same way `Book.save()` does it, but resolved
+for a whole chunk with one query. Signals are not sent for bulk inserts, so the search
+vectors, genre counters and page caches are updated once per import instead.
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from books.caching import (BOOKS, GENRE_CLOUD, GENRES, TAGS, genre_namespace,
+                           invalidate_namespaces, user_namespace)
+from books.models import Book, Genres, make_excerpt
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('slug', 'title', 'description', 'is_published', 'author', 'genres', 'image', 'time_create')
+FORMATS = ('jsonl', 'csv')
+CSV_LIST_SEPARATOR = '|'
+
+# Usernames resolved to ids are cached up to this number, then the cache starts over
+AUTHOR_CACHE_SIZE = 10000
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'published'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'draft', ''}
+
+
+def detect_format(path):
+    """
+    Returns the file format implied by the extension of the path (ignoring `.gz`), or None.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    return None
+
+
+@contextmanager
+def open_text(path, mode):
+    """
+    Opens a text file for streaming ('-' is stdin/stdout, `.gz` files are compressed).
+    """
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    elif path.endswith('.gz'):
+        with gzip.open(path, mode + 't', encoding='utf-8', newline='') as file:
+            yield file
+    else:
+        with open(path, mode, encoding='utf-8', newline='') as file:
+            yield file
+
+
+def read_rows(file, file_format):
+    """
+    Yields `(line number, row)` for every row of a JSON Lines or CSV file. CSV rows are dicts,
+    JSON Lines rows are left undecoded so that `parse_row` can skip a malformed line.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(file, start=1):
+        if line.strip():
+            yield number, line
+
+
+def write_rows(rows, file, file_format):
+    """
+    Writes row dicts to a JSON Lines or CSV file. Returns the number of written rows.
+    """
+    written = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in rows:
+            row = dict(row, genres=CSV_LIST_SEPARATOR.join(row['genres']), is_published=int(row['is_published']))
+            writer.writerow(row)
+            written += 1
+        return written
+    for row in rows:
+        file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        written += 1
+    return written
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to `size` items of the iterable.
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    """
+    Yields an export row for every book of the queryset, reading the books in chunks.
+    """
+    if queryset is None:
+        queryset = Book.objects.all()
+    books = (queryset
+             .select_related('author')
+             .prefetch_related(Prefetch('genres', queryset=Genres.objects.only('id', 'slug').order_by('slug')))
+             .only('slug', 'title', 'description', 'is_published', 'image', 'time_create', 'author__username')
+             .order_by('pk'))
+    for book in books.iterator(chunk_size=chunk_size):
+        yield {
+            'slug': book.slug,
+            'title': book.title,
+            'description': book.description,
+            'is_published': bool(book.is_published),
+            'author': book.author.username if book.author else '',
+            'genres': [genre.slug for genre in book.genres.all()],
+            'image': book.image.name if book.image else '',
+            'time_create': book.time_create.isoformat() if book.time_create else '',
+        }
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return True
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f'invalid is_published value {value!r}')
+
+
+def parse_row(row):
+    """
+    Returns the cleaned values of an import row. Raises ValueError for invalid rows.
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError('a row must be an object')
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ValueError('title is required')
+    if len(title) > Book._meta.get_field('title').max_length:
+        raise ValueError('title is too long')
+
+    genres = row.get('genres') or []
+    if isinstance(genres, str):
+        genres = genres.split(CSV_LIST_SEPARATOR)
+    genres = list(dict.fromkeys(slug for slug in (slugify(genre) for genre in genres) if slug))
+
+    time_create = row.get('time_create') or None
+    if time_create:
+        time_create = parse_datetime(time_create)
+        if time_create is None:
+            raise ValueError(f"invalid time_create value {row['time_create']!r}")
+        if timezone.is_naive(time_create):
+            time_create = timezone.make_aware(time_create)
+
+    return {
+        'slug': slugify(row.get('slug') or ''),
+        'title': title,
+        'description': row.get('description') or '',
+        'is_published': _parse_bool(row.get('is_published')),
+        'author': (row.get('author') or '').strip(),
+        'genres': genres,
+        'image': (row.get('image') or '').strip(),
+        'time_create': time_create,
+    }
+
+
+class BookImporter:
+    """
+    Inserts parsed import rows chunk by chunk with `bulk_create`.
+    """
+    def __init__(self, chunk_size=1000, images_dir=None, default_author=None, create_genres=False):
+        self.chunk_size = chunk_size
+        self.images_dir = os.path.realpath(images_dir) if images_dir else None
+        self.default_author = default_author
+        self.create_genres = create_genres
+        self.image_field = Book._meta.get_field('image')
+        self.author_ids = {}
+        self.genre_ids = {}
+        self.touched_genres = set()
+        self.touched_authors = set()
+        self.stats = {'created': 0, 'skipped': 0, 'images': 0, 'missing_images': 0,
+                      'unknown_authors': 0, 'unknown_genres': 0}
+
+    def run(self, rows, progress=None):
+        """
+        Imports `(line number, row)` pairs and returns the import statistics.
+        `progress` is called with the statistics after every chunk.
+        """
+        started = time.perf_counter()
+        for chunk in chunked(self.parse(rows), self.chunk_size):
+            self.import_chunk(chunk)
+            self.stats['seconds'] = time.perf_counter() - started
+            if progress:
+                progress(self.stats)
+        self.finish()
+        self.stats['seconds'] = time.perf_counter() - started
+        return self.stats
+
+    def parse(self, rows):
+        """
+        Yields the cleaned rows, skipping (and logging) invalid ones.
+        """
+        for number, row in rows:
+            try:
+                yield parse_row(row)
+            except (ValueError, TypeError, AttributeError) as error:
+                self.stats['skipped'] += 1
+                logger.warning("Skipped import row %s: %s", number, error)
+
+    def import_chunk(self, records):
+        """
+        Creates the books of one chunk of cleaned rows together with their genres.
+        """
+        author_ids = self.resolve_authors(records)
+        genre_ids = self.resolve_genres(records)
+        books = [Book(title=record['title'],
+                      slug=record['slug'],
+                      description=record['description'],
+                      excerpt=make_excerpt(record['description']),
+                      is_published=record['is_published'],
+                      author_id=author_ids.get(record['author']),
+                      image=self.attach_image(record['image']))
+                 for record in records]
+
+        for attempt in range(1, Book.slug_save_attempts + 1):
+            self.assign_slugs(books, records)
+            try:
+                with transaction.atomic():
+                    self.insert(books, records, genre_ids)
+                break
+            except IntegrityError:
+                # Another process took one of the slugs in the meantime: pick them again
+                for book in books:
+                    book.pk = None
+                if attempt == Book.slug_save_attempts:
+                    raise
+
+        self.stats['created'] += len(books)
+        self.touched_authors.update(book.author_id for book in books if book.author_id)
+
+    def insert(self, books, records, genre_ids):
+        Book.objects.bulk_create(books)
+        if any(book.pk is None for book in books):
+            # Databases that do not return the ids of inserted rows
+            ids = dict(Book.objects.filter(slug__in=[book.slug for book in books]).values_list('slug', 'pk'))
+            for book in books:
+                book.pk = ids[book.slug]
+
+        through = []
+        for book, record in zip(books, records):
+            for slug in record['genres']:
+                if slug in genre_ids:
+                    through.append(Book.genres.through(book_id=book.pk, genres_id=genre_ids[slug]))
+        Book.genres.through.objects.bulk_create(through)
+
+        # `auto_now_add` overwrites the creation time on insert
+        dated = []
+        for book, record in zip(books, records):
+            if record['time_create']:
+                book.time_create = record['time_create']
+                dated.append(book)
+        if dated:
+            Book.objects.bulk_update(dated, ['time_create'])
+        Book.objects.filter(pk__in=[book.pk for book in books]).update_search_vector()
+
+    def resolve_authors(self, records):
+        """
+        Returns the user ids of the usernames of a chunk, loading unknown ones in one query.
+        """
+        usernames = {record['author'] or self.default_author for record in records} - {None, ''}
+        missing = usernames - self.author_ids.keys()
+        if missing:
+            if len(self.author_ids) > AUTHOR_CACHE_SIZE:
+                self.author_ids.clear()
+                missing = usernames
+            found = dict(get_user_model().objects.filter(username__in=missing).values_list('username', 'pk'))
+            for username in missing:
+                self.author_ids[username] = found.get(username)
+        author_ids = {}
+        for record in records:
+            username = record['author'] or self.default_author
+            if username:
+                author_ids[record['author']] = self.author_ids.get(username)
+                if author_ids[record['author']] is None:
+                    self.stats['unknown_authors'] += 1
+        return author_ids
+
+    def resolve_genres(self, records):
+        """
+        Returns the genre ids of the genre slugs of a chunk, loading (or creating) unknown ones at once.
+        """
+        slugs = {slug for record in records for slug in record['genres']}
+        missing = slugs - self.genre_ids.keys()
+        if missing:
+            self.genre_ids.update(Genres.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+            missing -= self.genre_ids.keys()
+        if missing and self.create_genres:
+            max_length = Genres._meta.get_field('genre').max_length
+            Genres.objects.bulk_create([Genres(genre=slug.replace('-', ' ').capitalize()[:max_length], slug=slug)
+                                        for slug in sorted(missing)], ignore_conflicts=True)
+            self.genre_ids.update(Genres.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+            logger.info("Created %s genres during book import", len(missing))
+            missing -= self.genre_ids.keys()
+        if missing:
+            self.stats['unknown_genres'] += sum(slug in missing for record in records for slug in record['genres'])
+        self.touched_genres.update(slugs - missing)
+        return {slug: self.genre_ids[slug] for slug in slugs - missing}
+
+    def assign_slugs(self, books, records):
+        """
+        Gives every book of a chunk a unique slug: one query finds the taken base slugs and
+        only bases that are taken (or repeated in the chunk) look up their numbered variants.
+        """
+        bases = [Book.slug_base(record['slug'] or record['title']) for record in records]
+        existing = set(Book.objects.filter(slug__in=set(bases)).values_list('slug', flat=True))
+        used = set()
+        variants = {}
+        for book, base in zip(books, bases):
+            if base not in existing and base not in used:
+                slug = base
+            else:
+                if base not in variants:
+                    variants[base] = Book.taken_slugs(base)
+                slug = Book.first_free_slug(base, variants[base] | used)
+            used.add(slug)
+            book.slug = slug
+
+    def attach_image(self, path):
+        """
+        Copies an image from the images directory to the media storage and returns its name.
+        """
+        if not path or not self.images_dir:
+            return None
+        source = os.path.realpath(os.path.join(self.images_dir, path))
+        if os.path.commonpath([self.images_dir, source]) != self.images_dir or not os.path.isfile(source):
+            self.stats['missing_images'] += 1
+            logger.warning("Image %r not found in %s", path, self.images_dir)
+            return None
+        with open(source, 'rb') as file:
+            name = self.image_field.storage.save(
+                self.image_field.generate_filename(None, os.path.basename(source)), File(file))
+        self.stats['images'] += 1
+        return name
+
+    def finish(self):
+        """
+        Updates the genre counters and invalidates the cached pages after the import.
+        """
+        if not self.stats['created']:
+            return
+        Genres.objects.filter(slug__in=self.touched_genres).refresh_books_count()
+        invalidate_namespaces(BOOKS, TAGS, GENRE_CLOUD, GENRES,
+                              *[genre_namespace(slug) for slug in self.touched_genres],
+                              *[user_namespace(author_id) for author_id in self.touched_authors])
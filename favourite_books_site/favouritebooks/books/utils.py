@@ -1,3 +1,8 @@
+from django.db.models import prefetch_related_objects
+
+from books.models import Book
+from books.pagination import CursorPaginator
+
 # Navigation bar structure for the site
 navbar = [{'title': "Home", 'url_name': 'home'},
         {'title': "All books", 'url_name': 'books'},
@@ -12,6 +17,9 @@ class DataMixin:
     """
     page_title = None
     paginate_by = 4
+    # 'offset' - numbered pages (?page=N), 'cursor' - keyset pages (?cursor=...)
+    pagination = 'offset'
+    cursor_ordering = ('-time_create', '-id')
     extra_context = {}
 
     def __init__(self):
@@ -27,4 +35,56 @@ class DataMixin:
         """
         context['navbar'] = navbar
         context.update(kwargs)
-        return context
\ No newline at end of file
+        return context
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates list views either by page number or by cursor, depending on `pagination`.
+        """
+        if self.pagination != 'cursor':
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, self.cursor_ordering)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class BookObjectMixin:
+    """
+    Mixin for views of a single book (detail, edit, delete).
+    Loads the book from the URL slug once per request, together with its author, and returns
+    the same object from every later `get_object` call (permission checks in dispatch, the view
+    itself, the template). Genres and image renditions are prefetched only when the page is rendered,
+    so refused requests don't pay for them.
+    """
+    model = Book
+    slug_url_kwarg = 'book_slug'
+    prefetch_book_related = ('genres', 'renditions')
+
+    def get_queryset(self):
+        """
+        Returns books with the author joined.
+        """
+        return Book.objects.select_related('author')
+
+    def get_object(self, queryset=None):
+        """
+        Returns the book of the current request, querying the database only on the first call.
+        """
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_book'):
+            self._book = super().get_object()
+        return self._book
+
+    def is_book_author(self, book):
+        """
+        Returns True if the current user is the author of the book (without loading the author).
+        """
+        return book.author_id is not None and book.author_id == self.request.user.pk
+
+    def get_context_data(self, **kwargs):
+        """
+        Prefetches the genres and image renditions of the book before the page (and its form) uses them.
+        """
+        prefetch_related_objects([self.object], *self.prefetch_book_related)
+        return super().get_context_data(**kwargs)
@@ -1,8 +1,12 @@
 import logging
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.exceptions import ValidationError
 from django.core.mail import EmailMessage
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Count, Max
 from django.http import (Http404, HttpResponseNotFound, HttpResponseRedirect,
                          JsonResponse)
 from django.shortcuts import get_object_or_404, redirect
@@ -12,38 +16,120 @@ from django.views import View
 from django.views.generic import (DeleteView, DetailView, FormView, ListView,
                                   TemplateView, UpdateView)
 
+from books.caching import (BOOKS, GENRE_CLOUD, GENRES, POPULAR, TAGS,
+                           AnonymousCacheMixin, ConditionalGetMixin,
+                           books_watermark, genre_namespace,
+                           get_request_user_genres, get_versions,
+                           user_namespace)
 from books.forms import AddBookForm, CommentCreateForm, FeedbackForm
 from books.models import Book, Comment, Genres
-from books.utils import DataMixin
-from favouritebooks import settings
+from books.pagination import ThreadPaginator
+from books.popularity import ranking_watermark
+from books.utils import BookObjectMixin, DataMixin
 
 logger = logging.getLogger(__name__)
 
 
-class BookMainPage(DataMixin, TemplateView):
+class RankingStateMixin:
+    """
+    Page state of the pages showing the popularity ranking: the ranking is refreshed by the
+    `refresh_popularity` worker, so its database watermark is added to the default state.
+    """
+    def get_page_state(self):
+        """
+        Returns the default page state with the watermark of the ranking.
+        """
+        state, last_modified = super().get_page_state()
+        return (state, ranking_watermark()), last_modified
+
+
+class BookMainPage(RankingStateMixin, ConditionalGetMixin, AnonymousCacheMixin, DataMixin, TemplateView):
     """
     View for the main page of the Favourite Books site.
     """
+    cache_namespaces = (BOOKS, POPULAR)
     template_name = 'books/index.html'
     page_title = 'Favourite Books'
+    popular_count = 4
+
+    def get_watermarked_books(self):
+        """
+        The page lists published books.
+        """
+        return Book.published.all()
+
+    def get_context_data(self, **kwargs):
+        """
+        Adds the most popular books (read from the popularity ranking).
+        """
+        context = super().get_context_data(**kwargs)
+        context['popular_books'] = Book.published.popular().for_listing()[:self.popular_count]
+        return context
 
 
-class AllPublishedBooks(DataMixin, ListView):
+class AllPublishedBooks(ConditionalGetMixin, AnonymousCacheMixin, DataMixin, ListView):
     """
     View to display all published books.
     """
+    cache_namespaces = (BOOKS, TAGS)
     template_name = 'books/books.html'
     context_object_name = 'books'
     page_title = 'All Books'
+    pagination = 'cursor'
+
+    def get_watermarked_books(self):
+        """
+        The page lists published books.
+        """
+        return Book.published.all()
 
     def get_queryset(self):
         """
         Returns queryset of all published books.
         """
-        return Book.objects.filter(is_published=1)
+        return Book.published.for_listing()
+
+
+class PopularBooks(RankingStateMixin, ConditionalGetMixin, AnonymousCacheMixin, DataMixin, ListView):
+    """
+    View to display the most popular published books, ranked by recent comments and likes.
+    """
+    cache_namespaces = (BOOKS, TAGS, POPULAR)
+    template_name = 'books/books.html'
+    context_object_name = 'books'
+    page_title = 'Popular Books'
+    paginate_by = None
+    popular_count = 20
+
+    def get_watermarked_books(self):
+        """
+        The page lists published books.
+        """
+        return Book.published.all()
+
+    def get_queryset(self):
+        """
+        Returns the top of the popularity ranking.
+        """
+        return Book.published.popular().for_listing()[:self.popular_count]
+
+
+class UserBookStateMixin:
+    """
+    Page state of the pages listing the current user's books: the last change and number
+    of their books (a deleted book lowers the number) and the versions of their genre lists.
+    """
+    def get_page_state(self):
+        """
+        Returns the state of the user's books and the time of the last change of one of them.
+        """
+        user = self.request.user
+        books = Book.objects.filter(author=user).aggregate(latest=Max('update_time'), total=Count('id'))
+        versions = get_versions(user_namespace(user.pk), GENRES)
+        return (books['latest'], books['total'], versions), books['latest']
 
 
-class UserBooks(LoginRequiredMixin, DataMixin, ListView):
+class UserBooks(LoginRequiredMixin, UserBookStateMixin, ConditionalGetMixin, DataMixin, ListView):
     """
     View to display books added by the current user.
     """
@@ -56,7 +142,7 @@ class UserBooks(LoginRequiredMixin, DataMixin, ListView):
         Returns queryset of books authored by the current user.
         """
         user = self.request.user
-        return Book.objects.filter(author=user)
+        return Book.objects.filter(author=user).for_listing()
 
 
 class AddBook(LoginRequiredMixin, DataMixin, FormView):
@@ -75,65 +161,66 @@ class AddBook(LoginRequiredMixin, DataMixin, FormView):
         new_book = form.save(commit=False)
         new_book.author = self.request.user
         form.save()
-        logger.info(f"Book '{new_book.title}' added by user {self.request.user}")
+        logger.info("Book '%s' added by user %s", new_book.title, self.request.user)
         return super().form_valid(form)
 
 
-class DetailedBookInfo(DataMixin, DetailView):
+class DetailedBookInfo(ConditionalGetMixin, BookObjectMixin, DataMixin, DetailView):
     """
     View to display detailed information about a book, including comments and comment form.
     """
     template_name = 'books/book_info.html'
-    slug_url_kwarg = 'book_slug'
     context_object_name = 'book'
     form_class = CommentCreateForm
 
+    def get_page_state(self):
+        """
+        Returns the state of the book, of its comments (a like also moves `updated_at`) and
+        of the genre names, and the time of the last change of the book or a comment.
+        """
+        book = self.get_object()
+        comments = book.comments.aggregate(latest=Max('updated_at'), total=Count('id'))
+        # Shown as the number of comments, so rendering the page does not count them again
+        self.comments_count = comments['total']
+        changes = [time for time in (book.update_time, comments['latest']) if time]
+        state = (book.pk, book.update_time, comments['latest'], comments['total'], get_versions(GENRES))
+        return state, max(changes)
+
     def get_context_data(self, **kwargs):
         """
-        Adds comments and comment form to the context.
+        Adds a page of comment threads and the comment form to the context.
         """
         context = super().get_context_data(**kwargs)
         context['form'] = self.form_class()
 
-        context['comments'] = self.object.comments.all()
-        paginator = Paginator(context['comments'], per_page=5)
-        page_number = self.request.GET.get('page')
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-        context['comments_page'] = page_obj
+        comments = self.object.comments.for_listing(self.request.user)
+        paginator = ThreadPaginator(comments, per_page=5, ordering=('-created_at', '-id'))
+        context['comments_page'] = paginator.page(self.request.GET.get('cursor'))
         context['paginator'] = paginator
+        if not hasattr(self, 'comments_count'):
+            # A form posted with errors: the page state was not computed
+            self.comments_count = self.object.comments.count()
+        context['comments_count'] = self.comments_count
         return self.get_mixin_context(context, title=context['book'].title)
 
-    # Return book's slug according to url (book/<slug:book_slug>/)
-    def get_object(self, queryset=None):
-        """
-        Returns the Book object based on the slug from the URL.
-        """
-        return get_object_or_404(Book, slug=self.kwargs[self.slug_url_kwarg])
-
     def post(self, request, *args, **kwargs):
         """
         Handles posting a new comment to the book. Requires authentication.
         """
         if not request.user.is_authenticated:
             return redirect('users:login')
+        self.object = self.get_object()
         form = self.form_class(request.POST)
         if form.is_valid():
-            book_slug = self.kwargs[self.slug_url_kwarg]
-            book = get_object_or_404(Book, slug=book_slug)
             comment = form.save(commit=False)
-            comment.book = book
+            comment.book = self.object
             comment.author = request.user
             comment.save()
-            logger.info(f"Comment added to book '{book.title}' by user {request.user}")
-            return HttpResponseRedirect(reverse_lazy('book', kwargs={'book_slug': book_slug}))
+            logger.info("Comment added to book '%s' by user %s", self.object.title, request.user)
+            return HttpResponseRedirect(self.object.get_absolute_url())
         else:
-            logger.warning(f"Invalid comment form submission by user {request.user}")
-            context = self.get_context_data()
+            logger.warning("Invalid comment form submission by user %s", request.user)
+            context = self.get_context_data(object=self.object)
             context['form'] = form
             return self.render_to_response(context)
 
@@ -142,8 +229,8 @@ class DetailedBookInfo(DataMixin, DetailView):
         Restricts access to unpublished books to the author only.
         """
         book = self.get_object()
-        if book.is_published != 1 and book.author != self.request.user:
-            logger.warning(f"Unauthorized access attempt to unpublished book '{book.title}' by user {self.request.user}")
+        if book.is_published != 1 and not self.is_book_author(book):
+            logger.warning("Unauthorized access attempt to unpublished book '%s' by user %s", book.title, self.request.user)
             raise Http404("Access denied")
         return super(DetailedBookInfo, self).dispatch(request, *args, **kwargs)
 
@@ -157,12 +244,14 @@ class DeleteCommentView(LoginRequiredMixin, UserPassesTestMixin, View):
         """
         comment = get_object_or_404(Comment, id=kwargs['comment_id'])
         if comment.author == request.user or request.user.is_staff:
-            logger.info(f"Comment (id={comment.id}) deleted by user {request.user}")
+            logger.info("Comment (id=%s) deleted by user %s", comment.id, request.user)
             comment.delete()
         else:
-            logger.warning(f"Unauthorized comment delete attempt by user {request.user}")
-        current_page_number = request.GET.get('page', 1)
-        redirect_url = f"{reverse_lazy('book', kwargs={'book_slug': comment.book.slug})}?page={current_page_number}"
+            logger.warning("Unauthorized comment delete attempt by user %s", request.user)
+        redirect_url = reverse_lazy('book', kwargs={'book_slug': comment.book.slug})
+        cursor = request.GET.get('cursor')
+        if cursor:
+            redirect_url = f"{redirect_url}?{urlencode({'cursor': cursor})}"
         return redirect(redirect_url)
 
     def test_func(self):
@@ -172,6 +261,50 @@ class DeleteCommentView(LoginRequiredMixin, UserPassesTestMixin, View):
         comment = get_object_or_404(Comment, id=self.kwargs['comment_id'])
         return self.request.user == comment.author or self.request.user.is_staff
 
+class ReplyCommentView(LoginRequiredMixin, View):
+    """
+    View to post a reply to a comment, within the depth and fan-out limits of its thread.
+    """
+    def post(self, request, *args, **kwargs):
+        """
+        Saves the reply and redirects back to the page of the thread, or renders that page
+        again with the error under the reply form.
+        """
+        parent = get_object_or_404(Comment.objects.select_related('book'), id=kwargs['comment_id'])
+        book = parent.book
+        if book.is_published != Book.Status.PUBLISHED and book.author_id != request.user.pk:
+            raise Http404("Access denied")
+
+        form = CommentCreateForm(request.POST)
+        if not form.is_valid():
+            return self.render_error(request, parent, 'The reply cannot be empty or longer than 500 characters.')
+        reply = form.save(commit=False)
+        reply.author = request.user
+        try:
+            reply.reply_to(parent)
+        except ValidationError as error:
+            logger.warning("Reply to comment id=%s by user %s rejected: %s", parent.id, request.user, error.message)
+            return self.render_error(request, parent, error.message)
+        reply.save()
+
+        redirect_url = reverse_lazy('book', kwargs={'book_slug': book.slug})
+        cursor = request.GET.get('cursor')
+        if cursor:
+            redirect_url = f"{redirect_url}?{urlencode({'cursor': cursor})}"
+        return redirect(f'{redirect_url}#comment-{reply.id}')
+
+    def render_error(self, request, parent, message):
+        """
+        Returns the book page (the same page of threads) with the error and the submitted text
+        under the reply form of the comment. A POST response is never answered with 304,
+        so the error is always shown.
+        """
+        view = DetailedBookInfo()
+        view.setup(request, book_slug=parent.book.slug)
+        view.object = view.get_object()
+        reply_error = {'comment_id': parent.id, 'message': message, 'content': request.POST.get('content', '')}
+        return view.render_to_response(view.get_context_data(object=view.object, reply_error=reply_error))
+
 @method_decorator(login_required, name='dispatch')
 class LikeCommentView(View):
     """
@@ -181,30 +314,22 @@ class LikeCommentView(View):
         """
         Handles the like/unlike logic for a comment.
         """
-        comment_id = kwargs.get('comment_id')
-        comment = get_object_or_404(Comment, id=comment_id)
-        user = request.user
-
-        if comment.likes.filter(id=user.id).exists():
-            comment.likes.remove(user)
-            liked = False
-        else:
-            comment.likes.add(user)
-            liked = True
+        comment = get_object_or_404(Comment.objects.only('id'), id=kwargs.get('comment_id'))
+        liked, likes_count = comment.toggle_like(request.user)
 
         return JsonResponse({
             'liked': liked,
-            'likes_count': comment.likes.count()
+            'likes_count': likes_count
         })
 
-class BookEdit(DataMixin, UpdateView):
+class BookEdit(BookObjectMixin, DataMixin, UpdateView):
     """
     View to handle editing a book by its author.
     """
-    model = Book
     form_class = AddBookForm
-    slug_url_kwarg = 'book_slug'
     template_name = 'books/edit_book.html'
+    # The form shows the genres, the page has no image
+    prefetch_book_related = ('genres',)
     success_url = reverse_lazy('edit_success')
 
     def get_context_data(self, **kwargs):
@@ -219,7 +344,7 @@ class BookEdit(DataMixin, UpdateView):
         Restricts editing to the book's author only.
         """
         book = self.get_object()
-        if book.author != self.request.user:
+        if not self.is_book_author(book):
             raise Http404("You are not allowed to edit this Book")
         return super(BookEdit, self).dispatch(request, *args, **kwargs)
 
@@ -232,13 +357,13 @@ class BookEditSuccess(DataMixin, TemplateView):
     page_title = 'Success'
 
 
-class BookDelete(DataMixin, DeleteView):
+class BookDelete(BookObjectMixin, DataMixin, DeleteView):
     """
     View to handle deleting a book by its author.
     """
-    model = Book
-    slug_url_kwarg = 'book_slug'
     template_name = 'books/delete_book.html'
+    # The confirmation page only shows the title
+    prefetch_book_related = ()
     success_url = reverse_lazy('books')
 
     def get_context_data(self, **kwargs):
@@ -253,7 +378,7 @@ class BookDelete(DataMixin, DeleteView):
         Restricts deletion to the book's author only.
         """
         book = self.get_object()
-        if book.author != self.request.user:
+        if not self.is_book_author(book):
             raise Http404("You are not allowed to delete this Book")
         return super(BookDelete, self).dispatch(request, *args, **kwargs)
 
@@ -269,12 +394,12 @@ class Feedback(LoginRequiredMixin, DataMixin, FormView):
 
     def form_valid(self, form):
         """
-        Sends feedback email to the site admin.
+        Queues feedback email to the site admin (delivered by the outbox sender).
         """
         user_email = form.cleaned_data.get('email')
         user_name = form.cleaned_data.get('name')
         user_message = form.cleaned_data.get('content')
-        logger.info(f"Feedback submitted by user {user_name} <{user_email}>")
+        logger.info("Feedback submitted by user %s <%s>", user_name, user_email)
         subject = f'Feedback from {user_email}'
         message = f'User name: {user_name}\nEmail: {user_email}\nMessage: {user_message}'
 
@@ -297,12 +422,25 @@ class FeedbackSuccess(DataMixin, TemplateView):
     page_title = 'Success'
 
 
-class BookGenres(DataMixin, ListView):
+class BookGenres(ConditionalGetMixin, AnonymousCacheMixin, DataMixin, ListView):
     """
     View to display books filtered by a specific genre.
     """
     template_name = 'books/books.html'
     context_object_name = 'books'
+    pagination = 'cursor'
+
+    def get_cache_namespaces(self):
+        """
+        Pages of a genre are dropped when that genre or the genre cloud changes.
+        """
+        return genre_namespace(self.kwargs['tag_slug']), TAGS
+
+    def get_watermarked_books(self):
+        """
+        The page lists the published books of the genre.
+        """
+        return Book.published.filter(genres__slug=self.kwargs['tag_slug'])
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -316,16 +454,63 @@ class BookGenres(DataMixin, ListView):
         """
         Returns queryset of published books filtered by genre.
         """
-        return Book.published.filter(genres__slug=self.kwargs['tag_slug']).prefetch_related('genres')
+        return Book.published.filter(genres__slug=self.kwargs['tag_slug']).for_listing()
+
+
+class SearchBooks(ConditionalGetMixin, DataMixin, ListView):
+    """
+    View to search published books by title, genres and description, best matches first.
+    """
+    template_name = 'books/books.html'
+    context_object_name = 'books'
+
+    def get_page_state(self):
+        """
+        Results change with the published books, their genres (counts) and the genre names.
+        """
+        return (books_watermark(Book.published.all()), get_versions(BOOKS, GENRE_CLOUD, GENRES)), None
+
+    def get_queryset(self):
+        """
+        Returns published books matching the `q` parameter (no books for an empty query).
+        """
+        query = self.request.GET.get('q', '').strip()
+        if not query:
+            return Book.published.none()
+        return Book.published.search(query).for_listing()
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """
+        Adds the search query to the context.
+        """
+        context = super().get_context_data(**kwargs)
+        context['search_query'] = self.request.GET.get('q', '').strip()
+        return self.get_mixin_context(context, title=f"Search: {context['search_query']}")
 
 
-class UserBooksByGenres(LoginRequiredMixin, DataMixin, ListView):
+class UserBooksByGenres(LoginRequiredMixin, UserBookStateMixin, ConditionalGetMixin, DataMixin, ListView):
     """
     View to display user's books filtered by a specific genre.
     """
     template_name = 'books/user_books.html'
     context_object_name = 'books'
 
+    def get_genre(self):
+        """
+        Returns the selected genre from the user's genres, 404 if none of their books has it.
+        """
+        for tag in get_request_user_genres(self.request):
+            if tag.slug == self.kwargs['tag_slug']:
+                return tag
+        raise Http404('No genre found')
+
+    def get_page_state(self):
+        """
+        Answers an unknown genre with 404 before the user's books are queried.
+        """
+        self.get_genre()
+        return super().get_page_state()
+
     def get_queryset(self):
         """
         Returns queryset of user's books filtered by genre.
@@ -333,17 +518,14 @@ class UserBooksByGenres(LoginRequiredMixin, DataMixin, ListView):
         user = self.request.user
         genre_slug = self.kwargs.get('tag_slug')
         # Filter books by user and selected genre
-        return Book.objects.filter(author=user, genres__slug=genre_slug)
+        return Book.objects.filter(author=user, genres__slug=genre_slug).for_listing()
 
     def get_context_data(self, **kwargs):
         """
         Adds context for the user's books by genre page.
         """
         context = super().get_context_data(**kwargs)
-        context['tags'] = Genres.objects.filter(
-            id__in=Book.objects.filter(author=self.request.user).values_list('genres', flat=True)).distinct()
-        tag = Genres.objects.get(slug=self.kwargs['tag_slug'])
-        return self.get_mixin_context(context, title='My books - Genre: ' + tag.genre)
+        return self.get_mixin_context(context, title='My books - Genre: ' + self.get_genre().genre)
 
 
 def page_not_found(request, exception):
@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,6 +56,39 @@ if ENABLE_DEBUG_TOOLBAR:
 
 ROOT_URLCONF = 'favouritebooks.urls'
 
+# Log records are queued by the request threads and written as JSON lines to the console
+# by a background thread (books.log); LOG_LEVEL is the level of the project's loggers.
+# Test runs only write the warnings of the project's loggers and no 4xx responses of
+# django.request (the tests ask for them), so that the records do not hide test failures.
+TESTING = sys.argv[1:2] == ['test']
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING' if TESTING else 'INFO')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {
+            '()': 'books.log.JsonFormatter',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+        'queue': {
+            'class': 'books.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console'],
+        },
+    },
+    'loggers': {
+        'books': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+        'users': {'handlers': ['queue'], 'level': LOG_LEVEL, 'propagate': False},
+    },
+    'root': {'handlers': ['queue'], 'level': 'WARNING'},
+}
+if TESTING:
+    LOGGING['loggers']['django.request'] = {'level': 'ERROR'}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -76,6 +110,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'favouritebooks.wsgi.application'
 
+# Route the busiest pages (book, all books, genre pages, comment likes) to their async
+# versions; only useful when the site is served by an ASGI server (SERVER_MODE=asgi)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', False) == 'True'
+
 
 DATABASES = {
     'default': {
@@ -88,6 +126,61 @@ DATABASES = {
     }
 }
 
+# Pool of database connections shared by the threads of a worker (psycopg_pool),
+# recommended with ASGI where every request may run in a different thread
+if os.getenv('DB_POOL', False) == 'True':
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {'min_size': 2, 'max_size': int(os.getenv('DB_POOL_MAX_SIZE', 10))},
+    }
+
+
+# Cache (Redis when REDIS_URL is set, otherwise local memory)
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'favouritebooks',
+        }
+    }
+
+# Lifetime (seconds) of the cached public pages served to anonymous visitors
+PAGE_CACHE_TIMEOUT = int(os.getenv('PAGE_CACHE_TIMEOUT', 60 * 15))
+
+# Request profiler (books.profiling): share of requests whose SQL, template and cache work
+# is recorded and added to the per-route histograms, whether those requests get a
+# Server-Timing header, and the duration above which a request is logged as slow
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0.01))
+PROFILING_SERVER_TIMING = os.getenv('PROFILING_SERVER_TIMING', 'True') == 'True'
+PROFILING_SLOW_REQUEST_MS = int(os.getenv('PROFILING_SLOW_REQUEST_MS', 1000))
+
+# Popularity ranking (books.popularity): comments and likes lose half of their weight every
+# POPULARITY_HALF_LIFE_HOURS and are not counted after POPULARITY_WINDOW_DAYS
+POPULARITY_HALF_LIFE_HOURS = float(os.getenv('POPULARITY_HALF_LIFE_HOURS', 72))
+POPULARITY_WINDOW_DAYS = int(os.getenv('POPULARITY_WINDOW_DAYS', 30))
+
+# Comment threads: levels of replies, direct replies per comment and replies per thread,
+# which bound the size of a page of threads on the book page
+COMMENT_MAX_DEPTH = int(os.getenv('COMMENT_MAX_DEPTH', 4))
+COMMENT_MAX_REPLIES = int(os.getenv('COMMENT_MAX_REPLIES', 20))
+COMMENT_MAX_THREAD_REPLIES = int(os.getenv('COMMENT_MAX_THREAD_REPLIES', 100))
+
+# Part of the ETag of every page: set it to the release (e.g. the git tag) so that
+# pages revalidated after a deploy are rendered again with the new templates
+PAGE_ETAG_SALT = os.getenv('PAGE_ETAG_SALT', '')
+
+# Resized book image renditions: built by a background thread pool,
+# or in the calling thread when IMAGE_RENDITIONS_SYNC is True
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+IMAGE_RENDITIONS_SYNC = os.getenv('IMAGE_RENDITIONS_SYNC', False) == 'True'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -131,12 +224,18 @@ LOGIN_URL = 'users:login'
 
 
 # SMTP Email Protocol
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued in the outbox and delivered by `python manage.py send_outbox`
+EMAIL_BACKEND = 'books.outbox.OutboxEmailBackend'
+OUTBOX_DELIVERY_BACKEND = os.getenv('OUTBOX_DELIVERY_BACKEND') or 'django.core.mail.backends.smtp.EmailBackend'
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))
+# Seconds before the first retry, doubled after every failed attempt
+OUTBOX_RETRY_DELAY = int(os.getenv('OUTBOX_RETRY_DELAY', 60))
 EMAIL_HOST = os.getenv('EMAIL_HOST') or 'smtp.gmail.com'
 EMAIL_PORT = os.getenv('EMAIL_PORT') or 587
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
-EMAIL_USE_TLS = True
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_USE_SSL = False
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
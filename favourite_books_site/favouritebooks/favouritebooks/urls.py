@@ -9,6 +9,7 @@ from favouritebooks import settings
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('books.urls')),
+    path('api/', include('books.api_urls', namespace='api')),
     path('users/', include('users.urls', namespace='users')),
     path('social-auth/', include('social_django.urls', namespace='social')),
     path('captcha/', include('captcha.urls')),
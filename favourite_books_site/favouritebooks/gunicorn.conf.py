@@ -0,0 +1,35 @@
+"""
+Gunicorn settings, read from the working directory by `gunicorn` without arguments.
+
+SERVER_MODE=wsgi (default) runs the WSGI application in threaded sync workers.
+SERVER_MODE=asgi runs the ASGI application in uvicorn workers; set ASYNC_VIEWS=True
+as well so that the busiest pages are served by their async views, and DB_POOL=True
+so that the threads of a worker share a pool of database connections.
+
+Several workers need a cache they all share (REDIS_URL): with the local-memory cache a
+change saved by one worker would not invalidate the pages cached by the others.
+"""
+import multiprocessing
+import os
+
+server_mode = os.getenv('SERVER_MODE', 'wsgi')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+
+if workers > 1 and not os.getenv('REDIS_URL'):
+    raise RuntimeError(f'{workers} gunicorn workers need a shared cache: set REDIS_URL (or GUNICORN_WORKERS=1)')
+
+if server_mode == 'asgi':
+    wsgi_app = 'favouritebooks.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'favouritebooks.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('GUNICORN_THREADS', 4))
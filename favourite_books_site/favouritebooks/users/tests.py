@@ -1,10 +1,13 @@
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core import mail
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.test import Client
 
+from books.models import OutboxEmail
+
 
 class RegisterUserTestCase(TestCase):
 
@@ -133,6 +136,14 @@ class UsersFlowsTestCase(TestCase):
         response = self.client.post(reverse('users:password_reset'), {'email': 'test@example.com'})
         self.assertEqual(response.status_code, 302)
 
+    @override_settings(EMAIL_BACKEND='books.outbox.OutboxEmailBackend')
+    def test_password_reset_email_is_queued(self):
+        response = self.client.post(reverse('users:password_reset'), {'email': 'test@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, ['test@example.com'])
+
     def test_password_reset_done_page(self):
         response = self.client.get(reverse('users:password_reset_done'))
         self.assertEqual(response.status_code, 200)